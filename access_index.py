@@ -0,0 +1,197 @@
+import threading
+from typing import Optional, Dict, Any, Callable, List, Set, Tuple
+from sqlalchemy import select, func
+from db_defs import Transponder, TransponderToRoom, AccessChangeLog
+
+# Tabellen, deren Änderungen den Zugangsindex betreffen können
+ACCESS_TABLES = ("transponder", "transponder_to_room", "person", "room")
+
+class RoomAccessIndex:
+    """
+    Vorberechneter Index "wer kann welchen Raum öffnen".
+
+    Grundlage sind alle aktiven Transponder (Besitzer gesetzt, kein
+    Rückgabedatum) und ihre Raumzuordnungen. Der Index wird beim ersten
+    Zugriff aufgebaut und danach nur für geänderte Transponder
+    aktualisiert. Welche das sind, steht im von Triggern gefüllten
+    access_change_log; der Index merkt sich die zuletzt verarbeitete seq.
+    So kommen auch Commits anderer Prozesse an, und jede Abfrage holt
+    vorher den Rückstand nach.
+
+    Aufbau und Aktualisierung laufen nacheinander unter _sync_lock, Leser
+    warten nur auf das Veröffentlichen unter _lock.
+    """
+
+    def __init__(self, session_factory: Callable[[], Any]):
+        self.session_factory = session_factory
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._built = False
+        # Wird von invalidate() erhöht; ein laufender Neuaufbau, der eine
+        # Invalidierung verpasst hat, veröffentlicht nicht und beginnt neu
+        self._generation = 0
+        # Höchste bereits eingearbeitete seq aus access_change_log
+        self._last_seq = 0
+        # transponder_id -> (owner_id, serial_number, room_ids)
+        self._transponders: Dict[int, Tuple[Optional[int], Optional[str], frozenset]] = {}
+        # room_id -> person_id -> {transponder_id}
+        self._by_room: Dict[int, Dict[int, Set[int]]] = {}
+        # person_id -> room_id -> {transponder_id}
+        self._by_person: Dict[int, Dict[int, Set[int]]] = {}
+
+    def _load_transponders(self, session, transponder_ids: Optional[Set[int]] = None) -> Dict[int, Tuple[Optional[int], Optional[str], frozenset]]:
+        stmt = select(
+            Transponder.id, Transponder.owner_id, Transponder.serial_number, Transponder.return_date
+        )
+        link_stmt = select(TransponderToRoom.transponder_id, TransponderToRoom.room_id)
+        if transponder_ids is not None:
+            stmt = stmt.where(Transponder.id.in_(transponder_ids))
+            link_stmt = link_stmt.where(TransponderToRoom.transponder_id.in_(transponder_ids))
+
+        rooms: Dict[int, Set[int]] = {}
+        for transponder_id, room_id in session.execute(link_stmt):
+            if room_id is not None:
+                rooms.setdefault(transponder_id, set()).add(room_id)
+
+        result = {}
+        for transponder_id, owner_id, serial_number, return_date in session.execute(stmt):
+            active_owner = owner_id if return_date is None else None
+            result[transponder_id] = (
+                active_owner,
+                serial_number,
+                frozenset(rooms.get(transponder_id, ())),
+            )
+        return result
+
+    def _remove(self, transponder_id: int) -> None:
+        entry = self._transponders.pop(transponder_id, None)
+        if entry is None:
+            return
+        owner_id, _, room_ids = entry
+        if owner_id is None:
+            return
+        for room_id in room_ids:
+            persons = self._by_room.get(room_id)
+            if persons and owner_id in persons:
+                persons[owner_id].discard(transponder_id)
+                if not persons[owner_id]:
+                    del persons[owner_id]
+                if not persons:
+                    del self._by_room[room_id]
+            rooms = self._by_person.get(owner_id)
+            if rooms and room_id in rooms:
+                rooms[room_id].discard(transponder_id)
+                if not rooms[room_id]:
+                    del rooms[room_id]
+                if not rooms:
+                    del self._by_person[owner_id]
+
+    def _add(self, transponder_id: int, owner_id: Optional[int], serial_number: Optional[str], room_ids: frozenset) -> None:
+        self._transponders[transponder_id] = (owner_id, serial_number, room_ids)
+        if owner_id is None:
+            return
+        for room_id in room_ids:
+            self._by_room.setdefault(room_id, {}).setdefault(owner_id, set()).add(transponder_id)
+            self._by_person.setdefault(owner_id, {}).setdefault(room_id, set()).add(transponder_id)
+
+    def rebuild(self) -> None:
+        with self._sync_lock:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        while True:
+            with self._lock:
+                generation = self._generation
+            session = self.session_factory()
+            try:
+                # Erst die seq, dann die Daten: die Daten sind damit
+                # mindestens so neu wie die seq, spätere Änderungen holt
+                # der nächste sync() über das Protokoll nach
+                last_seq = session.execute(select(func.max(AccessChangeLog.seq))).scalar() or 0
+                loaded = self._load_transponders(session)
+            finally:
+                session.close()
+            with self._lock:
+                if self._generation != generation:
+                    continue
+                self._transponders.clear()
+                self._by_room.clear()
+                self._by_person.clear()
+                for transponder_id, (owner_id, serial_number, room_ids) in loaded.items():
+                    self._add(transponder_id, owner_id, serial_number, room_ids)
+                self._last_seq = last_seq
+                self._built = True
+                return
+
+    def sync(self) -> None:
+        """Arbeitet alle seit dem letzten Aufruf protokollierten Änderungen ein, aus allen Prozessen."""
+        with self._sync_lock:
+            if not self._built:
+                self._rebuild()
+                return
+            session = self.session_factory()
+            try:
+                rows = session.execute(
+                    select(AccessChangeLog.seq, AccessChangeLog.transponder_id)
+                    .where(AccessChangeLog.seq > self._last_seq)
+                    .order_by(AccessChangeLog.seq)
+                ).all()
+                # seq ist lückenlos (AUTOINCREMENT, ein Schreiber); fehlt der
+                # Anschluss, wurde das Protokoll schon weiter gekürzt
+                gap = bool(rows) and rows[0][0] > self._last_seq + 1
+                transponder_ids = {t for _, t in rows}
+                loaded = self._load_transponders(session, transponder_ids) if rows and not gap else {}
+            finally:
+                session.close()
+            if not rows:
+                return
+            if gap:
+                self._rebuild()
+                return
+            with self._lock:
+                if not self._built:
+                    return
+                for transponder_id in transponder_ids:
+                    self._remove(transponder_id)
+                for transponder_id, (owner_id, serial_number, room_ids) in loaded.items():
+                    self._add(transponder_id, owner_id, serial_number, room_ids)
+                self._last_seq = rows[-1][0]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._built = False
+
+    def on_commit(self, changes: Dict[str, Optional[Set[Any]]]) -> None:
+        # Die IDs selbst stehen im Protokoll; der Listener sorgt nur dafür,
+        # dass eigene Commits sofort und nicht erst bei der nächsten Abfrage
+        # eingearbeitet werden
+        if self._built and any(t in changes for t in ACCESS_TABLES):
+            self.sync()
+
+    def _ensure_built(self) -> None:
+        self.sync()
+
+    def _transponder_info(self, transponder_ids: Set[int]) -> List[Dict[str, Any]]:
+        return [
+            {"id": t, "serial_number": self._transponders[t][1]}
+            for t in sorted(transponder_ids) if t in self._transponders
+        ]
+
+    def persons_for_room(self, room_id: int) -> List[Dict[str, Any]]:
+        self._ensure_built()
+        with self._lock:
+            persons = self._by_room.get(room_id, {})
+            return [
+                {"person_id": person_id, "transponders": self._transponder_info(t_ids)}
+                for person_id, t_ids in persons.items()
+            ]
+
+    def rooms_for_person(self, person_id: int) -> List[Dict[str, Any]]:
+        self._ensure_built()
+        with self._lock:
+            rooms = self._by_person.get(person_id, {})
+            return [
+                {"room_id": room_id, "transponders": self._transponder_info(t_ids)}
+                for room_id, t_ids in rooms.items()
+            ]
@@ -5,8 +5,8 @@ import shutil
 import os
 import subprocess
 from datetime import date
-from copy import deepcopy
 import csv
+import json
 
 try:
     import venv
@@ -43,13 +43,12 @@ def restart_with_venv():
         sys.exit(1)
 
 try:
-    from flask import Flask, request, redirect, url_for, render_template_string, jsonify, send_from_directory, render_template, abort, send_file, flash
-    from sqlalchemy import create_engine, inspect
-    from sqlalchemy.orm import sessionmaker, joinedload, Session
+    from flask import Flask, request, redirect, url_for, render_template_string, jsonify, send_from_directory, render_template, abort, send_file, flash, Response, stream_with_context
+    from sqlalchemy import create_engine, inspect, update, delete, or_
+    from sqlalchemy.orm import sessionmaker, joinedload, selectinload, Session
     from sqlalchemy.exc import SQLAlchemyError
     from db_defs import *
     from pypdf import PdfReader, PdfWriter
-    from pypdf.generic import NameObject
     import io
     from markupsafe import escape
     import html
@@ -59,6 +58,28 @@ try:
     import datetime
 
     from db_interface import *
+    from change_tracking import register_commit_listener, record_change, record_delete, VersionedCache
+    from serializers import ModelSerializer, serializer_for
+    from access_index import RoomAccessIndex
+    from change_feed import ChangeFeed
+    from floor_layouts import (
+        resolve_building, parse_layout_data, load_floor_layout, save_floor_layout, LayoutValidationError,
+        rooms_at_point, rooms_in_box, overlapping_rooms
+    )
+    from floor_tiles import load_manifest, tile_directory
+    from wizards import compile_wizards, column_converter, WizardValidationError
+    from write_queue import WriteCoordinator, WRITE_MAX_BATCH, WRITE_MAX_WAIT
+    from custody import (
+        CUSTODY_SOURCE_KEY, CUSTODY_FIELDS, custody_event_row, record_custody_events, custody_history, holder_at,
+        custody_at, create_snapshot, find_transponder_ids_by_serial, snapshot_commit_listener
+    )
+    from pdf_forms import filled_pdf_cache, fill_pdf_forms_parallel, merge_pdfs, stream_zip, safe_filename, template_registry
+    from pdf_signing import get_signer
+    from pdf_jobs import pdf_job_queue, QueueFullError, JOB_DONE
+    from reports import (
+        inventory_rollup, parse_rollup_dimensions, parse_rollup_filters, outstanding_report, floor_occupancy,
+        ROLLUP_DIMENSIONS, ROLLUP_LABELS
+    )
 except ModuleNotFoundError:
     if not VENV_PATH.exists():
         create_and_setup_venv()
@@ -76,9 +97,24 @@ except ModuleNotFoundError:
         sys.exit(0)
 
 app = Flask(__name__)
-engine = create_engine("sqlite:///database.db")
-Base.metadata.create_all(engine)
+# Wird für flash() benötigt; ohne feste Konfiguration gilt der Schlüssel nur bis zum Neustart
+app.secret_key = os.environ.get("VERWALTUNG_SECRET_KEY") or os.urandom(32)
+DATABASE_URL = "sqlite:///database.db"
+engine = create_engine(DATABASE_URL)
+ensure_schema(engine)
 Session = sessionmaker(bind=engine)
+# Schreibende Routen reichen ihre Änderungen an den Schreib-Thread weiter
+write_coordinator = WriteCoordinator(DATABASE_URL, max_batch=WRITE_MAX_BATCH, max_wait=WRITE_MAX_WAIT)
+
+access_index = RoomAccessIndex(Session)
+register_commit_listener(access_index.on_commit)
+register_commit_listener(snapshot_commit_listener(Session))
+change_feed = ChangeFeed()
+register_commit_listener(change_feed.on_commit)
+
+SCHLIESSMEDIEN_TEMPLATE = "pdfs/ausgabe_schliessmedien.pdf"
+template_registry.preload(SCHLIESSMEDIEN_TEMPLATE)
+pdf_job_queue.start()
 
 COLUMN_LABELS = {
     "abteilung.abteilungsleiter_id": "Abteilungsleiter",
@@ -96,8 +132,8 @@ WIZARDS["transponder"] = {
     "title": "Transponder erstellen",
     "model": Transponder,
     "fields": [
-        {"name": "issuer_id", "type": "number", "label": "Ausgeber-ID", "required": True},
-        {"name": "owner_id", "type": "number", "label": "Besitzer-ID"},
+        {"name": "issuer_id", "type": "person", "label": "Ausgeber", "required": True},
+        {"name": "owner_id", "type": "person", "label": "Besitzer"},
         {"name": "serial_number", "type": "text", "label": "Seriennummer"},
         {"name": "got_date", "type": "date", "label": "Ausgabedatum"},
     ],
@@ -111,9 +147,13 @@ WIZARDS["transponder"] = {
                 {"name": "room_id", "type": "number", "label": "Raum-ID"},
             ]
         }
-    ]
+    ],
+    # Einfügemodus: eine Zeile pro Transponder, Ausgeber/Besitzer aus dem Formular
+    "paste_columns": ["serial_number", "got_date", "room_links.room_id"],
 }
 
+COMPILED_WIZARDS = compile_wizards(WIZARDS)
+
 HANDLER_MAP = {
     "person": PersonWithContactHandler,
     "abteilung": AbteilungHandler,
@@ -347,7 +387,7 @@ def get_model_class_by_tablename(table_name):
 def get_relevant_columns(cls):
     try:
         inspector = inspect(cls)
-        return [c for c in inspector.columns if not c.primary_key and c.name not in ("created_at", "updated_at")]
+        return [c for c in inspector.columns if not c.primary_key and c.name not in ("created_at", "updated_at", "name_search", "name_search_first", "version")]
     except Exception as e:
         app.logger.error(f"Fehler beim Inspektieren der Spalten für Klasse {cls}: {e}")
         return []
@@ -430,6 +470,50 @@ def get_column_label(table_name, column_name):
         app.logger.error(f"Fehler beim Abrufen des Labels für {table_name}.{column_name}: {e}")
         return column_name
 
+def render_row_inputs(row, columns, fk_options, table_name):
+    """Rendert die Eingabefelder einer Tabellenzeile: (row_id, [(html, label)], fehlende Optionen)."""
+    row_inputs = []
+    has_missing_inputs = False
+    try:
+        row_id = getattr(row, "id", None)
+        if row_id is None:
+            first_col_name = columns[0].name if columns else None
+            row_id = getattr(row, first_col_name, None) if first_col_name else None
+    except Exception as e:
+        app.logger.error(f"Fehler beim Zugriff auf ID der Zeile: {e}")
+        row_id = None
+
+    for col in columns:
+        col_name = col.name
+        if col_name == "return":
+            col_name = "return_"
+
+        try:
+            value = getattr(row, col_name)
+        except AttributeError:
+            value = None
+        except Exception as e:
+            app.logger.error(f"Fehler beim Zugriff auf Spalte {col_name} der Tabelle {table_name}: {e}")
+            value = None
+
+        label = get_column_label(table_name, col.name)
+        try:
+            input_html, valid = generate_input_field(
+                col,
+                value,
+                row_id=row_id,
+                fk_options=fk_options,
+                table_name=table_name
+            )
+            if not valid:
+                has_missing_inputs = True
+        except Exception as e:
+            app.logger.error(f"Fehler bei der Generierung des Input-Felds für {col.name}: {e}")
+            input_html = '<input value="Error">'
+
+        row_inputs.append((input_html, label))
+    return row_id, row_inputs, has_missing_inputs
+
 def prepare_table_data(session, cls, table_name):
     columns = get_relevant_columns(cls)
     fk_columns = get_foreign_key_columns(columns)
@@ -443,52 +527,15 @@ def prepare_table_data(session, cls, table_name):
 
     row_html = []
     row_ids = []
+    row_versions = []
     table_has_missing_inputs = False
 
     for row in rows:
-        row_inputs = []
-        try:
-            row_id = getattr(row, "id", None)
-            if row_id is None:
-                first_col_name = columns[0].name if columns else None
-                row_id = getattr(row, first_col_name, None) if first_col_name else None
-        except Exception as e:
-            app.logger.error(f"Fehler beim Zugriff auf ID der Zeile: {e}")
-            row_id = None
-
+        row_id, row_inputs, missing = render_row_inputs(row, columns, fk_options, table_name)
         row_ids.append(row_id)
-
-        for col in columns:
-            col_name = col.name
-            if col_name == "return":
-                col_name = "return_"
-
-            try:
-                value = getattr(row, col_name)
-            except AttributeError:
-                value = None
-            except Exception as e:
-                app.logger.error(f"Fehler beim Zugriff auf Spalte {col_name} der Tabelle {table_name}: {e}")
-                value = None
-
-            label = get_column_label(table_name, col.name)
-            try:
-                input_html, valid = generate_input_field(
-                    col,
-                    value,
-                    row_id=row_id,
-                    fk_options=fk_options,
-                    table_name=table_name
-                )
-                if not valid:
-                    table_has_missing_inputs = True
-            except Exception as e:
-                app.logger.error(f"Fehler bei der Generierung des Input-Felds für {col.name}: {e}")
-                input_html = '<input value="Error">'
-                valid = True
-
-            row_inputs.append((input_html, label))
+        row_versions.append(getattr(row, "version", None))
         row_html.append(row_inputs)
+        table_has_missing_inputs = table_has_missing_inputs or missing
 
     new_entry_inputs = []
     for col in columns:
@@ -508,7 +555,7 @@ def prepare_table_data(session, cls, table_name):
 
     column_labels = [get_column_label(table_name, col.name) for col in columns]
 
-    return column_labels, row_html, new_entry_inputs, row_ids, table_has_missing_inputs
+    return column_labels, row_html, new_entry_inputs, row_ids, row_versions, table_has_missing_inputs
 
 def load_static_file(path):
     try:
@@ -525,11 +572,11 @@ def table_view(table_name):
     if cls is None:
         abort(404, description="Tabelle nicht gefunden")
 
-    column_labels, row_html, new_entry_inputs, row_ids, table_has_missing_inputs = prepare_table_data(session, cls, table_name)
+    column_labels, row_html, new_entry_inputs, row_ids, row_versions, table_has_missing_inputs = prepare_table_data(session, cls, table_name)
 
     javascript_code = load_static_file("static/table_scripts.js").replace("{{ table_name }}", table_name)
 
-    row_data = list(zip(row_html, row_ids))
+    row_data = list(zip(row_html, row_ids, row_versions))
 
     missing_data_messages = []
     if table_has_missing_inputs:
@@ -548,15 +595,103 @@ def table_view(table_name):
         missing_data_messages=missing_data_messages
     )
 
+# Live-Aktualisierung offener Tabellenansichten (Server-Sent Events). Jede
+# Nachricht enthält die geänderten Zeilen fertig gerendert sowie die IDs
+# gelöschter Zeilen; bei unbekannten Änderungen kommt der ganze Inhalt
+# ("complete"), und der Client entfernt alles, was nicht mehr dabei ist.
+
+TABLE_FEED_HEARTBEAT = 15
+
+_fk_options_caches = {}
+
+def cached_fk_options(session, table_name, fk_columns):
+    """FK-Auswahllisten, zwischengespeichert bis sich eine der Zieltabellen ändert."""
+    cache = _fk_options_caches.get(table_name)
+    if cache is None:
+        ref_tables = tuple(sorted({fk.column.table.name for fk in fk_columns.values()}))
+        cache = _fk_options_caches.setdefault(table_name, VersionedCache(ref_tables, max_entries=1))
+    return cache.get_or_compute(table_name, lambda: get_fk_options(session, fk_columns))
+
+def table_change_payload(session, cls, table_name, ids):
+    columns = get_relevant_columns(cls)
+    fk_options = cached_fk_options(session, table_name, get_foreign_key_columns(columns))
+    serializer = serializer_for(cls, iso_dates=True)
+
+    query = session.query(cls)
+    if ids is not None:
+        query = query.filter(cls.id.in_(ids))
+
+    rows = []
+    found = set()
+    for row in query.all():
+        row_id, inputs, _ = render_row_inputs(row, columns, fk_options, table_name)
+        found.add(row_id)
+        rows.append({
+            "id": row_id,
+            "version": getattr(row, "version", None),
+            "values": serializer(row),
+            "cells": [input_html for input_html, _ in inputs],
+        })
+
+    payload = {"table": table_name, "rows": rows, "complete": ids is None}
+    if ids is not None:
+        payload["deleted"] = sorted(set(ids) - found)
+    return payload
+
+@app.route("/table/<table_name>/events")
+def table_events(table_name):
+    cls = get_model_class_by_tablename(table_name)
+    if cls is None:
+        abort(404, description="Tabelle nicht gefunden")
+
+    # Nach einem Verbindungsabbruch schickt der Browser die letzte Event-ID
+    # mit; hat sich seitdem etwas geändert, wird einmal komplett abgeglichen
+    last_event_id = request.headers.get("Last-Event-ID")
+    subscription = change_feed.subscribe(table_name)
+    resync = last_event_id is not None and last_event_id != str(subscription.last_sequence)
+
+    def generate():
+        try:
+            yield f"retry: 3000\nid: {subscription.last_sequence}\n\n"
+            pending = {"ids": None, "sequence": subscription.last_sequence} if resync else None
+            while True:
+                if pending is None:
+                    pending = subscription.wait(TABLE_FEED_HEARTBEAT)
+                if pending is None:
+                    yield ": ping\n\n"
+                    continue
+                session = Session()
+                try:
+                    payload = table_change_payload(session, cls, table_name, pending["ids"])
+                except Exception as e:
+                    app.logger.error(f"Fehler beim Laden der Änderungen für {table_name}: {e}")
+                    payload = None
+                finally:
+                    session.close()
+                if payload is not None:
+                    yield f"id: {pending['sequence']}\nevent: change\ndata: {json.dumps(payload, default=str)}\n\n"
+                pending = None
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/add/<table_name>", methods=["POST"])
 def add_entry(table_name):
-    session = Session()
     cls = next((c for c in Base.__subclasses__() if c.__tablename__ == table_name), None)
     if not cls:
         return jsonify(success=False, error="Tabelle nicht gefunden")
-    try:
+    if getattr(cls, "__append_only__", False):
+        return jsonify(success=False, error="Tabelle ist schreibgeschützt")
+
+    def insert_row(session):
+        session.info[CUSTODY_SOURCE_KEY] = "tabelle"
         obj = cls()
-        for key, val in request.form.items():
+        for key, val in request_values:
             _, _, field = key.partition(f"{table_name}_new_")
             if not hasattr(obj, field):
                 continue
@@ -571,289 +706,802 @@ def add_entry(table_name):
             else:
                 setattr(obj, field, val)
         session.add(obj)
-        session.commit()
+        session.flush()
+
+    # Das Formular wird hier ausgelesen, da der Schreib-Thread keinen Request-Kontext hat
+    request_values = list(request.form.items())
+    try:
+        write_coordinator.run(insert_row)
         return jsonify(success=True)
     except Exception as e:
-        session.rollback()
         return jsonify(success=False, error=str(e))
 
+# Zellenänderungen der Tabellenansicht laufen als einzelnes
+# UPDATE ... RETURNING direkt auf der Tabelle, ohne das Objekt vorher zu
+# laden. Tabellen mit Spalte "version" werden optimistisch gesperrt: der
+# Client schickt die gelesene Version mit, und passt sie nicht mehr, gibt es
+# einen Konflikt statt eines stillen Überschreibens.
+
+def update_cell(session, cls, row_id: int, column, value, expected_version: int = None):
+    """
+    Schreibt einen Zellenwert und gibt die geänderte Zeile zurück, oder None,
+    wenn keine Zeile (mit passender Version) getroffen wurde. Abgeleitete
+    Daten (Suchschlüssel, Besitzhistorie) werden in derselben Transaktion
+    nachgezogen.
+    """
+    table = cls.__table__
+    values = {column.name: value}
+    stmt = update(table).where(table.c.id == row_id)
+    if "version" in table.c:
+        values["version"] = table.c.version + 1
+        if expected_version is not None:
+            stmt = stmt.where(table.c.version == expected_version)
+
+    connection = session.connection()
+    row = connection.execute(stmt.values(values).returning(*table.c)).mappings().first()
+    if row is None:
+        return None
+
+    if cls is Person and column.name in ("first_name", "last_name"):
+        connection.execute(
+            update(table).where(table.c.id == row_id).values(**person_search_keys(row["first_name"], row["last_name"]))
+        )
+    if cls is Transponder and column.name in CUSTODY_FIELDS:
+        record_custody_events(session, [custody_event_row(
+            row["id"], row["serial_number"], row["owner_id"], row["got_date"], row["return_date"], "tabelle"
+        )])
+    record_change(session, table.name, row_id)
+    return row
+
 @app.route("/update/<table_name>", methods=["POST"])
 def update_entry(table_name):
-    session = Session()
     cls = next((c for c in Base.__subclasses__() if c.__tablename__ == table_name), None)
     if not cls:
         return jsonify(success=False, error="Tabelle nicht gefunden")
+    if getattr(cls, "__append_only__", False):
+        return jsonify(success=False, error="Tabelle ist schreibgeschützt")
+
+    name = request.form.get("name") or ""
+    value = request.form.get("value")
+    prefix = f"{table_name}_"
+    if not name.startswith(prefix):
+        return jsonify(success=False, error="Ungültiger Feldname")
+    parts = name[len(prefix):].split("_", 1)
+    if len(parts) != 2:
+        return jsonify(success=False, error="Ungültiger Feldname")
+    row_id_str, field = parts
+    column = next((c for c in get_relevant_columns(cls) if c.name == field), None)
+    if column is None:
+        return jsonify(success=False, error="Ungültiger Feldname")
     try:
-        name = request.form.get("name")
-        value = request.form.get("value")
-        prefix = f"{table_name}_"
-        if not name.startswith(prefix):
-            return jsonify(success=False, error="Ungültiger Feldname")
-        parts = name[len(prefix):].split("_", 1)
-        if len(parts) != 2:
-            return jsonify(success=False, error="Ungültiger Feldname")
-        row_id_str, field = parts
         row_id = int(row_id_str)
-        obj = session.query(cls).get(row_id)
-        if not obj:
-            return jsonify(success=False, error="Datensatz nicht gefunden")
+        expected_version = request.form.get("version")
+        expected_version = int(expected_version) if expected_version not in (None, "") else None
+        value = None if value in (None, "") else column_converter(column)(value)
+    except ValueError:
+        return jsonify(success=False, error=f"Ungültiger Wert: {value}")
+
+    def write_cell(session):
+        row = update_cell(session, cls, row_id, column, value, expected_version)
+        if row is not None:
+            return "ok", row.get("version")
+        # Keine Zeile getroffen: gelöscht oder Version veraltet
+        table = cls.__table__
+        current = session.execute(select(table.c.get("version", table.c.id)).where(table.c.id == row_id)).scalar()
+        return ("missing", None) if current is None else ("conflict", current)
 
-        col_type = getattr(cls, field).property.columns[0].type
-        if value == "":
-            setattr(obj, field, None)
-        elif isinstance(col_type, Date):
-            setattr(obj, field, datetime.datetime.strptime(value, "%Y-%m-%d").date())
-        elif isinstance(col_type, DateTime):
-            setattr(obj, field, datetime.datetime.fromisoformat(value))
-        else:
-            setattr(obj, field, value)
-        session.commit()
-        return jsonify(success=True)
-    except Exception as e:
-        session.rollback()
+    try:
+        status, version = write_coordinator.run(write_cell)
+    except SQLAlchemyError as e:
         return jsonify(success=False, error=str(e))
+    if status == "missing":
+        return jsonify(success=False, error="Datensatz nicht gefunden"), 404
+    if status == "conflict":
+        return jsonify(
+            success=False, conflict=True, version=version,
+            error="Der Datensatz wurde inzwischen geändert. Bitte die Seite neu laden."
+        ), 409
+    return jsonify(success=True, version=version)
+
+# Gelöscht wird mit einem einzigen DELETE ... RETURNING; abhängige Zeilen
+# entfernt bzw. entkoppelt die Datenbank selbst über ON DELETE CASCADE/SET
+# NULL, statt dass das ORM jede Kind-Sammlung lädt und einzeln löscht.
+DELETE_BULK_MAX_IDS = 1000
+
+def delete_rows(session, cls, ids) -> list:
+    table = cls.__table__
+    connection = session.connection()
+    # ON DELETE SET NULL nimmt Personen ihre Transponder weg; das gehört
+    # in die Besitzhistorie, also vorher feststellen, wer was hält
+    held = []
+    if cls is Person:
+        held = connection.execute(
+            select(Transponder.id, Transponder.serial_number, Transponder.owner_id)
+            .where(Transponder.owner_id.in_(ids), Transponder.return_date.is_(None))
+        ).all()
+
+    # ON DELETE SET NULL ändert die verweisenden Zeilen in der Datenbank;
+    # deren Version wird vorher hochgezählt, damit offene Bearbeitungen
+    # dieser Zeilen als Konflikt erkannt werden
+    for other in Base.metadata.sorted_tables:
+        if "version" not in other.c:
+            continue
+        columns = [
+            fk.parent for fk in other.foreign_keys
+            if fk.column.table is table and (fk.ondelete or "").upper() == "SET NULL"
+        ]
+        if columns:
+            connection.execute(
+                update(other)
+                .where(or_(*(column.in_(ids) for column in columns)))
+                .values(version=other.c.version + 1)
+            )
+
+    deleted = connection.execute(
+        delete(table).where(table.c.id.in_(ids)).returning(table.c.id)
+    ).scalars().all()
+    if deleted:
+        record_delete(session, table, deleted)
+        removed = set(deleted)
+        record_custody_events(session, [
+            custody_event_row(transponder_id, serial_number, None, None, None, "loeschung")
+            for transponder_id, serial_number, owner_id in held if owner_id in removed
+        ])
+    return deleted
 
 @app.route("/delete/<table_name>", methods=["POST"])
 def delete_entry(table_name):
-    session = Session()
     cls = next((c for c in Base.__subclasses__() if c.__tablename__ == table_name), None)
     if not cls:
         return jsonify(success=False, error="Tabelle nicht gefunden")
+    if getattr(cls, "__append_only__", False):
+        return jsonify(success=False, error="Tabelle ist schreibgeschützt")
 
-    try:
-        json_data = request.get_json()
-
-        if not json_data or "id" not in json_data:
-            return jsonify(success=False, error="Keine ID angegeben")
+    json_data = request.get_json(silent=True)
+    if not json_data or "id" not in json_data:
+        return jsonify(success=False, error="Keine ID angegeben")
 
-        row_id = json_data["id"]
-        if not isinstance(row_id, int):
-            try:
-                row_id = int(row_id)
-            except ValueError:
-                return jsonify(success=False, error="Ungültige ID")
+    row_id = json_data["id"]
+    if not isinstance(row_id, int):
+        try:
+            row_id = int(row_id)
+        except (TypeError, ValueError):
+            return jsonify(success=False, error="Ungültige ID")
 
-        obj = session.query(cls).get(row_id)
-        if not obj:
+    try:
+        if not write_coordinator.run(delete_rows, cls, [row_id]):
             return jsonify(success=False, error="Datensatz nicht gefunden")
-
-        session.delete(obj)
-        session.commit()
         return jsonify(success=True)
-
     except Exception as e:
-        session.rollback()
         return jsonify(success=False, error=str(e))
 
+@app.route("/delete/<table_name>/bulk", methods=["POST"])
+def delete_entries_bulk(table_name):
+    cls = next((c for c in Base.__subclasses__() if c.__tablename__ == table_name), None)
+    if not cls:
+        return jsonify(success=False, error="Tabelle nicht gefunden"), 404
+    if getattr(cls, "__append_only__", False):
+        return jsonify(success=False, error="Tabelle ist schreibgeschützt"), 400
+
+    payload = request.get_json(silent=True) or {}
+    raw_ids = payload.get("ids")
+    if not isinstance(raw_ids, list) or not raw_ids:
+        return jsonify(success=False, error="ids muss eine nicht-leere Liste sein"), 400
+    if len(raw_ids) > DELETE_BULK_MAX_IDS:
+        return jsonify(success=False, error=f"Maximal {DELETE_BULK_MAX_IDS} IDs pro Auftrag"), 400
+    try:
+        ids = sorted({int(i) for i in raw_ids})
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="Ungültige ids"), 400
+
+    try:
+        deleted = write_coordinator.run(delete_rows, cls, ids)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Sammel-Löschen aus {table_name}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+
+    missing = sorted(set(ids) - set(deleted))
+    return jsonify(success=not missing, deleted=sorted(deleted), missing=missing)
+
 
 @app.route("/aggregate/")
 def aggregate_index():
     return render_template("aggregate_index.html")  # Optional – nur als Startseite für Aggregates
 
 
-@app.route("/aggregate/transponder")
-def aggregate_transponder_view():
-    session = Session()
+AGGREGATE_CHUNK_SIZE = 100
+AGGREGATE_MAX_CHUNK_SIZE = 1000
 
-    # Filter aus Query-Params
-    show_only_unreturned = request.args.get("unreturned") == "1"
-    owner_filter = request.args.get("owner", "").strip()
-    issuer_filter = request.args.get("issuer", "").strip()
+def parse_aggregate_filters(args) -> dict:
+    return {
+        "unreturned": args.get("unreturned") == "1",
+        "owner": args.get("owner", type=int),
+        "issuer": args.get("issuer", type=int),
+    }
 
-    try:
-        query = session.query(Transponder) \
-            .options(
-                joinedload(Transponder.owner),
-                joinedload(Transponder.issuer),
-                joinedload(Transponder.room_links).joinedload(TransponderToRoom.room).joinedload(Room.building)
-            )
+def transponder_aggregate_query(session, filters):
+    query = session.query(Transponder) \
+        .options(
+            joinedload(Transponder.owner),
+            joinedload(Transponder.issuer),
+            joinedload(Transponder.room_links).joinedload(TransponderToRoom.room).joinedload(Room.building)
+        )
 
-        # Filter nur nicht zurückgegebene
-        if show_only_unreturned:
-            query = query.filter(Transponder.return_date.is_(None))
+    # Filter nur nicht zurückgegebene
+    if filters["unreturned"]:
+        query = query.filter(Transponder.return_date.is_(None))
+
+    # Filter für owner (besitzer), Auswahl über die Personensuche
+    if filters["owner"]:
+        query = query.filter(Transponder.owner_id == filters["owner"])
+
+    # Filter für issuer (ausgeber)
+    if filters["issuer"]:
+        query = query.filter(Transponder.issuer_id == filters["issuer"])
+
+    return query.order_by(Transponder.id)
+
+def transponder_aggregate_row(t) -> list:
+    owner = t.owner
+    issuer = t.issuer
+    rooms = [link.room for link in t.room_links if link.room]
+    buildings = list({r.building.name if r.building else "?" for r in rooms})
+    pdf_url = url_for(
+        "generate_pdf",
+        issuer_id=issuer.id if issuer else "",
+        owner_id=owner.id if owner else "",
+        transponder_id=t.id
+    )
 
-        # Filter für owner (besitzer)
-        if owner_filter:
-            # Hier gehen wir davon aus, dass owner_filter eine Teilstring-Suche auf Vor- oder Nachname erlaubt
-            query = query.join(Transponder.owner).filter(
-                (Transponder.owner.first_name.ilike(f"%{owner_filter}%")) |
-                (Transponder.owner.last_name.ilike(f"%{owner_filter}%"))
-            )
+    return [
+        str(t.id),
+        t.serial_number or "-",
+        f"{owner.first_name} {owner.last_name}" if owner else "Unbekannt",
+        f"{issuer.first_name} {issuer.last_name}" if issuer else "Unbekannt",
+        t.got_date.isoformat() if t.got_date else "-",
+        t.return_date.isoformat() if t.return_date else "Nicht zurückgegeben",
+        ", ".join(sorted(buildings)) if buildings else "-",
+        ", ".join(sorted(set(f"{r.name} ({r.floor}.OG)" for r in rooms))) if rooms else "-",
+        t.comment or "-",
+        f"<a href='{html.escape(pdf_url)}'><img src='/static/pdf.svg' height=32 width=32></a>",
+    ]
 
-        # Filter für issuer (ausgeber)
-        if issuer_filter:
-            query = query.join(Transponder.issuer).filter(
-                (Transponder.issuer.first_name.ilike(f"%{issuer_filter}%")) |
-                (Transponder.issuer.last_name.ilike(f"%{issuer_filter}%"))
-            )
+def inventory_aggregate_query(session, filters):
+    # Grundquery mit Joins
+    query = session.query(Inventory) \
+        .options(
+            joinedload(Inventory.owner),
+            joinedload(Inventory.issuer),
+            joinedload(Inventory.object).joinedload(Object.category),
+            joinedload(Inventory.kostenstelle),
+            joinedload(Inventory.abteilung),
+            joinedload(Inventory.professorship),
+            joinedload(Inventory.room)
+        )
 
-        transponder_list = query.all()
+    # Filter anwenden
+    if filters["unreturned"]:
+        query = query.filter(Inventory.return_date.is_(None))
+
+    if filters["owner"]:
+        query = query.filter(Inventory.owner_id == filters["owner"])
+
+    if filters["issuer"]:
+        query = query.filter(Inventory.issuer_id == filters["issuer"])
+
+    return query.order_by(Inventory.id)
+
+def inventory_aggregate_row(inv) -> list:
+    def person_name(p):
+        if p:
+            return f"{p.first_name} {p.last_name}"
+        return "Unbekannt"
+
+    def name_or_dash(obj):
+        return obj.name if obj else "-"
+
+    def room_name(r):
+        if r:
+            floor_str = f"{r.floor}.OG" if r.floor is not None else "?"
+            return f"{r.name} ({floor_str})"
+        return "-"
+
+    return [
+        str(inv.id),
+        inv.serial_number or "-",
+        inv.object.name if inv.object else "-",
+        name_or_dash(inv.object.category) if inv.object else "-",
+        inv.anlagennummer or "-",
+        person_name(inv.owner),
+        person_name(inv.issuer),
+        inv.got_date.isoformat() if inv.got_date else "-",
+        inv.return_date.isoformat() if inv.return_date else "Nicht zurückgegeben",
+        room_name(inv.room),
+        name_or_dash(inv.abteilung),
+        name_or_dash(inv.professorship),
+        name_or_dash(inv.kostenstelle),
+        f"{inv.price:.2f} €" if inv.price is not None else "-",
+        inv.comment or "-",
+    ]
 
-        rows = []
-        for t in transponder_list:
-            owner = t.owner
-            issuer = t.issuer
-            rooms = [link.room for link in t.room_links if link.room]
-            buildings = list({r.building.name if r.building else "?" for r in rooms})
-
-            row = {
-                "ID": t.id,
-                "Seriennummer": t.serial_number or "-",
-                "Ausgegeben an": f"{owner.first_name} {owner.last_name}" if owner else "Unbekannt",
-                "Ausgegeben durch": f"{issuer.first_name} {issuer.last_name}" if issuer else "Unbekannt",
-                "Ausgabedatum": t.got_date.isoformat() if t.got_date else "-",
-                "Rückgabedatum": t.return_date.isoformat() if t.return_date else "Nicht zurückgegeben",
-                "Gebäude": ", ".join(sorted(buildings)) if buildings else "-",
-                "Räume": ", ".join(sorted(set(f"{r.name} ({r.floor}.OG)" for r in rooms))) if rooms else "-",
-                "Kommentar": t.comment or "-",
-            }
-            rows.append(row)
-
-        column_labels = list(rows[0].keys()) if rows else []
-        column_labels.append("PDF")
-
-
-        row_data = [
-            [html.escape(str(row[col])) for col in column_labels if col != "PDF"] +
-            [f"<a href='http://localhost:5000/generate_pdf/schliessmedien/?issuer_id={issuer.id if issuer else ''}&owner_id={owner.id if owner else ''}&transponder_id={t.id}'><img src='../static/pdf.svg' height=32 width=32></a>"]
-            for t, row, owner, issuer in [(t, row, t.owner, t.issuer) for t, row in zip(transponder_list, rows)]
-        ]
+# Aggregatsansichten: Spalten, Query und Zeilenformatierung. Spalten in
+# "html_columns" enthalten fertiges HTML und werden nicht escaped.
+AGGREGATES = {
+    "transponder": {
+        "title": "Ausgegebene Transponder",
+        "view": "aggregate_transponder_view",
+        "columns": [
+            "ID", "Seriennummer", "Ausgegeben an", "Ausgegeben durch", "Ausgabedatum",
+            "Rückgabedatum", "Gebäude", "Räume", "Kommentar", "PDF"
+        ],
+        "html_columns": [9],
+        "query": transponder_aggregate_query,
+        "row": transponder_aggregate_row,
+    },
+    "inventory": {
+        "title": "Inventarübersicht",
+        "view": "aggregate_inventory_view",
+        "columns": [
+            "ID", "Seriennummer", "Objekt", "Kategorie", "Anlagennummer", "Ausgegeben an",
+            "Ausgegeben durch", "Ausgabedatum", "Rückgabedatum", "Raum", "Abteilung",
+            "Professur", "Kostenstelle", "Preis", "Kommentar"
+        ],
+        "html_columns": [],
+        "query": inventory_aggregate_query,
+        "row": inventory_aggregate_row,
+    },
+}
 
+def load_aggregate_chunk(session, name, filters, offset, limit):
+    aggregate = AGGREGATES[name]
+    query = aggregate["query"](session, filters)
+    total = query.order_by(None).count()
+    items = query.offset(offset).limit(limit).all()
+    return total, [aggregate["row"](item) for item in items]
 
-        # Filter-Dict zum dynamischen Befüllen des Formulars und Anzeige des Status
-        filters = {
-            "Nur nicht zurückgegebene anzeigen": show_only_unreturned,
-            "Besitzer (Ausgegeben an)": owner_filter,
-            "Ausgeber (Ausgegeben durch)": issuer_filter
-        }
+def render_aggregate_view(name):
+    aggregate = AGGREGATES[name]
+    session = Session()
+    try:
+        filters = parse_aggregate_filters(request.args)
+        total, rows = load_aggregate_chunk(session, name, filters, 0, AGGREGATE_CHUNK_SIZE)
+
+        # Für die Filter nur die Namen der aktuell gewählten Personen laden,
+        # die Auswahl selbst läuft über /api/persons/suggest
+        person_labels = get_person_labels(session, [filters["owner"], filters["issuer"]])
+
+        rows_url = url_for(
+            "api_aggregate_rows",
+            name=name,
+            unreturned="1" if filters["unreturned"] else None,
+            owner=filters["owner"],
+            issuer=filters["issuer"]
+        )
 
         return render_template(
             "aggregate_view.html",
-            title="Ausgegebene Transponder",
-            column_labels=column_labels,
-            row_data=row_data,
+            title=aggregate["title"],
+            column_labels=aggregate["columns"],
+            html_columns=aggregate["html_columns"],
+            initial_rows=rows,
+            total_rows=total,
+            chunk_size=AGGREGATE_CHUNK_SIZE,
+            rows_url=rows_url,
             filters=filters,
-            # toggle_url nicht mehr hart codiert, hier auf Basis aktueller Filter mit geändertem "unreturned"
-            toggle_url=url_for(
-                "aggregate_transponder_view",
-                unreturned="0" if show_only_unreturned else "1",
-                owner=owner_filter,
-                issuer=issuer_filter
-            )
+            filter_labels={
+                "owner": person_labels.get(filters["owner"], ""),
+                "issuer": person_labels.get(filters["issuer"], ""),
+            },
+            url_for_view=url_for(aggregate["view"])
         )
-
     except Exception as e:
-        app.logger.error(f"Fehler beim Laden der Transponder-Aggregatsansicht: {e}")
+        app.logger.error(f"Fehler beim Laden der Aggregatsansicht {name}: {e}")
         return render_template("error.html", message="Fehler beim Laden der Daten.")
+    finally:
+        session.close()
+
+@app.route("/aggregate/transponder")
+def aggregate_transponder_view():
+    return render_aggregate_view("transponder")
 
 @app.route("/aggregate/inventory")
 def aggregate_inventory_view():
-    session = None
+    return render_aggregate_view("inventory")
+
+@app.route("/api/aggregate/<name>/rows")
+def api_aggregate_rows(name):
+    if name not in AGGREGATES:
+        return jsonify(success=False, error="Aggregat nicht gefunden"), 404
+
+    session = Session()
     try:
-        session = Session()
-
-        # Query-Parameter auslesen
-        show_only_unreturned = request.args.get("unreturned") == "1"
-        owner_filter = request.args.get("owner", type=int)
-        issuer_filter = request.args.get("issuer", type=int)
-
-        # Grundquery mit Joins
-        query = session.query(Inventory) \
-            .options(
-                joinedload(Inventory.owner),
-                joinedload(Inventory.issuer),
-                joinedload(Inventory.object).joinedload(Object.category),
-                joinedload(Inventory.kostenstelle),
-                joinedload(Inventory.abteilung),
-                joinedload(Inventory.professorship),
-                joinedload(Inventory.room)
-            )
+        filters = parse_aggregate_filters(request.args)
+        offset = max(0, request.args.get("offset", 0, type=int))
+        limit = request.args.get("limit", AGGREGATE_CHUNK_SIZE, type=int)
+        limit = max(1, min(limit, AGGREGATE_MAX_CHUNK_SIZE))
+        total, rows = load_aggregate_chunk(session, name, filters, offset, limit)
+        return jsonify(success=True, total=total, offset=offset, rows=rows)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Aggregat-Zeilen {name}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
+
+PERSON_SUGGEST_DEFAULT_LIMIT = 10
+PERSON_SUGGEST_MAX_LIMIT = 50
+
+def person_label(title, first_name, last_name) -> str:
+    return " ".join(part for part in (title, first_name, last_name) if part)
+
+def get_person_labels(session, person_ids) -> dict:
+    ids = [i for i in person_ids if i]
+    if not ids:
+        return {}
+    rows = session.execute(
+        select(Person.id, Person.title, Person.first_name, Person.last_name).where(Person.id.in_(ids))
+    ).all()
+    return {r.id: person_label(r.title, r.first_name, r.last_name) for r in rows}
+
+def suggest_persons(session, query_text: str, limit: int = PERSON_SUGGEST_DEFAULT_LIMIT) -> list:
+    prefix = normalize_search_text(query_text)
+    if not prefix:
+        return []
+
+    # Bereichsabfrage statt LIKE, damit SQLite den Index unabhängig von
+    # case_sensitive_like/Kollation nutzen kann
+    upper = prefix + "\uffff"
+    columns = (Person.id, Person.title, Person.first_name, Person.last_name)
+    results = []
+    seen = set()
+    for key_column in (Person.name_search, Person.name_search_first):
+        stmt = (
+            select(*columns)
+            .where(key_column >= prefix, key_column < upper)
+            .order_by(key_column)
+            .limit(limit)
+        )
+        for r in session.execute(stmt):
+            if r.id in seen:
+                continue
+            seen.add(r.id)
+            results.append({
+                "id": r.id,
+                "label": person_label(r.title, r.first_name, r.last_name),
+                "first_name": r.first_name,
+                "last_name": r.last_name,
+            })
+            if len(results) >= limit:
+                return results
+    return results
+
+@app.route("/api/persons/suggest")
+def api_persons_suggest():
+    session = Session()
+    try:
+        limit = request.args.get("limit", PERSON_SUGGEST_DEFAULT_LIMIT, type=int)
+        limit = max(1, min(limit or PERSON_SUGGEST_DEFAULT_LIMIT, PERSON_SUGGEST_MAX_LIMIT))
+        return jsonify(suggest_persons(session, request.args.get("q", ""), limit))
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler bei der Personensuche: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
+
+PERSON_DOSSIER_MAX_IDS = 500
+
+DOSSIER_ROOM_SERIALIZER = ModelSerializer(
+    Room,
+    fields=("id", "name", "floor"),
+    related={"building": ModelSerializer(Building, fields=("id", "name", "building_number", "abkuerzung"))}
+)
+
+DOSSIER_TRANSPONDER_SERIALIZER = ModelSerializer(
+    Transponder,
+    fields=("id", "serial_number", "issuer_id", "owner_id", "got_date", "return_date", "comment"),
+    related={"rooms": ("room_links.room", DOSSIER_ROOM_SERIALIZER)},
+    iso_dates=True
+)
+
+DOSSIER_ABTEILUNG_SERIALIZER = ModelSerializer(Abteilung, fields=("id", "name"))
+
+PERSON_DOSSIER_SERIALIZER = ModelSerializer(
+    Person,
+    related={
+        "contacts": ModelSerializer(PersonContact, fields=("id", "phone", "fax", "email", "comment")),
+        "rooms": ("rooms.room", DOSSIER_ROOM_SERIALIZER),
+        "abteilungen": ("person_abteilungen.abteilung", DOSSIER_ABTEILUNG_SERIALIZER),
+        "leitet_abteilungen": ("departments", DOSSIER_ABTEILUNG_SERIALIZER),
+        "professorships": ("professorships.professorship", ModelSerializer(
+            Professorship,
+            fields=("id", "name"),
+            related={"kostenstelle": ModelSerializer(Kostenstelle, fields=("id", "name"))}
+        )),
+        "transponders_owned": DOSSIER_TRANSPONDER_SERIALIZER,
+        "transponders_issued": DOSSIER_TRANSPONDER_SERIALIZER,
+    },
+    iso_dates=True
+)
+
+def _transponder_room_options(rel):
+    return selectinload(rel).selectinload(Transponder.room_links).selectinload(TransponderToRoom.room).selectinload(Room.building)
+
+def load_person_dossiers(session, person_ids) -> dict:
+    """
+    Lädt Personen mit allen Beziehungen in einem festen Satz von
+    selectinload-Abfragen, unabhängig von der Anzahl der Personen.
+    Gibt {person_id: dossier} zurück.
+    """
+    persons = session.execute(
+        select(Person)
+        .where(Person.id.in_(set(person_ids)))
+        .options(
+            selectinload(Person.contacts),
+            selectinload(Person.rooms).selectinload(PersonToRoom.room).selectinload(Room.building),
+            selectinload(Person.person_abteilungen).selectinload(PersonToAbteilung.abteilung),
+            selectinload(Person.departments),
+            selectinload(Person.professorships).selectinload(ProfessorshipToPerson.professorship).selectinload(Professorship.kostenstelle),
+            _transponder_room_options(Person.transponders_owned),
+            _transponder_room_options(Person.transponders_issued),
+        )
+    ).scalars().all()
+    return {p.id: PERSON_DOSSIER_SERIALIZER(p) for p in persons}
+
+@app.route("/api/person/<int:person_id>/dossier")
+def api_person_dossier(person_id):
+    session = Session()
+    try:
+        dossier = load_person_dossiers(session, [person_id]).get(person_id)
+        if dossier is None:
+            return jsonify(success=False, error=f"Keine Person mit ID {person_id}"), 404
+        return jsonify(success=True, person=dossier)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden des Dossiers für Person {person_id}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
 
-        # Filter anwenden
-        if show_only_unreturned:
-            query = query.filter(Inventory.return_date.is_(None))
+@app.route("/api/persons/dossier", methods=["GET", "POST"])
+def api_person_dossiers():
+    payload = request.get_json(silent=True) or {}
+    try:
+        person_ids = parse_id_list(payload.get("ids", request.values.get("ids")))
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="Ungültige ids"), 400
+    if not person_ids:
+        return jsonify(success=False, error="Keine ids angegeben"), 400
+    if len(person_ids) > PERSON_DOSSIER_MAX_IDS:
+        return jsonify(success=False, error=f"Maximal {PERSON_DOSSIER_MAX_IDS} Personen pro Abfrage"), 400
 
-        if owner_filter:
-            query = query.filter(Inventory.owner_id == owner_filter)
+    session = Session()
+    try:
+        dossiers = load_person_dossiers(session, person_ids)
+        return jsonify(
+            success=True,
+            persons=[dossiers[i] for i in dict.fromkeys(person_ids) if i in dossiers],
+            missing=[i for i in dict.fromkeys(person_ids) if i not in dossiers]
+        )
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Personendossiers: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
 
-        if issuer_filter:
-            query = query.filter(Inventory.issuer_id == issuer_filter)
+ABTEILUNG_MEMBER_SERIALIZER = ModelSerializer(
+    Person,
+    fields=("id", "title", "first_name", "last_name"),
+    related={
+        "contacts": ModelSerializer(PersonContact, fields=("id", "phone", "fax", "email", "comment")),
+        "rooms": ("rooms.room", DOSSIER_ROOM_SERIALIZER),
+    }
+)
+
+ABTEILUNG_ROSTER_SERIALIZER = ModelSerializer(
+    Abteilung,
+    fields=("id", "name"),
+    related={
+        "abteilungsleiter": ("leiter", ABTEILUNG_MEMBER_SERIALIZER),
+        "personen": ("persons.person", ABTEILUNG_MEMBER_SERIALIZER),
+    }
+)
+
+# Ein Eintrag pro Abteilung; jede Änderung an Mitgliedschaften, Personen,
+# Kontakten oder Räumen macht die Einträge ungültig
+_abteilung_roster_cache = VersionedCache((
+    "abteilung", "person_to_abteilung", "person", "person_contact",
+    "person_to_room", "room", "building"
+), max_entries=1024)
+
+def _member_options(path):
+    return (
+        path.selectinload(Person.contacts),
+        path.selectinload(Person.rooms).selectinload(PersonToRoom.room).selectinload(Room.building),
+    )
 
-        inventory_list = query.all()
+def load_abteilung_rosters(session, abteilung_ids) -> dict:
+    """Lädt Abteilungen mit Leitung und Mitgliedern samt Kontakten und Räumen, unabhängig von der Mitgliederzahl in einer festen Zahl von Abfragen."""
+    leiter = selectinload(Abteilung.leiter)
+    members = selectinload(Abteilung.persons).selectinload(PersonToAbteilung.person)
+    abteilungen = session.execute(
+        select(Abteilung)
+        .where(Abteilung.id.in_(set(abteilung_ids)))
+        .options(*_member_options(leiter), *_member_options(members))
+    ).scalars().all()
+    return {a.id: ABTEILUNG_ROSTER_SERIALIZER(a) for a in abteilungen}
+
+def get_abteilung_rosters(session, abteilung_ids) -> dict:
+    return _abteilung_roster_cache.get_many_or_compute(
+        list(dict.fromkeys(abteilung_ids)),
+        lambda missing: load_abteilung_rosters(session, missing)
+    )
 
-        # Hilfsfunktionen
-        def person_name(p):
-            if p:
-                return f"{p.first_name} {p.last_name}"
-            return "Unbekannt"
+@app.route("/api/abteilung/<int:abteilung_id>")
+def api_abteilung(abteilung_id):
+    session = Session()
+    try:
+        roster = get_abteilung_rosters(session, [abteilung_id]).get(abteilung_id)
+        if roster is None:
+            return jsonify(success=False, error=f"Keine Abteilung mit ID {abteilung_id}"), 404
+        return jsonify(success=True, abteilung=roster)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Abteilung {abteilung_id}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
 
-        def category_name(c):
-            return c.name if c else "-"
+@app.route("/api/abteilungen")
+def api_abteilungen():
+    try:
+        abteilung_ids = parse_id_list(request.args.get("ids"))
+    except ValueError:
+        return jsonify(success=False, error="Ungültige ids"), 400
 
-        def kostenstelle_name(k):
-            return k.name if k else "-"
+    session = Session()
+    try:
+        if not abteilung_ids:
+            abteilung_ids = session.execute(
+                select(Abteilung.id).order_by(Abteilung.name, Abteilung.id)
+            ).scalars().all()
+        rosters = get_abteilung_rosters(session, abteilung_ids)
+        return jsonify(success=True, abteilungen=[rosters[i] for i in dict.fromkeys(abteilung_ids) if i in rosters])
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Abteilungen: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
 
-        def abteilung_name(a):
-            return a.name if a else "-"
+@app.route("/api/access/room/<int:room_id>")
+def api_access_room(room_id):
+    try:
+        return jsonify(room_id=room_id, persons=access_index.persons_for_room(room_id))
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Abfragen des Zugangsindex für Raum {room_id}: {e}")
+        return jsonify(success=False, error=str(e)), 500
 
-        def professorship_name(pf):
-            return pf.name if pf else "-"
+@app.route("/api/access/person/<int:person_id>")
+def api_access_person(person_id):
+    try:
+        return jsonify(person_id=person_id, rooms=access_index.rooms_for_person(person_id))
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Abfragen des Zugangsindex für Person {person_id}: {e}")
+        return jsonify(success=False, error=str(e)), 500
 
-        def room_name(r):
-            if r:
-                floor_str = f"{r.floor}.OG" if r.floor is not None else "?"
-                return f"{r.name} ({floor_str})"
-            return "-"
+@app.route("/api/inventory/rollup")
+def api_inventory_rollup():
+    session = Session()
+    try:
+        dims = parse_rollup_dimensions(request.args.get("dims"))
+        filters = parse_rollup_filters(request.args)
+        only_unreturned = request.args.get("unreturned") == "1"
+        return jsonify(success=True, **inventory_rollup(session, dims, filters, only_unreturned))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler bei der Inventar-Wertübersicht: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
 
+@app.route("/aggregate/inventory/rollup")
+def aggregate_inventory_rollup_view():
+    session = Session()
+    try:
+        dims = parse_rollup_dimensions(request.args.get("dims"))
+        filters = parse_rollup_filters(request.args)
+        only_unreturned = request.args.get("unreturned") == "1"
+        result = inventory_rollup(session, dims, filters, only_unreturned)
+
+        # Drill-down: ein Klick auf eine Gruppe filtert auf deren Wert und
+        # öffnet die nächste noch nicht gewählte Dimension
+        remaining = [d for d in ROLLUP_DIMENSIONS if d not in dims and d not in filters]
         rows = []
-        for inv in inventory_list:
-            row = {
-                "ID": inv.id,
-                "Seriennummer": inv.serial_number or "-",
-                "Objekt": inv.object.name if inv.object else "-",
-                "Kategorie": category_name(inv.object.category) if inv.object else "-",
-                "Anlagennummer": inv.anlagennummer or "-",
-                "Ausgegeben an": person_name(inv.owner),
-                "Ausgegeben durch": person_name(inv.issuer),
-                "Ausgabedatum": inv.got_date.isoformat() if inv.got_date else "-",
-                "Rückgabedatum": inv.return_date.isoformat() if inv.return_date else "Nicht zurückgegeben",
-                "Raum": room_name(inv.room),
-                "Abteilung": abteilung_name(inv.abteilung),
-                "Professur": professorship_name(inv.professorship),
-                "Kostenstelle": kostenstelle_name(inv.kostenstelle),
-                "Preis": f"{inv.price:.2f} €" if inv.price is not None else "-",
-                "Kommentar": inv.comment or "-"
-            }
-            rows.append(row)
-
-        # Für Filter: Alle User (Owner und Issuer) holen (vereinfachend hier alle Personen)
-        # Du kannst ggf. nur Owner oder Issuer spezifisch holen, falls nötig
-        people_query = session.query(Person).order_by(Person.last_name, Person.first_name).all()
-        people = [{"id": p.id, "name": f"{p.first_name} {p.last_name}"} for p in people_query]
-
-        column_labels = list(rows[0].keys()) if rows else []
-        row_data = [[escape(str(row[col])) for col in column_labels] for row in rows]
+        for row in result["rows"]:
+            level = row["level"]
+            label = "Gesamt"
+            drill_url = None
+            if level > 0:
+                dim = dims[level - 1]
+                group = row[dim]
+                label = group["name"] or "(ohne Zuordnung)"
+                if level == len(dims) and remaining:
+                    args = {d: ("none" if v is None else v) for d, v in filters.items()}
+                    for d in dims:
+                        args[d] = "none" if row[d]["id"] is None else row[d]["id"]
+                    drill_url = url_for(
+                        "aggregate_inventory_rollup_view",
+                        dims=remaining[0],
+                        unreturned="1" if only_unreturned else None,
+                        **args
+                    )
+            rows.append({
+                "level": level,
+                "is_total": level < len(dims),
+                "label": label,
+                "drill_url": drill_url,
+                "total_price": f"{row['total_price']:.2f} €",
+                "item_count": row["item_count"],
+                "unreturned_count": row["unreturned_count"],
+            })
 
         return render_template(
-            "aggregate_view.html",
-            title="Inventarübersicht",
-            column_labels=column_labels,
-            row_data=row_data,
-            filters={
-                "unreturned": show_only_unreturned,
-                "owner": owner_filter,
-                "issuer": issuer_filter,
-            },
-            people=people,
-            url_for_view=url_for("aggregate_inventory_view")
+            "aggregate_rollup.html",
+            title="Inventar-Wertübersicht",
+            dims=dims,
+            dimension_labels=ROLLUP_LABELS,
+            filters={ROLLUP_LABELS[d]: v for d, v in filters.items()},
+            only_unreturned=only_unreturned,
+            rows=rows,
+            depth=len(dims)
         )
-    except Exception as e:
-        app.logger.error(f"Fehler beim Laden der Inventar-Aggregatsansicht: {e}")
+    except ValueError as e:
+        return render_template("error.html", message=str(e)), 400
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Inventar-Wertübersicht: {e}")
         return render_template("error.html", message="Fehler beim Laden der Daten.")
     finally:
-        if session:
-            session.close()
+        session.close()
 
+def parse_outstanding_args(args):
+    kind = args.get("kind", "transponder")
+    days = args.get("days", 30, type=int)
+    since_str = args.get("since")
+    since = datetime.date.fromisoformat(since_str) if since_str else None
+    return kind, days, since
+
+@app.route("/api/reports/outstanding")
+def api_outstanding_report():
+    session = Session()
+    try:
+        kind, days, since = parse_outstanding_args(request.args)
+        return jsonify(success=True, **outstanding_report(session, kind, days, since))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Ausgabebericht: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
+
+@app.route("/aggregate/outstanding")
+def aggregate_outstanding_view():
+    session = Session()
+    try:
+        kind, days, since = parse_outstanding_args(request.args)
+        report = outstanding_report(session, kind, days, since)
+        return render_template(
+            "aggregate_outstanding.html",
+            title="Überfällige Ausgaben",
+            report=report,
+            kind=kind,
+            days=days,
+            since=since.isoformat() if since else ""
+        )
+    except ValueError as e:
+        return render_template("error.html", message=str(e)), 400
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden des Ausgabeberichts: {e}")
+        return render_template("error.html", message="Fehler beim Laden der Daten.")
+    finally:
+        session.close()
 
 @app.route("/wizard")
 def wizard_index():
@@ -866,178 +1514,243 @@ def wizard_index():
 
 @app.route("/wizard/person", methods=["GET", "POST"])
 def wizard_person():
-    session = Session()
     error = None
     success = False
 
+    def create_person(session, form):
+        title = form.get("title", "").strip() or None
+        first_name = form.get("first_name", "").strip()
+        last_name = form.get("last_name", "").strip()
+        comment = form.get("comment", "").strip() or None
+        image_url = form.get("image_url", "").strip() or None
+
+        if not first_name or not last_name:
+            raise ValueError("Vorname und Nachname sind Pflichtfelder.")
+
+        emails = form.getlist("email[]")
+        phones = form.getlist("phone[]")
+        faxes = form.getlist("fax[]")
+        comments = form.getlist("contact_comment[]")
+
+        valid_emails = [e.strip() for e in emails if e.strip() != ""]
+        if len(valid_emails) == 0:
+            raise ValueError("Mindestens eine Email muss eingegeben werden.")
+
+        for email in valid_emails:
+            if not is_valid_email(email):
+                raise ValueError(f"Ungültige Email-Adresse: {email}")
+
+        new_person = Person(
+            title=title,
+            first_name=first_name,
+            last_name=last_name,
+            comment=comment,
+            image_url=image_url
+        )
+        session.add(new_person)
+        session.flush()
+
+        max_len = max(len(emails), len(phones), len(faxes), len(comments))
+        for i in range(max_len):
+            email_val = emails[i].strip() if i < len(emails) else None
+            phone_val = phones[i].strip() if i < len(phones) else None
+            fax_val = faxes[i].strip() if i < len(faxes) else None
+            comment_val = comments[i].strip() if i < len(comments) else None
+
+            if any([email_val, phone_val, fax_val, comment_val]):
+                if email_val and not is_valid_email(email_val):
+                    raise ValueError(f"Ungültige Email-Adresse in Kontakt: {email_val}")
+
+                contact = PersonContact(
+                    person_id=new_person.id,
+                    email=email_val,
+                    phone=phone_val,
+                    fax=fax_val,
+                    comment=comment_val
+                )
+                session.add(contact)
+
     if request.method == "POST":
         try:
-            title = request.form.get("title", "").strip() or None
-            first_name = request.form.get("first_name", "").strip()
-            last_name = request.form.get("last_name", "").strip()
-            comment = request.form.get("comment", "").strip() or None
-            image_url = request.form.get("image_url", "").strip() or None
-
-            if not first_name or not last_name:
-                raise ValueError("Vorname und Nachname sind Pflichtfelder.")
-
-            emails = request.form.getlist("email[]")
-            phones = request.form.getlist("phone[]")
-            faxes = request.form.getlist("fax[]")
-            comments = request.form.getlist("contact_comment[]")
-
-            valid_emails = [e.strip() for e in emails if e.strip() != ""]
-            if len(valid_emails) == 0:
-                raise ValueError("Mindestens eine Email muss eingegeben werden.")
-
-            for email in valid_emails:
-                if not is_valid_email(email):
-                    raise ValueError(f"Ungültige Email-Adresse: {email}")
-
-            new_person = Person(
-                title=title,
-                first_name=first_name,
-                last_name=last_name,
-                comment=comment,
-                image_url=image_url
-            )
-            session.add(new_person)
-            session.flush()
-
-            max_len = max(len(emails), len(phones), len(faxes), len(comments))
-            for i in range(max_len):
-                email_val = emails[i].strip() if i < len(emails) else None
-                phone_val = phones[i].strip() if i < len(phones) else None
-                fax_val = faxes[i].strip() if i < len(faxes) else None
-                comment_val = comments[i].strip() if i < len(comments) else None
-
-                if any([email_val, phone_val, fax_val, comment_val]):
-                    if email_val and not is_valid_email(email_val):
-                        raise ValueError(f"Ungültige Email-Adresse in Kontakt: {email_val}")
-
-                    contact = PersonContact(
-                        person_id=new_person.id,
-                        email=email_val,
-                        phone=phone_val,
-                        fax=fax_val,
-                        comment=comment_val
-                    )
-                    session.add(contact)
-
-            session.commit()
+            write_coordinator.run(create_person, request.form.copy())
             success = True
 
         except Exception as e:
-            session.rollback()
-            error = str(e) + "\n" + traceback.format_exc()
-
-        finally:
-            session.close()
+            app.logger.error(f"Fehler beim Anlegen der Person im Assistenten: {e}")
+            error = str(e)
 
     return render_template("person_wizard.html", success=success, error=error)
 
 @app.route("/map-editor")
 def map_editor():
-    return render_template("map_editor.html")
+    session = Session()
+    try:
+        buildings = session.execute(select(Building.id, Building.name, Building.abkuerzung).order_by(Building.name)).all()
+    finally:
+        session.close()
+    return render_template(
+        "map_editor.html",
+        buildings=buildings,
+        building_id=request.args.get("building", type=int),
+        floor=request.args.get("floor", type=int)
+    )
+
+@app.route("/api/floor/<building>/<int(signed=True):floor>/layout", methods=["GET", "PUT"])
+def api_floor_layout(building, floor):
+    session = Session()
+    try:
+        found = resolve_building(session, building)
+        if found is None:
+            return jsonify(success=False, error=f"Gebäude {building} nicht gefunden"), 404
+        building_id = found.id
+        if request.method == "GET":
+            return jsonify(success=True, building_id=building_id, floor=floor, **load_floor_layout(session, building_id, floor))
+    finally:
+        session.close()
+
+    payload = request.get_json(silent=True)
+    create_missing = flag_arg("create_missing", payload if isinstance(payload, dict) else None)
+    try:
+        rects = parse_layout_data(payload)
+        result = write_coordinator.run(save_floor_layout, building_id, floor, rects, create_missing)
+    except LayoutValidationError as e:
+        return jsonify(success=False, errors=e.errors, error=str(e)), 400
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Speichern des Etagenlayouts {building}/{floor}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    return jsonify(success=True, building_id=building_id, floor=floor, **result)
+
+def _floor_room_query(building, floor, query, params):
+    """Gemeinsamer Rahmen der Raumabfragen: Gebäude auflösen, Zahlenparameter prüfen."""
+    values = {}
+    for name in params:
+        value = request.args.get(name, type=float)
+        if value is None:
+            return jsonify(success=False, error=f"Parameter {name} fehlt oder ist keine Zahl"), 400
+        values[name] = value
+    session = Session()
+    try:
+        found = resolve_building(session, building)
+        if found is None:
+            return jsonify(success=False, error=f"Gebäude {building} nicht gefunden"), 404
+        rooms = query(session, found.id, floor, **values)
+        return jsonify(success=True, building_id=found.id, floor=floor, rooms=rooms)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler bei der Raumabfrage {building}/{floor}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
+
+@app.route("/api/floor/<building>/<int(signed=True):floor>/rooms/at")
+def api_floor_rooms_at(building, floor):
+    return _floor_room_query(building, floor, rooms_at_point, ("x", "y"))
+
+@app.route("/api/floor/<building>/<int(signed=True):floor>/rooms/in")
+def api_floor_rooms_in(building, floor):
+    return _floor_room_query(building, floor, rooms_in_box, ("x1", "y1", "x2", "y2"))
+
+@app.route("/api/floor/<building>/<int(signed=True):floor>/rooms/overlap")
+def api_floor_rooms_overlap(building, floor):
+    exclude = request.args.get("exclude", type=int)
+    query = lambda session, building_id, floor, **rect: overlapping_rooms(session, building_id, floor, exclude_room_id=exclude, **rect)
+    return _floor_room_query(building, floor, query, ("x", "y", "width", "height"))
+
+@app.route("/api/floor/<building>/<int(signed=True):floor>/occupancy")
+def api_floor_occupancy(building, floor):
+    session = Session()
+    try:
+        found = resolve_building(session, building)
+        if found is None:
+            return jsonify(success=False, error=f"Gebäude {building} nicht gefunden"), 404
+        return jsonify(success=True, building_id=found.id, floor=floor, **floor_occupancy(session, found.id, floor))
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Belegung {building}/{floor}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
+
+# Kacheln tragen die Version des Quellbilds in der URL und ändern sich nie
+TILE_CACHE_SECONDS = 365 * 24 * 3600
+
+@app.route("/api/floor/<building>/<int(signed=True):floor>/tiles")
+def api_floor_tiles(building, floor):
+    session = Session()
+    try:
+        found = resolve_building(session, building)
+        if found is None:
+            return jsonify(success=False, error=f"Gebäude {building} nicht gefunden"), 404
+        building_id = found.id
+    finally:
+        session.close()
+    manifest = load_manifest(building_id, floor)
+    if manifest is None:
+        return jsonify(success=False, error="Für diese Etage wurden keine Kacheln erzeugt"), 404
+    tile_url = f"/tiles/{building_id}/{floor}/{manifest['version']}/{{z}}/{{x}}_{{y}}.png"
+    return jsonify(success=True, building_id=building_id, floor=floor, tile_url=tile_url, **manifest)
+
+@app.route("/tiles/<int:building_id>/<int(signed=True):floor>/<version>/<int:zoom>/<int:x>_<int:y>.png")
+def floor_tile(building_id, floor, version, zoom, x, y):
+    directory = tile_directory(building_id, floor, version, zoom)
+    if directory is None:
+        abort(404)
+    response = send_from_directory(os.path.abspath(directory), f"{x}_{y}.png", max_age=TILE_CACHE_SECONDS)
+    response.headers["Cache-Control"] = f"public, max-age={TILE_CACHE_SECONDS}, immutable"
+    return response
 
 @app.route("/wizard/transponder", methods=["GET", "POST"])
 def run_wizard():
     return _wizard_internal("transponder")
 
 def _wizard_internal(name):
-    config = WIZARDS.get(name)
-    if not config:
+    wizard = COMPILED_WIZARDS.get(name)
+    if not wizard:
         abort(404)
 
-    # JSON-sichere Version ohne nicht-serialisierbare Objekte
-    def get_json_safe_config(config):
-        safe = deepcopy(config)
-        for sub in safe.get("subforms", []):
-            sub.pop("model", None)
-            sub.pop("foreign_key", None)
-        safe.pop("model", None)
-        return safe
-
-    session = Session()
     success = False
     error = None
+    message = None
 
     if request.method == "POST":
+        def create_entries(session, entries):
+            session.info[CUSTODY_SOURCE_KEY] = "wizard"
+            wizard.validate(session, entries)
+            return len(wizard.persist(session, entries))
+
         try:
-            main_model = config["model"]
-            main_data = {
-                f["name"]: request.form.get(f["name"], "").strip() or None
-                for f in config["fields"]
-            }
-
-            if any(f.get("required") and not main_data[f["name"]] for f in config["fields"]):
-                raise ValueError("Pflichtfelder fehlen.")
-
-            main_instance = main_model(**main_data)
-            session.add(main_instance)
-            session.flush()
-
-            for sub in config.get("subforms", []):
-                model = sub["model"]
-                foreign_key = sub["foreign_key"]
-                field_names = [f["name"] for f in sub["fields"]]
-                data_lists = {f: request.form.getlist(f + "[]") for f in field_names}
-
-                for i in range(max(len(l) for l in data_lists.values())):
-                    entry = {
-                        f: data_lists[f][i].strip() if i < len(data_lists[f]) else None
-                        for f in field_names
-                    }
-                    if any(entry.values()):
-                        entry[foreign_key] = main_instance.id
-                        session.add(model(**entry))
-
-            session.commit()
+            created = write_coordinator.run(create_entries, wizard.parse(request.form))
             success = True
-
+            message = f"{created} Datensätze angelegt." if created > 1 else "Erfolgreich gespeichert."
+        except WizardValidationError as e:
+            error = "\n".join(e.errors)
         except Exception as e:
-            session.rollback()
             error = str(e)
-        finally:
-            session.close()
 
-    return render_template("wizard.html", config=config, config_json=get_json_safe_config(config), success=success, error=error)
+    return render_template("wizard.html", config=wizard.schema, config_json=wizard.schema, success=success, error=error, message=message)
+
+# Serialisierer für Formular- und Metadaten, einmal beim Start kompiliert
+PERSON_FORM_SERIALIZER = ModelSerializer(
+    Person,
+    fields=("id", "title", "first_name", "last_name"),
+    coalesce={"first_name": "", "last_name": ""},
+    related={"contacts": ModelSerializer(PersonContact, fields=("phone", "fax", "email", "comment"))}
+)
+
+TRANSPONDER_FORM_SERIALIZER = ModelSerializer(
+    Transponder,
+    fields=("id", "serial_number", "got_date", "return_date", "comment"),
+    related={
+        "rooms": ("room_links.room", ModelSerializer(
+            Room,
+            fields=("id", "name", "floor"),
+            related={"building": ModelSerializer(Building, fields=("id", "name"))}
+        )),
+    }
+)
 
 def get_abteilung_metadata(abteilung_id: int) -> dict:
     session = Session()
     try:
-        abteilung = session.query(Abteilung).filter(Abteilung.id == abteilung_id).one_or_none()
-        if abteilung is None:
-            return None
-
-        metadata = {
-            "id": abteilung.id,
-            "name": abteilung.name,
-            "abteilungsleiter": None,
-            "personen": []
-        }
-
-        if abteilung.leiter is not None:
-            metadata["abteilungsleiter"] = {
-                "id": abteilung.leiter.id,
-                "first_name": abteilung.leiter.first_name,
-                "last_name": abteilung.leiter.last_name,
-                "title": abteilung.leiter.title
-            }
-
-        # Falls du die Personen mit drin haben willst
-        for person_to_abteilung in abteilung.persons:
-            person = person_to_abteilung.person
-            if person:
-                metadata["personen"].append({
-                    "id": person.id,
-                    "first_name": person.first_name,
-                    "last_name": person.last_name,
-                    "title": person.title
-                })
-
-        return metadata
-
+        return get_abteilung_rosters(session, [abteilung_id]).get(abteilung_id)
     except SQLAlchemyError as e:
         return {"error": str(e)}
     finally:
@@ -1069,8 +1782,8 @@ def generate_fields_for_schluesselausgabe_from_metadata(
         if not contacts:
             return ""
         contact = contacts[0]  # nur erster Eintrag
-        phone = contact.get("phone", "").strip()
-        email = contact.get("email", "").strip()
+        phone = (contact.get("phone") or "").strip()
+        email = (contact.get("email") or "").strip()
 
         if phone and email:
             return f"{phone} / {email}"
@@ -1137,187 +1850,102 @@ def generate_fields_for_schluesselausgabe_from_metadata(
     return data
 
 
-def get_transponder_metadata(transponder_id: int) -> dict:
-    session = Session()
-
-    try:
-        transponder = session.query(Transponder).filter(Transponder.id == transponder_id).one_or_none()
-
-        if transponder is None:
-            return None
-
-        metadata = {
-            "id": transponder.id,
-            "serial_number": transponder.serial_number,
-            "got_date": transponder.got_date,
-            "return_date": transponder.return_date,
-            "comment": transponder.comment,
-
-            "issuer": None,
-            "owner": None,
-            "rooms": []
-        }
-
-        if transponder.issuer is not None:
-            metadata["issuer"] = {
-                "id": transponder.issuer.id,
-                "first_name": transponder.issuer.first_name,
-                "last_name": transponder.issuer.last_name,
-                "title": transponder.issuer.title
-            }
-
-        if transponder.owner is not None:
-            metadata["owner"] = {
-                "id": transponder.owner.id,
-                "first_name": transponder.owner.first_name,
-                "last_name": transponder.owner.last_name,
-                "title": transponder.owner.title
-            }
-
-        for link in transponder.room_links:
-            room = link.room
-
-            room_data = {
-                "id": room.id,
-                "name": room.name,
-                "floor": room.floor,
-                "building": None
-            }
-
-            if room.building is not None:
-                room_data["building"] = {
-                    "id": room.building.id,
-                    "name": room.building.name,
-                    "building_number": room.building.building_number,
-                    "abkuerzung": room.building.abkuerzung
-                }
-
-            metadata["rooms"].append(room_data)
-
-        return metadata
-
-    except SQLAlchemyError as e:
-        return {"error": str(e)}
-
-def get_person_metadata(person_id: int) -> dict:
-    session = Session()
+def person_form_metadata(person) -> dict:
+    return PERSON_FORM_SERIALIZER(person)
+
+def transponder_form_metadata(transponder) -> dict:
+    return TRANSPONDER_FORM_SERIALIZER(transponder)
+
+def load_schliessmedien_metadata(session, issuer_id: int, owner_id: int, transponder_id: int) -> dict:
+    """
+    Lädt alles für ein Schließmedien-Formular in drei Abfragen: Ausgeber und
+    Besitzer (eine Abfrage plus eine für deren Kontakte) sowie den
+    Transponder mit Räumen und Gebäuden. Das Ergebnis passt direkt auf
+    generate_fields_for_schluesselausgabe_from_metadata(**metadata).
+    Fehlende Datensätze sind None.
+    """
+    persons = session.execute(
+        select(Person)
+        .where(Person.id.in_({issuer_id, owner_id}))
+        .options(selectinload(Person.contacts))
+    ).scalars().all()
+    persons_by_id = {p.id: p for p in persons}
+
+    transponder = session.execute(
+        select(Transponder)
+        .where(Transponder.id == transponder_id)
+        .options(joinedload(Transponder.room_links).joinedload(TransponderToRoom.room).joinedload(Room.building))
+    ).unique().scalars().one_or_none()
+
+    return {
+        "issuer": person_form_metadata(persons_by_id.get(issuer_id)),
+        "owner": person_form_metadata(persons_by_id.get(owner_id)),
+        "transponder": transponder_form_metadata(transponder) if transponder is not None else None,
+    }
+
+def flag_arg(name: str, payload: dict = None) -> bool:
+    if payload and name in payload:
+        return bool(payload[name])
+    return request.values.get(name, "").lower() in ("1", "true", "yes")
+
+def wants_async(payload: dict = None) -> bool:
+    return flag_arg("async", payload)
+
+def signing_unavailable():
+    return jsonify(success=False, error="Signieren ist nicht konfiguriert (VERWALTUNG_SIGNING_KEY / VERWALTUNG_SIGNING_CERT)"), 400
+
+def signed_zip_response(files, download_name: str):
+    return Response(
+        stream_with_context(stream_zip(files)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={download_name}"}
+    )
 
+def submit_pdf_job(kind: str, params: dict):
     try:
-        person = session.query(Person).filter(Person.id == person_id).one_or_none()
-
-        if person is None:
-            return {"error": f"No person found with id {person_id}"}
-
-        metadata = {
-            "id": person.id,
-            "title": person.title,
-            "first_name": person.first_name,
-            "last_name": person.last_name,
-            "created_at": person.created_at,
-            "comment": person.comment,
-            "image_url": person.image_url,
-
-            "contacts": [],
-            "rooms": [],
-            "transponders_issued": [],
-            "transponders_owned": [],
-            "departments": [],
-            "person_abteilungen": [],
-            "professorships": []
-        }
-
-        for contact in person.contacts:
-            metadata["contacts"].append({
-                "id": contact.id,
-                "phone": contact.phone,
-                "fax": contact.fax,
-                "email": contact.email,
-                "comment": contact.comment
-            })
-
-        for room in person.rooms:
-            metadata["rooms"].append({
-                "id": room.id,
-                "room_id": getattr(room, "room_id", None),  # adapt if necessary
-                "comment": getattr(room, "comment", None)
-            })
-
-        for transponder in person.transponders_issued:
-            metadata["transponders_issued"].append({
-                "id": transponder.id,
-                "number": getattr(transponder, "number", None),
-                "owner_id": transponder.owner_id
-            })
-
-        for transponder in person.transponders_owned:
-            metadata["transponders_owned"].append({
-                "id": transponder.id,
-                "number": getattr(transponder, "number", None),
-                "issuer_id": transponder.issuer_id
-            })
-
-        for dept in person.departments:
-            metadata["departments"].append({
-                "id": dept.id,
-                "name": getattr(dept, "name", None)
-            })
-
-        for pa in person.person_abteilungen:
-            metadata["person_abteilungen"].append({
-                "id": pa.id,
-                "abteilung_id": getattr(pa, "abteilung_id", None),
-                "funktion": getattr(pa, "funktion", None)
-            })
-
-        for prof in person.professorships:
-            metadata["professorships"].append({
-                "id": prof.id,
-                "professorship_id": getattr(prof, "professorship_id", None),
-                "title": getattr(prof, "title", None)
-            })
-
-        return metadata
-
-    except SQLAlchemyError as e:
-        return {"error": str(e)}
-
-def fill_pdf_form(template_path, data_dict):
-    reader = PdfReader(template_path)
-    writer = PdfWriter()
-
-    # Alle Seiten übernehmen
-    writer.append_pages_from_reader(reader)
-
-    # 🛠️ AcroForm vom Original-PDF übernehmen
-    if "/AcroForm" in reader.trailer["/Root"]:
-        writer._root_object.update({
-            NameObject("/AcroForm"): reader.trailer["/Root"]["/AcroForm"]
-        })
-
-    # Feldwerte vorbereiten
-    fields = reader.get_fields()
-    filled_fields = {}
-
-    for field_name in data_dict:
-        if field_name in fields:
-            filled_fields[field_name] = data_dict[field_name]
-
-    # 📝 Formularfelder auf erster Seite aktualisieren
-    writer.update_page_form_field_values(writer.pages[0], filled_fields)
-
-    # Ergebnis zurückgeben
-    output_io = io.BytesIO()
-    writer.write(output_io)
-    output_io.seek(0)
-    return output_io
+        job_id = pdf_job_queue.submit(kind, params)
+    except QueueFullError as e:
+        return jsonify(success=False, error=str(e)), 503
+    return jsonify(
+        success=True,
+        job_id=job_id,
+        status_url=url_for("job_status", job_id=job_id),
+        download_url=url_for("job_download", job_id=job_id)
+    ), 202
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = pdf_job_queue.get(job_id)
+    if job is None:
+        return jsonify(success=False, error="Auftrag nicht gefunden"), 404
+    data = job.to_dict()
+    if job.status == JOB_DONE:
+        data["download_url"] = url_for("job_download", job_id=job_id)
+    return jsonify(success=True, job=data)
+
+@app.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    job = pdf_job_queue.get(job_id)
+    if job is None:
+        return jsonify(success=False, error="Auftrag nicht gefunden"), 404
+    if job.status != JOB_DONE:
+        return jsonify(success=False, error=f"Auftrag ist nicht fertig (Status: {job.status})", job=job.to_dict()), 409
+    if not job.result_path or not os.path.exists(job.result_path):
+        return jsonify(success=False, error="Ergebnis ist nicht mehr verfügbar"), 410
+    return send_file(
+        os.path.abspath(job.result_path),
+        mimetype=job.mimetype,
+        as_attachment=True,
+        download_name=job.download_name,
+        conditional=True
+    )
 
 @app.route('/generate_pdf/schliessmedien/')
 def generate_pdf():
-    TEMPLATE_PATH = 'pdfs/ausgabe_schliessmedien.pdf'
-
     issuer_id = request.args.get('issuer_id')
     owner_id = request.args.get('owner_id')
     transponder_id = request.args.get('transponder_id')
+    abteilung_id = request.args.get('abteilung_id')
 
     missing = []
     if not issuer_id:
@@ -1333,17 +1961,32 @@ def generate_pdf():
             missing=missing
         ), 400
 
-    issuer = get_person_metadata(issuer_id)
-    owner = get_person_metadata(owner_id)
-    transponder = get_transponder_metadata(transponder_id)
+    try:
+        issuer_id, owner_id, transponder_id = int(issuer_id), int(owner_id), int(transponder_id)
+        abteilung_id = int(abteilung_id) if abteilung_id else None
+    except ValueError:
+        return render_template_string("<h1>Ungültige Parameter</h1><p>Alle IDs müssen Zahlen sein.</p>"), 400
+
+    session = Session()
+    try:
+        metadata = load_schliessmedien_metadata(session, issuer_id, owner_id, transponder_id)
+        if abteilung_id is not None:
+            metadata["abteilung"] = get_abteilung_rosters(session, [abteilung_id]).get(abteilung_id)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Formulardaten: {e}")
+        return render_template_string("<h1>Fehler</h1><p>Die Formulardaten konnten nicht geladen werden.</p>"), 500
+    finally:
+        session.close()
 
     not_found = []
-    if issuer is None:
+    if metadata["issuer"] is None:
         not_found.append(f"Keine Person mit issuer_id: {issuer_id}")
-    if owner is None:
+    if metadata["owner"] is None:
         not_found.append(f"Keine Person mit owner_id: {owner_id}")
-    if transponder is None:
+    if metadata["transponder"] is None:
         not_found.append(f"Kein Transponder mit transponder_id: {transponder_id}")
+    if abteilung_id is not None and metadata["abteilung"] is None:
+        not_found.append(f"Keine Abteilung mit abteilung_id: {abteilung_id}")
 
     if not_found:
         return render_template_string(
@@ -1351,73 +1994,438 @@ def generate_pdf():
             not_found=not_found
         ), 404
 
-    field_data = generate_fields_for_schluesselausgabe_from_metadata(issuer, owner, transponder, )
+    field_data = generate_fields_for_schluesselausgabe_from_metadata(**metadata)
+
+    sign = flag_arg("sign")
+    signer = get_signer() if sign else None
+    if sign and signer is None:
+        return signing_unavailable()
 
-    filled_pdf = fill_pdf_form(TEMPLATE_PATH, field_data)
-    if filled_pdf is None:
+    if wants_async():
+        return submit_pdf_job("fill_form", {
+            "template": SCHLIESSMEDIEN_TEMPLATE,
+            "fields": field_data,
+            "download_name": "ausgabe_schliessmedien_filled.pdf",
+            "sign": sign,
+        })
+
+    try:
+        pdf_file, cache_key = filled_pdf_cache.open_or_create(SCHLIESSMEDIEN_TEMPLATE, field_data)
+    except Exception as e:
+        app.logger.error(f"Fehler beim Ausfüllen des PDF-Formulars: {e}")
         return render_template_string("<h1>Fehler</h1><p>Das PDF-Formular konnte nicht generiert werden.</p>"), 500
 
+    if signer is not None:
+        # Formular und abgesetzte Signatur gemeinsam als ZIP ausliefern
+        with pdf_file:
+            data = pdf_file.read()
+        return signed_zip_response(
+            signer.sign_single("ausgabe_schliessmedien_filled.pdf", data),
+            "ausgabe_schliessmedien_filled.zip"
+        )
+
+    # Der Cache-Schlüssel hängt nur vom Inhalt ab und taugt daher als ETag;
+    # erneute Downloads desselben Formulars werden mit 304 beantwortet
+    # send_file schließt die Datei nach der Antwort
     return send_file(
-        filled_pdf,
+        pdf_file,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name='ausgabe_schliessmedien_filled.pdf'
+        download_name='ausgabe_schliessmedien_filled.pdf',
+        conditional=True,
+        etag=cache_key
     )
 
+PDF_BATCH_MAX_SIZE = 1000
+
+def load_schliessmedien_batch(session, transponder_ids) -> list:
+    """Lädt Transponder samt Ausgeber, Besitzer, Kontakten und Räumen für viele Formulare auf einmal."""
+    transponders = session.execute(
+        select(Transponder)
+        .where(Transponder.id.in_(transponder_ids))
+        .options(
+            selectinload(Transponder.issuer).selectinload(Person.contacts),
+            selectinload(Transponder.owner).selectinload(Person.contacts),
+            selectinload(Transponder.room_links).selectinload(TransponderToRoom.room).selectinload(Room.building),
+        )
+        .order_by(Transponder.id)
+    ).scalars().all()
+
+    return [
+        (t, generate_fields_for_schluesselausgabe_from_metadata(
+            person_form_metadata(t.issuer) or {},
+            person_form_metadata(t.owner),
+            transponder_form_metadata(t)
+        ))
+        for t in transponders
+    ]
+
+def parse_id_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [v for v in re.split(r"[,\s]+", value) if v]
+    return [int(v) for v in value]
+
+@app.route('/generate_pdf/schliessmedien/batch', methods=["GET", "POST"])
+def generate_pdf_batch():
+    payload = request.get_json(silent=True) or {}
+    args = request.values
+
+    try:
+        transponder_ids = parse_id_list(payload.get("transponder_ids", args.get("transponder_ids")))
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="Ungültige transponder_ids"), 400
+
+    output_format = payload.get("format", args.get("format", "zip"))
+    if output_format not in ("zip", "pdf"):
+        return jsonify(success=False, error="format muss zip oder pdf sein"), 400
+
+    session = Session()
+    try:
+        if not transponder_ids:
+            # Ohne explizite IDs gelten dieselben Filter wie in der Transponder-Aggregatsansicht
+            filters = parse_aggregate_filters(args)
+            query = transponder_aggregate_query(session, filters).with_entities(Transponder.id)
+            transponder_ids = [row.id for row in query.limit(PDF_BATCH_MAX_SIZE + 1)]
+
+        if not transponder_ids:
+            return jsonify(success=False, error="Keine Transponder ausgewählt"), 400
+        if len(transponder_ids) > PDF_BATCH_MAX_SIZE:
+            return jsonify(success=False, error=f"Maximal {PDF_BATCH_MAX_SIZE} Formulare pro Stapel"), 400
+
+        batch = load_schliessmedien_batch(session, transponder_ids)
+        names = [
+            f"schliessmedien_{t.id}_{safe_filename(t.serial_number or '')}.pdf"
+            for t, _ in batch
+        ]
+        jobs = [fields for _, fields in batch]
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Transponder für den PDF-Stapel: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
+
+    if not jobs:
+        return jsonify(success=False, error="Keine der angegebenen Transponder gefunden"), 404
+
+    sign = flag_arg("sign", payload)
+    signer = get_signer() if sign else None
+    if sign and signer is None:
+        return signing_unavailable()
+
+    if wants_async(payload):
+        return submit_pdf_job("batch_forms", {
+            "template": SCHLIESSMEDIEN_TEMPLATE,
+            "jobs": jobs,
+            "names": names,
+            "format": output_format,
+            "download_name": f"ausgabe_schliessmedien.{output_format}",
+            "sign": sign,
+        })
+
+    if output_format == "zip":
+        documents = fill_pdf_forms_parallel(SCHLIESSMEDIEN_TEMPLATE, jobs)
+        files = zip(names, documents)
+        if signer is not None:
+            # Eine Signatur pro Formular, dazu das signierte Manifest
+            files = signer.sign_batch(files)
+        return signed_zip_response(files, "ausgabe_schliessmedien.zip")
+
+    if signer is not None:
+        def generate_signed_merged():
+            documents = fill_pdf_forms_parallel(SCHLIESSMEDIEN_TEMPLATE, jobs, flatten=True)
+            yield from signer.sign_single("ausgabe_schliessmedien.pdf", merge_pdfs(documents))
+
+        return signed_zip_response(generate_signed_merged(), "ausgabe_schliessmedien.zip")
+
+    def generate_merged():
+        # Zusammengeführte Formulare werden flach gerechnet, sonst teilen sich
+        # alle Kopien dieselben Formularfelder
+        documents = fill_pdf_forms_parallel(SCHLIESSMEDIEN_TEMPLATE, jobs, flatten=True)
+        yield merge_pdfs(documents)
+
+    return Response(
+        stream_with_context(generate_merged()),
+        mimetype="application/pdf",
+        headers={"Content-Disposition": "attachment; filename=ausgabe_schliessmedien.pdf"}
+    )
 
 @app.route("/transponder", methods=["GET"])
 def transponder_form():
     session = Session()
-    persons = session.query(Person).order_by(Person.last_name).all()
     transponders = session.query(Transponder).options(
         joinedload(Transponder.owner)
     ).order_by(Transponder.serial_number).all()
 
     return render_template("transponder_form.html",
         config={"title": "Transponder-Ausgabe / Rückgabe"},
-        persons=persons,
         transponders=transponders,
         current_date=date.today().isoformat()
     )
 
-@app.route("/transponder/ausgabe", methods=["POST"])
-def transponder_ausgabe():
-    person_id = request.form.get("person_id")
-    transponder_id = request.form.get("transponder_id")
-    got_date_str = request.form.get("got_date")
+TRANSPONDER_BULK_MAX_ITEMS = 1000
+
+def parse_transponder_bulk_items(raw_items, with_person: bool) -> list:
+    """
+    Normalisiert Einträge der Form {"transponder_id", "person_id", "date"}
+    oder [transponder_id, person_id, date] (bei Rückgaben ohne person_id).
+    Fehlerhafte Einträge bleiben mit "error" in der Liste.
+    """
+    items = []
+    for index, raw in enumerate(raw_items):
+        item = {"index": index, "transponder_id": None, "person_id": None, "date": None, "error": None}
+        try:
+            if isinstance(raw, dict):
+                transponder_id = raw.get("transponder_id")
+                person_id = raw.get("person_id")
+                date_value = raw.get("date")
+            else:
+                values = list(raw)
+                if with_person:
+                    transponder_id, person_id, date_value = (values + [None, None, None])[:3]
+                else:
+                    transponder_id, date_value = (values + [None, None])[:2]
+                    person_id = None
+
+            item["transponder_id"] = int(transponder_id)
+            if with_person:
+                if person_id in (None, ""):
+                    raise ValueError("person_id fehlt")
+                item["person_id"] = int(person_id)
+            item["date"] = date.fromisoformat(date_value) if date_value else date.today()
+        except (TypeError, ValueError) as e:
+            item["error"] = f"Ungültiger Eintrag: {e}"
+        items.append(item)
+    return items
+
+def apply_transponder_changes(session, items: list, issue: bool, all_or_nothing: bool = False, source: str = None) -> list:
+    """
+    Prüft alle Einträge mit je einer IN-Abfrage für Transponder und Personen
+    und schreibt die gültigen mit einem gebündelten UPDATE, zusammen mit den
+    Ereignissen der Besitzhistorie. Läuft als Einheit im Schreib-Thread und
+    committet daher nicht selbst. Gibt die Einträge mit "ok" bzw. "error"
+    zurück.
+    """
+    valid = [item for item in items if item["error"] is None]
+
+    transponder_ids = {item["transponder_id"] for item in valid}
+    transponders = {}
+    if transponder_ids:
+        transponders = {
+            row.id: row for row in session.execute(
+                select(Transponder.id, Transponder.serial_number, Transponder.owner_id, Transponder.got_date, Transponder.return_date, Transponder.version)
+                .where(Transponder.id.in_(transponder_ids))
+            )
+        }
 
-    session = Session()
+    person_ids = {item["person_id"] for item in valid if item["person_id"] is not None}
+    known_persons = set()
+    if person_ids:
+        known_persons = set(session.execute(select(Person.id).where(Person.id.in_(person_ids))).scalars())
 
+    seen = set()
+    for item in valid:
+        transponder = transponders.get(item["transponder_id"])
+        is_issued = transponder is not None and transponder.owner_id is not None and transponder.return_date is None
+        if transponder is None:
+            item["error"] = f"Kein Transponder mit ID {item['transponder_id']}"
+        elif item["transponder_id"] in seen:
+            item["error"] = "Transponder mehrfach im Auftrag"
+        elif issue and item["person_id"] not in known_persons:
+            item["error"] = f"Keine Person mit ID {item['person_id']}"
+        elif issue and is_issued:
+            item["error"] = f"Transponder ist bereits an Person {transponder.owner_id} ausgegeben"
+        elif not issue and not is_issued:
+            item["error"] = "Transponder ist nicht ausgegeben"
+        # Daten außerhalb der bisherigen Historie würden die Stichtagsabfragen verfälschen
+        elif item["date"] > date.today():
+            item["error"] = f"{'Ausgabedatum' if issue else 'Rückgabedatum'} {item['date']:%d.%m.%Y} liegt in der Zukunft"
+        elif not issue and transponder.got_date and item["date"] < transponder.got_date:
+            item["error"] = f"Rückgabedatum {item['date']:%d.%m.%Y} liegt vor dem Ausgabedatum {transponder.got_date:%d.%m.%Y}"
+        elif issue and transponder.return_date and item["date"] < transponder.return_date:
+            item["error"] = f"Ausgabedatum {item['date']:%d.%m.%Y} liegt vor der letzten Rückgabe am {transponder.return_date:%d.%m.%Y}"
+        seen.add(item["transponder_id"])
+
+    to_apply = [item for item in items if item["error"] is None]
+    if all_or_nothing and len(to_apply) != len(items):
+        to_apply = []
+        for item in items:
+            if item["error"] is None:
+                item["error"] = "Nicht ausgeführt, da andere Einträge fehlerhaft sind"
+
+    if to_apply:
+        if issue:
+            params = [
+                {"id": item["transponder_id"], "owner_id": item["person_id"], "got_date": item["date"], "return_date": None,
+                 "version": transponders[item["transponder_id"]].version + 1}
+                for item in to_apply
+            ]
+        else:
+            params = [
+                {"id": item["transponder_id"], "owner_id": None, "return_date": item["date"],
+                 "version": transponders[item["transponder_id"]].version + 1}
+                for item in to_apply
+            ]
+        source = source or ("ausgabe" if issue else "rueckgabe")
+        events = []
+        for item in to_apply:
+            transponder = transponders[item["transponder_id"]]
+            if issue:
+                events.append(custody_event_row(transponder.id, transponder.serial_number, item["person_id"], item["date"], None, source))
+            else:
+                events.append(custody_event_row(transponder.id, transponder.serial_number, None, transponder.got_date, item["date"], source))
+        session.execute(update(Transponder), params)
+        record_custody_events(session, events)
+
+    for item in items:
+        item["ok"] = item["error"] is None
+        if isinstance(item["date"], date):
+            item["date"] = item["date"].isoformat()
+    return items
+
+def transponder_bulk_response(issue: bool):
+    payload = request.get_json(silent=True) or {}
+    raw_items = payload.get("items")
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify(success=False, error="items muss eine nicht-leere Liste sein"), 400
+    if len(raw_items) > TRANSPONDER_BULK_MAX_ITEMS:
+        return jsonify(success=False, error=f"Maximal {TRANSPONDER_BULK_MAX_ITEMS} Einträge pro Auftrag"), 400
+
+    items = parse_transponder_bulk_items(raw_items, with_person=issue)
     try:
-        transponder = session.get(Transponder, int(transponder_id))
-        transponder.owner_id = int(person_id)
-        transponder.got_date = date.fromisoformat(got_date_str)
-        session.session.commit()
-        flash("Transponder erfolgreich ausgegeben.", "success")
-    except Exception as e:
-        session.session.rollback()
-        flash(f"Fehler bei Ausgabe: {str(e)}", "danger")
+        results = write_coordinator.run(
+            apply_transponder_changes, items, issue, bool(payload.get("all_or_nothing")),
+            source="sammelausgabe" if issue else "sammelrueckgabe"
+        )
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler bei der Sammel-{'Ausgabe' if issue else 'Rückgabe'} von Transpondern: {e}")
+        return jsonify(success=False, error=str(e)), 500
+
+    applied = sum(1 for item in results if item["ok"])
+    return jsonify(success=applied == len(results), applied=applied, results=results)
 
-    return redirect(url_for("transponder.transponder_form"))
+@app.route("/transponder/ausgabe/bulk", methods=["POST"])
+def transponder_ausgabe_bulk():
+    return transponder_bulk_response(issue=True)
+
+@app.route("/transponder/rueckgabe/bulk", methods=["POST"])
+def transponder_rueckgabe_bulk():
+    return transponder_bulk_response(issue=False)
+
+def _single_transponder_change(issue: bool, date_field: str, success_message: str, error_label: str):
+    item = {"transponder_id": request.form.get("transponder_id"), "date": request.form.get(date_field)}
+    if issue:
+        item["person_id"] = request.form.get("person_id")
+
+    try:
+        result = write_coordinator.run(apply_transponder_changes, parse_transponder_bulk_items([item], with_person=issue), issue)[0]
+        if result["ok"]:
+            flash(success_message, "success")
+        else:
+            flash(f"Fehler bei {error_label}: {result['error']}", "danger")
+    except SQLAlchemyError as e:
+        flash(f"Fehler bei {error_label}: {str(e)}", "danger")
+
+    return redirect(url_for("transponder_form"))
+
+@app.route("/transponder/ausgabe", methods=["POST"])
+def transponder_ausgabe():
+    return _single_transponder_change(True, "got_date", "Transponder erfolgreich ausgegeben.", "Ausgabe")
 
 @app.route("/transponder/rueckgabe", methods=["POST"])
 def transponder_rueckgabe():
-    transponder_id = request.form.get("transponder_id")
-    return_date_str = request.form.get("return_date")
+    return _single_transponder_change(False, "return_date", "Transponder erfolgreich zurückgenommen.", "Rückgabe")
+
+def parse_custody_date(value):
+    return date.fromisoformat(value) if value else date.today()
+
+def custody_event_dict(event, labels: dict) -> dict:
+    return {
+        "id": event.id,
+        "transponder_id": event.transponder_id,
+        "serial_number": event.serial_number,
+        "event_type": event.event_type,
+        "event_date": event.event_date.isoformat(),
+        "owner_id": event.owner_id,
+        "owner": labels.get(event.owner_id),
+        "source": event.source,
+    }
+
+@app.route("/api/transponder/<int:transponder_id>/custody")
+def api_transponder_custody(transponder_id):
+    """Ohne ?at die komplette Historie, mit ?at=JJJJ-MM-TT den Besitzer zu diesem Tag."""
+    try:
+        when = date.fromisoformat(request.args["at"]) if request.args.get("at") else None
+    except ValueError:
+        return jsonify(success=False, error="Ungültiges Datum"), 400
+
+    session = Session()
+    try:
+        if when is None:
+            events = custody_history(session, transponder_id)
+            labels = get_person_labels(session, {e.owner_id for e in events if e.owner_id})
+            return jsonify(success=True, transponder_id=transponder_id, events=[custody_event_dict(e, labels) for e in events])
+
+        event = holder_at(session, transponder_id, when)
+        labels = get_person_labels(session, {event.owner_id}) if event and event.owner_id else {}
+        return jsonify(
+            success=True,
+            transponder_id=transponder_id,
+            at=when.isoformat(),
+            owner_id=event.owner_id if event else None,
+            owner=labels.get(event.owner_id) if event else None,
+            event=custody_event_dict(event, labels) if event else None
+        )
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Laden der Besitzhistorie von Transponder {transponder_id}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
+
+@app.route("/api/custody")
+def api_custody_at():
+    """Besitzstand aller (oder per ?serial=... bestimmter) Transponder zum Stichtag ?at=JJJJ-MM-TT."""
+    try:
+        when = parse_custody_date(request.args.get("at"))
+    except ValueError:
+        return jsonify(success=False, error="Ungültiges Datum"), 400
 
     session = Session()
+    try:
+        transponder_ids = None
+        serial = request.args.get("serial")
+        if serial:
+            transponder_ids = find_transponder_ids_by_serial(session, serial)
+            if not transponder_ids:
+                return jsonify(success=False, error=f"Keine Historie für Seriennummer {serial}"), 404
+
+        state = custody_at(session, when, transponder_ids)
+        labels = get_person_labels(session, {o for o in state.values() if o})
+        holders = [
+            {"transponder_id": t, "owner_id": o, "owner": labels.get(o)}
+            for t, o in sorted(state.items()) if o is not None
+        ]
+        return jsonify(success=True, at=when.isoformat(), holders=holders)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler bei der Stichtagsabfrage der Besitzhistorie: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    finally:
+        session.close()
 
+@app.route("/api/custody/snapshot", methods=["POST"])
+def api_custody_snapshot():
     try:
-        transponder = session.session.get(Transponder, int(transponder_id))
-        transponder.return_date = date.fromisoformat(return_date_str)
-        transponder.owner_id = None
-        session.commit()
-        flash("Transponder erfolgreich zurückgenommen.", "success")
-    except Exception as e:
-        session.rollback()
-        flash(f"Fehler bei Rückgabe: {str(e)}", "danger")
+        snapshot_date = date.fromisoformat(request.values["date"]) if request.values.get("date") else None
+    except ValueError:
+        return jsonify(success=False, error="Ungültiges Datum"), 400
 
-    return redirect(url_for("transponder.transponder_form"))
+    try:
+        rows = write_coordinator.run_exclusive(create_snapshot, snapshot_date)
+        return jsonify(success=True, rows=rows)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Fehler beim Anlegen des Besitz-Snapshots: {e}")
+        return jsonify(success=False, error=str(e)), 500
 
 def get_handler_instance(handler_name):
     handler_class = HANDLER_MAP.get(handler_name)
@@ -1438,6 +2446,28 @@ def user_edit_index():
     html += "</ul>"
     return html
 
+def apply_handler_form(session, handler_name, form_data, obj_id):
+    handler = HANDLER_MAP[handler_name](session)
+    if "delete" in form_data and form_data["delete"] == "1":
+        # Lösch-Request
+        if obj_id is None:
+            return "Keine ID angegeben zum Löschen."
+        # Wie in der Tabellenansicht über delete_rows, damit Besitzhistorie
+        # und Versionen der per ON DELETE SET NULL geänderten Zeilen stimmen
+        try:
+            success = bool(delete_rows(session, handler.model, [int(obj_id)]))
+            return f"Eintrag {obj_id} gelöscht." if success else "Löschen fehlgeschlagen."
+        except Exception as e:
+            session.rollback()
+            return f"Fehler beim Löschen: {e}"
+
+    # Update oder Insert
+    if obj_id:
+        success = handler.update_by_id(int(obj_id), form_data)
+        return f"Eintrag {obj_id} aktualisiert." if success else "Update fehlgeschlagen."
+    inserted_id = handler.insert_data(form_data)
+    return f"Neuer Eintrag eingefügt mit ID {inserted_id}"
+
 @app.route("/user_edit/<handler_name>", methods=["GET", "POST"])
 def gui_edit(handler_name):
     handler, error = get_handler_instance(handler_name)
@@ -1450,27 +2480,9 @@ def gui_edit(handler_name):
             form_data = dict(request.form)
             obj_id = form_data.pop("id", None)
             try:
-                if "delete" in form_data and form_data["delete"] == "1":
-                    # Lösch-Request
-                    if obj_id is not None:
-                        try:
-                            success = handler.delete_by_id(int(obj_id))
-                            if success:
-                                message = f"Eintrag {obj_id} gelöscht."
-                            else:
-                                message = "Löschen fehlgeschlagen."
-                        except Exception as e:
-                            message = f"Fehler beim Löschen: {e}"
-                    else:
-                        message = "Keine ID angegeben zum Löschen."
-                else:
-                    # Update oder Insert
-                    if obj_id:
-                        success = handler.update_by_id(int(obj_id), form_data)
-                        message = f"Eintrag {obj_id} aktualisiert." if success else "Update fehlgeschlagen."
-                    else:
-                        inserted_id = handler.insert_data(form_data)
-                        message = f"Neuer Eintrag eingefügt mit ID {inserted_id}"
+                # Die Handler committen selbst und laufen deshalb als
+                # exklusive Einheit im Schreib-Thread
+                message = write_coordinator.run_exclusive(apply_handler_form, handler_name, form_data, obj_id)
             except Exception as e:
                 message = f"Fehler: {e}"
 
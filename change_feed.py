@@ -0,0 +1,88 @@
+import queue
+import threading
+from typing import Optional, Dict, Any, List, Set
+
+# Verteilt die Tabellenänderungen jedes Commits an offene Tabellenansichten
+# (Server-Sent Events). Der Commit-Listener reiht nur IDs ein; das Laden
+# und Rendern der Zeilen erledigt der Request-Thread des jeweiligen
+# Abonnenten, damit der Schreib-Thread nicht aufgehalten wird.
+
+# So viele Commits darf ein Abonnent im Rückstand sein, danach bekommt er
+# statt einzelner Änderungen einmal den vollständigen Tabelleninhalt
+FEED_MAX_BACKLOG = 100
+
+class FeedSubscription:
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self._queue: "queue.Queue[Optional[Set[Any]]]" = queue.Queue(maxsize=FEED_MAX_BACKLOG)
+        self.overflowed = False
+        self.last_sequence = 0
+
+    def push(self, ids: Optional[Set[Any]], sequence: int) -> None:
+        self.last_sequence = sequence
+        try:
+            self._queue.put_nowait(None if ids is None else set(ids))
+        except queue.Full:
+            self.overflowed = True
+
+    def wait(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wartet auf Änderungen und fasst alles Angefallene zusammen:
+        {"ids": {...} oder None für "unbekannt/alles", "sequence": n}.
+        Liefert None, wenn innerhalb von timeout nichts passiert ist.
+        """
+        try:
+            first = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        ids: Optional[Set[Any]] = first
+        while True:
+            try:
+                more = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if ids is not None:
+                ids = None if more is None else ids | more
+        if self.overflowed:
+            self.overflowed = False
+            ids = None
+        return {"ids": ids, "sequence": self.last_sequence}
+
+class ChangeFeed:
+    """Commit-Listener, der Änderungen an die Abonnenten einer Tabelle verteilt."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[FeedSubscription]] = {}
+        self._sequence = 0
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    def subscribe(self, table_name: str) -> FeedSubscription:
+        subscription = FeedSubscription(table_name)
+        with self._lock:
+            subscription.last_sequence = self._sequence
+            self._subscribers.setdefault(table_name, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: FeedSubscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.table_name, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.table_name, None)
+
+    def on_commit(self, changes: Dict[str, Optional[Set[Any]]]) -> None:
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+            targets = [
+                (subscription, ids)
+                for table_name, ids in changes.items()
+                for subscription in self._subscribers.get(table_name, ())
+            ]
+        for subscription, ids in targets:
+            subscription.push(ids, sequence)
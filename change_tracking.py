@@ -0,0 +1,212 @@
+import threading
+from typing import Optional, Dict, Any, Callable, List, Set, Tuple, Hashable
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Versionszähler pro Tabelle. Jeder Commit, der eine Tabelle verändert,
+# erhöht deren Version; Caches können sich so an den Tabellenversionen
+# orientieren, statt bei jedem Request neu zu rechnen.
+
+_lock = threading.Lock()
+_versions: Dict[str, int] = {}
+_commit_listeners: List[Callable[[Dict[str, Optional[Set[Any]]]], None]] = []
+
+PENDING_KEY = "pending_table_changes"
+
+def get_version(table_name: str) -> int:
+    return _versions.get(table_name, 0)
+
+def get_versions(*table_names: str) -> Tuple[int, ...]:
+    return tuple(_versions.get(t, 0) for t in table_names)
+
+def bump_versions(changes: Dict[str, Optional[Set[Any]]]) -> None:
+    if not changes:
+        return
+    with _lock:
+        for table_name in changes:
+            _versions[table_name] = _versions.get(table_name, 0) + 1
+    for listener in list(_commit_listeners):
+        try:
+            listener(changes)
+        except Exception as e:
+            print(f"❌ Fehler im Commit-Listener {listener}: {e}")
+
+def register_commit_listener(listener: Callable[[Dict[str, Optional[Set[Any]]]], None]) -> None:
+    """
+    Registriert eine Funktion, die nach jedem erfolgreichen Commit mit den
+    geänderten Tabellen aufgerufen wird: {tabellenname: {ids} oder None}.
+    None bedeutet, dass die betroffenen Zeilen nicht bekannt sind.
+    """
+    _commit_listeners.append(listener)
+
+def record_change(session: Session, table_name: str, ids: Optional[Any] = None) -> None:
+    """
+    Merkt eine Änderung für den nächsten Commit der Session vor. Für
+    Schreibpfade, die an der ORM-Unit-of-Work vorbei direkt SQL ausführen.
+    """
+    pending = session.info.setdefault(PENDING_KEY, {})
+    if ids is None:
+        pending[table_name] = None
+        return
+    if table_name in pending and pending[table_name] is None:
+        return
+    if not isinstance(ids, (set, list, tuple)):
+        ids = [ids]
+    pending.setdefault(table_name, set()).update(i for i in ids if i is not None)
+
+_cascade_cache: Dict[str, Tuple[str, ...]] = {}
+
+def cascade_tables(table) -> Tuple[str, ...]:
+    """
+    Tabellen, die die Datenbank beim Löschen aus table über ON DELETE
+    CASCADE/SET NULL selbst mitändert (transitiv). Diese Änderungen sieht
+    das ORM nicht; sie werden ohne IDs vorgemerkt.
+    """
+    cached = _cascade_cache.get(table.name)
+    if cached is not None:
+        return cached
+    affected = set()
+    visited = set()
+    stack = [table]
+    while stack:
+        current = stack.pop()
+        if current.name in visited:
+            continue
+        visited.add(current.name)
+        for other in table.metadata.tables.values():
+            for fk in other.foreign_keys:
+                ondelete = (fk.ondelete or "").upper()
+                if fk.column.table is not current or ondelete not in ("CASCADE", "SET NULL"):
+                    continue
+                affected.add(other.name)
+                if ondelete == "CASCADE":
+                    stack.append(other)
+    affected.discard(table.name)
+    result = tuple(sorted(affected))
+    _cascade_cache[table.name] = result
+    return result
+
+def record_delete(session: Session, table, ids: Optional[Any] = None) -> None:
+    """Merkt gelöschte Zeilen samt der von der Datenbank kaskadierten Tabellen vor."""
+    record_change(session, table.name, ids)
+    for name in cascade_tables(table):
+        record_change(session, name, None)
+
+def _object_id(obj: Any) -> Optional[Any]:
+    try:
+        return getattr(obj, "id", None)
+    except Exception:
+        return None
+
+@event.listens_for(Session, "after_flush")
+def _collect_flush_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        table = getattr(obj, "__table__", None)
+        if table is None:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        record_change(session, table.name, _object_id(obj))
+    for obj in session.deleted:
+        table = getattr(obj, "__table__", None)
+        if table is not None:
+            record_delete(session, table, _object_id(obj))
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_statement_changes(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    statement = orm_execute_state.statement
+    table = getattr(statement, "table", None)
+    name = getattr(table, "name", None)
+    if not name:
+        return
+
+    # ORM-Bulk-UPDATE nach Primärschlüssel (update(Model) mit einer Liste
+    # von Parametern ohne WHERE): die betroffenen IDs stehen in den Parametern
+    params = orm_execute_state.parameters
+    if (orm_execute_state.is_update and statement.whereclause is None
+            and isinstance(params, list) and params and all("id" in p for p in params)):
+        record_change(orm_execute_state.session, name, [p["id"] for p in params])
+        return
+
+    if orm_execute_state.is_delete:
+        record_delete(orm_execute_state.session, table, None)
+        return
+    record_change(orm_execute_state.session, name, None)
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    # after_commit kommt auch beim Freigeben eines SAVEPOINTs; veröffentlicht
+    # wird erst, wenn die äußere Transaktion wirklich committet ist
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop(PENDING_KEY, None)
+    if changes:
+        bump_versions(changes)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
+
+class VersionedCache:
+    """
+    Kleiner In-Memory-Cache, dessen Einträge an Tabellenversionen gebunden
+    sind. Ändert sich eine der Tabellen, wird der Eintrag beim nächsten
+    Zugriff neu berechnet.
+    """
+
+    def __init__(self, tables: Tuple[str, ...], max_entries: int = 256):
+        self.tables = tuple(tables)
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[Tuple[int, ...], Any]] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        versions = get_versions(*self.tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                return entry[1]
+        value = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (versions, value)
+        return value
+
+    def get_many_or_compute(self, keys: List[Hashable], compute_missing: Callable[[List[Hashable]], Dict[Hashable, Any]]) -> Dict[Hashable, Any]:
+        """
+        Wie get_or_compute für viele Schlüssel: alle fehlenden oder veralteten
+        Einträge werden mit einem einzigen Aufruf von compute_missing berechnet.
+        Schlüssel, für die compute_missing nichts liefert, fehlen im Ergebnis.
+        """
+        versions = get_versions(*self.tables)
+        result = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == versions:
+                    result[key] = entry[1]
+                else:
+                    missing.append(key)
+        if not missing:
+            return result
+
+        computed = compute_missing(missing)
+        with self._lock:
+            if len(self._entries) + len(computed) > self.max_entries:
+                self._entries.clear()
+            for key, value in computed.items():
+                self._entries[key] = (versions, value)
+        result.update(computed)
+        return result
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -0,0 +1,190 @@
+import datetime
+from typing import Optional, Dict, Any, Callable, Iterable, List
+from sqlalchemy import select, func, insert, delete, event
+from sqlalchemy.orm import Session, attributes
+from db_defs import Transponder, TransponderCustodyEvent, TransponderCustodySnapshot, TransponderCustodySnapshotRun
+from change_tracking import record_change
+
+# Besitzhistorie der Transponder. Jede Ausgabe, Rückgabe oder Korrektur
+# hängt ein Ereignis an; Zeitpunktabfragen lesen den letzten Snapshot vor
+# dem Stichtag und nur die Ereignisse zwischen Snapshot und Stichtag.
+
+EVENT_TABLE = TransponderCustodyEvent.__table__
+SNAPSHOT_TABLE = TransponderCustodySnapshot.__table__
+SNAPSHOT_RUN_TABLE = TransponderCustodySnapshotRun.__table__
+
+# Quelle der Ereignisse, die der ORM-Listener schreibt; Routen setzen sie
+# über session.info, z.B. "tabelle" oder "wizard"
+CUSTODY_SOURCE_KEY = "custody_source"
+
+# Nach so vielen neuen Ereignissen wird ein neuer Snapshot angelegt
+CUSTODY_SNAPSHOT_INTERVAL = 500
+# Snapshots liegen eine Woche in der Vergangenheit, damit normal
+# rückdatierte Ausgaben sie nicht gleich wieder ungültig machen
+CUSTODY_SNAPSHOT_LAG = datetime.timedelta(days=7)
+
+CUSTODY_FIELDS = ("owner_id", "got_date", "return_date")
+
+def custody_event_row(transponder_id: int, serial_number: Optional[str], owner_id: Optional[int],
+                      got_date: Optional[datetime.date], return_date: Optional[datetime.date],
+                      source: str) -> Dict[str, Any]:
+    """Leitet aus dem neuen Zustand eines Transponders das zugehörige Ereignis ab."""
+    today = datetime.date.today()
+    if return_date is not None:
+        event_type, holder, event_date = "rueckgabe", None, return_date
+    elif owner_id is not None:
+        event_type, holder, event_date = "ausgabe", owner_id, got_date or today
+    else:
+        event_type, holder, event_date = "korrektur", None, today
+    return {
+        "transponder_id": transponder_id,
+        "serial_number": serial_number,
+        "event_type": event_type,
+        "owner_id": holder,
+        "event_date": event_date,
+        "source": source,
+    }
+
+def record_custody_events(session: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    Schreibt Ereignisse über die Verbindung der laufenden Transaktion. Liegt
+    ein Ereignis vor einem vorhandenen Snapshot, wird dieser verworfen, da
+    er den Zustand an seinem Stichtag nicht mehr korrekt wiedergibt.
+    """
+    if not rows:
+        return
+    now = datetime.datetime.utcnow()
+    for row in rows:
+        row.setdefault("recorded_at", now)
+
+    connection = session.connection()
+    connection.execute(insert(EVENT_TABLE), rows)
+    earliest = min(row["event_date"] for row in rows)
+    result = connection.execute(delete(SNAPSHOT_TABLE).where(SNAPSHOT_TABLE.c.snapshot_date >= earliest))
+    runs = connection.execute(delete(SNAPSHOT_RUN_TABLE).where(SNAPSHOT_RUN_TABLE.c.snapshot_date >= earliest))
+
+    record_change(session, EVENT_TABLE.name, None)
+    if result.rowcount:
+        record_change(session, SNAPSHOT_TABLE.name, None)
+    if runs.rowcount:
+        record_change(session, SNAPSHOT_RUN_TABLE.name, None)
+
+@event.listens_for(Session, "after_flush")
+def _record_orm_custody_changes(session, flush_context):
+    source = session.info.get(CUSTODY_SOURCE_KEY, "orm")
+    rows = []
+    for obj in session.new:
+        if isinstance(obj, Transponder) and (obj.owner_id is not None or obj.return_date is not None):
+            rows.append(custody_event_row(obj.id, obj.serial_number, obj.owner_id, obj.got_date, obj.return_date, source))
+    for obj in session.dirty:
+        if not isinstance(obj, Transponder):
+            continue
+        if any(attributes.get_history(obj, key).has_changes() for key in CUSTODY_FIELDS):
+            rows.append(custody_event_row(obj.id, obj.serial_number, obj.owner_id, obj.got_date, obj.return_date, source))
+    record_custody_events(session, rows)
+
+def custody_history(session: Session, transponder_id: int) -> List[TransponderCustodyEvent]:
+    return session.execute(
+        select(TransponderCustodyEvent)
+        .where(TransponderCustodyEvent.transponder_id == transponder_id)
+        .order_by(TransponderCustodyEvent.event_date, TransponderCustodyEvent.id)
+    ).scalars().all()
+
+def holder_at(session: Session, transponder_id: int, when: datetime.date) -> Optional[TransponderCustodyEvent]:
+    """Letztes Ereignis bis einschließlich when, eine einzelne Indexsuche."""
+    return session.execute(
+        select(TransponderCustodyEvent)
+        .where(TransponderCustodyEvent.transponder_id == transponder_id, TransponderCustodyEvent.event_date <= when)
+        .order_by(TransponderCustodyEvent.event_date.desc(), TransponderCustodyEvent.id.desc())
+        .limit(1)
+    ).scalars().first()
+
+def find_transponder_ids_by_serial(session: Session, serial_number: str) -> List[int]:
+    """Auch gelöschte Transponder lassen sich über die Seriennummer im Protokoll finden."""
+    return session.execute(
+        select(TransponderCustodyEvent.transponder_id)
+        .where(TransponderCustodyEvent.serial_number == serial_number)
+        .distinct()
+    ).scalars().all()
+
+def custody_at(session: Session, when: datetime.date, transponder_ids: Optional[Iterable[int]] = None) -> Dict[int, Optional[int]]:
+    """
+    Besitzstand zum Stichtag: {transponder_id: owner_id oder None}. Startet
+    beim letzten Snapshot vor when und wendet nur die Ereignisse danach an.
+    """
+    ids = set(transponder_ids) if transponder_ids is not None else None
+
+    # Maßgeblich ist der Snapshot-Lauf, nicht die Zeilen: ein leerer
+    # Snapshot bedeutet "zum Stichtag war nichts ausgegeben"
+    snapshot_date = session.execute(
+        select(func.max(TransponderCustodySnapshotRun.snapshot_date))
+        .where(TransponderCustodySnapshotRun.snapshot_date <= when)
+    ).scalar()
+
+    state: Dict[int, Optional[int]] = {}
+    if snapshot_date is not None:
+        stmt = select(TransponderCustodySnapshot.transponder_id, TransponderCustodySnapshot.owner_id).where(
+            TransponderCustodySnapshot.snapshot_date == snapshot_date
+        )
+        if ids is not None:
+            stmt = stmt.where(TransponderCustodySnapshot.transponder_id.in_(ids))
+        state.update(session.execute(stmt).tuples().all())
+
+    stmt = select(TransponderCustodyEvent.transponder_id, TransponderCustodyEvent.owner_id).where(
+        TransponderCustodyEvent.event_date <= when
+    )
+    if snapshot_date is not None:
+        stmt = stmt.where(TransponderCustodyEvent.event_date > snapshot_date)
+    if ids is not None:
+        stmt = stmt.where(TransponderCustodyEvent.transponder_id.in_(ids))
+    for transponder_id, owner_id in session.execute(
+        stmt.order_by(TransponderCustodyEvent.event_date, TransponderCustodyEvent.id)
+    ):
+        state[transponder_id] = owner_id
+    return state
+
+def create_snapshot(session: Session, snapshot_date: Optional[datetime.date] = None) -> int:
+    """Legt einen Snapshot zum Stichtag an (Standard: heute minus CUSTODY_SNAPSHOT_LAG) und gibt die Zeilenzahl zurück."""
+    snapshot_date = snapshot_date or (datetime.date.today() - CUSTODY_SNAPSHOT_LAG)
+    state = custody_at(session, snapshot_date)
+    # Höchste beim Anlegen bekannte Ereignis-ID; Grundlage für die Zählung
+    # neuer Ereignisse bis zum nächsten Snapshot
+    last_event_id = session.execute(select(func.max(TransponderCustodyEvent.id))).scalar()
+
+    session.execute(delete(TransponderCustodySnapshot).where(TransponderCustodySnapshot.snapshot_date == snapshot_date))
+    session.execute(delete(TransponderCustodySnapshotRun).where(TransponderCustodySnapshotRun.snapshot_date == snapshot_date))
+    # Der Lauf wird auch bei leerem Besitzstand festgehalten, sonst bliebe
+    # events_since_last_snapshot über der Schwelle und jeder weitere Commit
+    # würde erneut einen Snapshot versuchen
+    session.execute(insert(TransponderCustodySnapshotRun), [{
+        "snapshot_date": snapshot_date, "last_event_id": last_event_id, "created_at": datetime.datetime.utcnow()
+    }])
+    if state:
+        session.execute(insert(TransponderCustodySnapshot), [
+            {"snapshot_date": snapshot_date, "transponder_id": t, "owner_id": o, "last_event_id": last_event_id}
+            for t, o in state.items()
+        ])
+    session.commit()
+    return len(state)
+
+def events_since_last_snapshot(session: Session) -> int:
+    covered = session.execute(select(func.max(TransponderCustodySnapshotRun.last_event_id))).scalar() or 0
+    return session.execute(
+        select(func.count(TransponderCustodyEvent.id)).where(TransponderCustodyEvent.id > covered)
+    ).scalar() or 0
+
+def snapshot_commit_listener(session_factory: Callable[[], Session]):
+    """Commit-Listener, der nach genügend neuen Ereignissen einen Snapshot anlegt."""
+    def on_commit(changes):
+        if EVENT_TABLE.name not in changes:
+            return
+        session = session_factory()
+        try:
+            if events_since_last_snapshot(session) >= CUSTODY_SNAPSHOT_INTERVAL:
+                create_snapshot(session)
+        except Exception as e:
+            session.rollback()
+            print(f"❌ Fehler beim Anlegen des Besitz-Snapshots: {e}")
+        finally:
+            session.close()
+    return on_commit
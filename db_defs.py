@@ -1,28 +1,36 @@
+import sqlite3
+import datetime
+import unicodedata
 from typing import Optional, Dict, Any, Type, List
-from sqlalchemy import (create_engine, Column, Integer, String, Text, ForeignKey, Date, Float, TIMESTAMP, UniqueConstraint)
+from sqlalchemy.engine import Engine
+from sqlalchemy import (create_engine, Column, Integer, String, Text, ForeignKey, Date, Float, TIMESTAMP, UniqueConstraint, Index, event, select, text, func)
 from sqlalchemy.orm.util import AliasedClass
 from sqlalchemy.inspection import inspect
 from sqlalchemy.exc import NoInspectionAvailable
 from sqlalchemy.orm import declarative_base, relationship, Session, class_mapper, RelationshipProperty, aliased, joinedload
+from serializers import serializer_for
 
 class CustomBase:
     def to_dict(self, recursive=False):
         try:
-            result = {col.name: getattr(self, col.name) for col in self.__table__.columns}
-            if recursive:
-                for rel in self.__mapper__.relationships:
-                    val = getattr(self, rel.key)
-                    if isinstance(val, list):
-                        result[rel.key] = [x.to_dict(recursive=False) if hasattr(x, 'to_dict') else {} for x in val]
-                    elif val is not None:
-                        result[rel.key] = val.to_dict(recursive=False) if hasattr(val, 'to_dict') else {}
-            return result
+            return serializer_for(type(self), depth=1 if recursive else 0)(self)
         except Exception as e:
             print(f"❌ Fehler bei to_dict: {e}")
             return {}
 
 Base = declarative_base(cls=CustomBase)
 
+# SQLite prüft Fremdschlüssel nur, wenn es pro Verbindung eingeschaltet
+# wird; erst damit greifen die ondelete-Regeln (CASCADE/SET NULL) der
+# Modelle, und die Beziehungen können mit passive_deletes arbeiten, statt
+# vor dem Löschen alle Kindzeilen zu laden.
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 class Person(Base):
     __tablename__ = "person"
     id = Column(Integer, primary_key=True)
@@ -31,14 +39,22 @@ class Person(Base):
     last_name = Column(Text)
     comment = Column(Text)
     image_url = Column(Text)
+    # Normalisierte Suchschlüssel ("nachname vorname" / "vorname nachname")
+    # für die Präfixsuche der Personen-Autovervollständigung
+    name_search = Column(Text, index=True)
+    name_search_first = Column(Text, index=True)
+    # Zeilenversion für optimistisches Sperren bei Zellenänderungen
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    # Interne Suchschlüssel gehören nicht in die Ausgabe
+    __serializer_exclude__ = ("name_search", "name_search_first")
 
-    contacts = relationship("PersonContact", back_populates="person", cascade="all, delete")
-    rooms = relationship("PersonToRoom", back_populates="person", cascade="all, delete")
-    transponders_issued = relationship("Transponder", foreign_keys="[Transponder.issuer_id]", back_populates="issuer")
-    transponders_owned = relationship("Transponder", foreign_keys="[Transponder.owner_id]", back_populates="owner")
-    departments = relationship("Abteilung", back_populates="leiter")
-    person_abteilungen = relationship("PersonToAbteilung", back_populates="person", cascade="all, delete")
-    professorships = relationship("ProfessorshipToPerson", back_populates="person", cascade="all, delete")
+    contacts = relationship("PersonContact", back_populates="person", cascade="all, delete", passive_deletes=True)
+    rooms = relationship("PersonToRoom", back_populates="person", cascade="all, delete", passive_deletes=True)
+    transponders_issued = relationship("Transponder", foreign_keys="[Transponder.issuer_id]", back_populates="issuer", passive_deletes=True)
+    transponders_owned = relationship("Transponder", foreign_keys="[Transponder.owner_id]", back_populates="owner", passive_deletes=True)
+    departments = relationship("Abteilung", back_populates="leiter", passive_deletes=True)
+    person_abteilungen = relationship("PersonToAbteilung", back_populates="person", cascade="all, delete", passive_deletes=True)
+    professorships = relationship("ProfessorshipToPerson", back_populates="person", cascade="all, delete", passive_deletes=True)
     
     __table_args__ = (
         UniqueConstraint("title", "first_name", "last_name", name="uq_person_name_title"),
@@ -53,13 +69,35 @@ class Person(Base):
             print(f"❌ Fehler bei get_all in PersonHandler: {e}")
             return []
 
-    def to_dict(self) -> Dict[str, Any]:
-        try:
-            return {col.name: getattr(self, col.name) for col in self.__table__.columns}
-        except Exception as e:
-            print(f"❌ Fehler bei to_dict in PersonHandler: {e}")
-            return {}
 
+def normalize_search_text(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    value = value.replace("ß", "ss").replace("ẞ", "ss")
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return " ".join(value.lower().split())
+
+def person_search_keys(first_name: Optional[str], last_name: Optional[str]) -> Dict[str, str]:
+    return {
+        "name_search": normalize_search_text(f"{last_name or ''} {first_name or ''}"),
+        "name_search_first": normalize_search_text(f"{first_name or ''} {last_name or ''}"),
+    }
+
+@event.listens_for(Person, "before_insert")
+@event.listens_for(Person, "before_update")
+def _update_person_search_keys(mapper, connection, target):
+    for key, value in person_search_keys(target.first_name, target.last_name).items():
+        setattr(target, key, value)
+
+@event.listens_for(Base, "before_update", propagate=True)
+def _bump_row_version(mapper, connection, target):
+    """Auch Änderungen über das ORM erhöhen die Zeilenversion."""
+    if "version" not in mapper.columns:
+        return
+    session = Session.object_session(target)
+    if session is not None and session.is_modified(target, include_collections=False):
+        target.version = (target.version or 0) + 1
 
 class PersonContact(Base):
     __tablename__ = "person_contact"
@@ -83,7 +121,7 @@ class Abteilung(Base):
     name = Column(Text)
     abteilungsleiter_id = Column(Integer, ForeignKey("person.id", ondelete="SET NULL"))
     leiter = relationship("Person", back_populates="departments")
-    persons = relationship("PersonToAbteilung", back_populates="abteilung", cascade="all, delete")
+    persons = relationship("PersonToAbteilung", back_populates="abteilung", cascade="all, delete", passive_deletes=True)
     
     __table_args__ = (
         UniqueConstraint("name", name="uq_abteilung_name"),
@@ -105,7 +143,7 @@ class Kostenstelle(Base):
     __tablename__ = "kostenstelle"
     id = Column(Integer, primary_key=True)
     name = Column(Text)
-    professorships = relationship("Professorship", back_populates="kostenstelle")
+    professorships = relationship("Professorship", back_populates="kostenstelle", passive_deletes=True)
     
     __table_args__ = (
         UniqueConstraint("name", name="uq_kostenstelle_name"),
@@ -117,7 +155,7 @@ class Professorship(Base):
     kostenstelle_id = Column(Integer, ForeignKey("kostenstelle.id", ondelete="SET NULL"))
     name = Column(Text)
     kostenstelle = relationship("Kostenstelle", back_populates="professorships")
-    persons = relationship("ProfessorshipToPerson", back_populates="professorship", cascade="all, delete")
+    persons = relationship("ProfessorshipToPerson", back_populates="professorship", cascade="all, delete", passive_deletes=True)
     
     __table_args__ = (
         UniqueConstraint("kostenstelle_id", "name", name="uq_professorship_per_kostenstelle"),
@@ -141,7 +179,7 @@ class Building(Base):
     name = Column(Text)
     building_number = Column(Text)
     abkuerzung = Column(Text)
-    rooms = relationship("Room", back_populates="building")
+    rooms = relationship("Room", back_populates="building", passive_deletes=True)
 
 class Room(Base):
     __tablename__ = "room"
@@ -150,12 +188,13 @@ class Room(Base):
     name = Column(Text)
     floor = Column(Integer)
     building = relationship("Building", back_populates="rooms")
-    person_links = relationship("PersonToRoom", back_populates="room", cascade="all, delete")
-    transponder_links = relationship("TransponderToRoom", back_populates="room", cascade="all, delete")
-    layout = relationship("RoomLayout", back_populates="room", uselist=False, cascade="all, delete")
+    person_links = relationship("PersonToRoom", back_populates="room", cascade="all, delete", passive_deletes=True)
+    transponder_links = relationship("TransponderToRoom", back_populates="room", cascade="all, delete", passive_deletes=True)
+    layout = relationship("RoomLayout", back_populates="room", uselist=False, cascade="all, delete", passive_deletes=True)
 
     __table_args__ = (
         UniqueConstraint("building_id", "name", name="uq_room_per_building"),
+        Index("ix_room_building_floor", "building_id", "floor"),
     )
 
 class PersonToRoom(Base):
@@ -168,6 +207,7 @@ class PersonToRoom(Base):
     
     __table_args__ = (
         UniqueConstraint("person_id", "room_id", name="uq_person_to_room"),
+        Index("ix_person_to_room_room", "room_id", "person_id"),
     )
 
 class Transponder(Base):
@@ -179,12 +219,14 @@ class Transponder(Base):
     return_date = Column("return_date", Date)
     serial_number = Column(Text)
     comment = Column(Text)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     issuer = relationship("Person", foreign_keys=[issuer_id], back_populates="transponders_issued")
     owner = relationship("Person", foreign_keys=[owner_id], back_populates="transponders_owned")
-    room_links = relationship("TransponderToRoom", back_populates="transponder", cascade="all, delete")
+    room_links = relationship("TransponderToRoom", back_populates="transponder", cascade="all, delete", passive_deletes=True)
     
     __table_args__ = (
         UniqueConstraint("serial_number", name="uq_transponder_serial"),
+        Index("ix_transponder_return_got", "return_date", "got_date"),
     )
 
 class TransponderToRoom(Base):
@@ -197,13 +239,64 @@ class TransponderToRoom(Base):
 
     __table_args__ = (
         UniqueConstraint("transponder_id", "room_id", name="uq_transponder_to_room"),
+        Index("ix_transponder_to_room_room", "room_id", "transponder_id"),
+    )
+
+class TransponderCustodyEvent(Base):
+    """
+    Append-only-Protokoll der Transponder-Besitzwechsel. Jeder Eintrag hält
+    den Besitzer ab event_date fest (None = zurückgegeben). Bewusst ohne
+    Fremdschlüssel, damit die Historie das Löschen eines Transponders
+    übersteht.
+    """
+    __tablename__ = "transponder_custody_event"
+    __append_only__ = True
+    id = Column(Integer, primary_key=True)
+    transponder_id = Column(Integer, nullable=False)
+    serial_number = Column(Text)
+    event_type = Column(String(20), nullable=False)
+    owner_id = Column(Integer)
+    event_date = Column(Date, nullable=False)
+    source = Column(String(30))
+    recorded_at = Column(TIMESTAMP)
+
+    __table_args__ = (
+        Index("ix_custody_event_transponder_date", "transponder_id", "event_date", "id"),
+        Index("ix_custody_event_date", "event_date", "id"),
+        Index("ix_custody_event_serial_date", "serial_number", "event_date"),
     )
 
+class TransponderCustodySnapshot(Base):
+    """Besitzstand aller Transponder zu einem Stichtag, damit Zeitpunktabfragen nicht die ganze Historie lesen."""
+    __tablename__ = "transponder_custody_snapshot"
+    __append_only__ = True
+    id = Column(Integer, primary_key=True)
+    snapshot_date = Column(Date, nullable=False)
+    transponder_id = Column(Integer, nullable=False)
+    owner_id = Column(Integer)
+    last_event_id = Column(Integer)
+
+    __table_args__ = (
+        UniqueConstraint("snapshot_date", "transponder_id", name="uq_custody_snapshot"),
+    )
+
+class TransponderCustodySnapshotRun(Base):
+    """
+    Ein Eintrag pro angelegtem Snapshot, auch wenn zum Stichtag kein
+    Transponder ausgegeben war und der Snapshot selbst keine Zeilen hat.
+    """
+    __tablename__ = "transponder_custody_snapshot_run"
+    __append_only__ = True
+    id = Column(Integer, primary_key=True)
+    snapshot_date = Column(Date, nullable=False, unique=True)
+    last_event_id = Column(Integer)
+    created_at = Column(TIMESTAMP, default=datetime.datetime.utcnow)
+
 class ObjectCategory(Base):
     __tablename__ = "object_category"
     id = Column(Integer, primary_key=True)
     name = Column(Text)
-    objects = relationship("Object", back_populates="category")
+    objects = relationship("Object", back_populates="category", passive_deletes=True)
     
     __table_args__ = (
         UniqueConstraint("name", name="uq_object_category_name"),
@@ -257,6 +350,7 @@ class Inventory(Base):
     raum_id = Column(Integer, ForeignKey("room.id", ondelete="SET NULL"))
     professorship_id = Column(Integer, ForeignKey("professorship.id", ondelete="SET NULL"))
     abteilung_id = Column(Integer, ForeignKey("abteilung.id", ondelete="SET NULL"))
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
 
     owner = relationship("Person", foreign_keys=[owner_id], lazy="joined")
     issuer = relationship("Person", foreign_keys=[issuer_id], lazy="joined")
@@ -266,6 +360,59 @@ class Inventory(Base):
     professorship = relationship("Professorship", lazy="joined")
     room = relationship("Room", foreign_keys=[raum_id], lazy="joined")
 
+    __table_args__ = (
+        Index("ix_inventory_return_got", "return_date", "got_date"),
+        Index("ix_inventory_raum", "raum_id", "price"),
+    )
+
+class AccessChangeLog(Base):
+    """
+    Von Triggern gefülltes Protokoll geänderter Transponder. Darüber sieht
+    der Zugangsindex jedes Prozesses auch Commits anderer Prozesse; seq
+    ist dank AUTOINCREMENT streng monoton.
+    """
+    __tablename__ = "access_change_log"
+    __append_only__ = True
+    seq = Column(Integer, primary_key=True)
+    transponder_id = Column(Integer, nullable=False)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+# So viele Einträge bleiben stehen; ein Prozess, der weiter zurückliegt,
+# baut seinen Index neu auf
+ACCESS_CHANGE_LOG_KEEP = 10000
+
+ACCESS_CHANGE_LOG_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS access_log_transponder_insert AFTER INSERT ON transponder BEGIN
+        INSERT INTO access_change_log (transponder_id) VALUES (new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS access_log_transponder_update
+    AFTER UPDATE OF id, owner_id, return_date, serial_number ON transponder BEGIN
+        INSERT INTO access_change_log (transponder_id) VALUES (old.id);
+        INSERT INTO access_change_log (transponder_id) SELECT new.id WHERE new.id != old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS access_log_transponder_delete AFTER DELETE ON transponder BEGIN
+        INSERT INTO access_change_log (transponder_id) VALUES (old.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS access_log_link_insert AFTER INSERT ON transponder_to_room
+    WHEN new.transponder_id IS NOT NULL BEGIN
+        INSERT INTO access_change_log (transponder_id) VALUES (new.transponder_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS access_log_link_update AFTER UPDATE ON transponder_to_room BEGIN
+        INSERT INTO access_change_log (transponder_id) SELECT old.transponder_id WHERE old.transponder_id IS NOT NULL;
+        INSERT INTO access_change_log (transponder_id)
+            SELECT new.transponder_id WHERE new.transponder_id IS NOT NULL AND new.transponder_id IS NOT old.transponder_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS access_log_link_delete AFTER DELETE ON transponder_to_room
+    WHEN old.transponder_id IS NOT NULL BEGIN
+        INSERT INTO access_change_log (transponder_id) VALUES (old.transponder_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS access_log_prune AFTER INSERT ON access_change_log
+    WHEN new.seq % 1000 = 0 BEGIN
+        DELETE FROM access_change_log WHERE seq <= new.seq - {ACCESS_CHANGE_LOG_KEEP};
+    END""",
+]
+
 class RoomLayout(Base):
     __tablename__ = "room_layout"
     id = Column(Integer, primary_key=True)
@@ -276,3 +423,129 @@ class RoomLayout(Base):
     height = Column(Integer, nullable=False)
 
     room = relationship("Room", back_populates="layout")
+
+    __table_args__ = (
+        # Ein Rechteck pro Raum; Grundlage für das Upsert des Karteneditors
+        Index("ux_room_layout_room", "room_id", unique=True),
+    )
+
+# R*Tree über die Raumrechtecke für Treffer- und Ausschnittsabfragen des
+# Karteneditors. Neben x/y sind Gebäude und Etage eigene Dimensionen, damit
+# eine Abfrage direkt nur die Rechtecke einer Etage durchsucht. Die
+# Trigger halten den Index bei allen Schreibwegen aktuell, auch bei
+# ON DELETE CASCADE und wenn ein Raum Gebäude oder Etage wechselt.
+ROOM_LAYOUT_RTREE = "room_layout_rtree"
+
+_RTREE_ROWS = """
+    SELECT l.id, l.x, l.x + l.width, l.y, l.y + l.height, r.building_id, r.building_id, r.floor, r.floor
+    FROM room_layout l JOIN room r ON r.id = l.room_id
+    WHERE r.building_id IS NOT NULL AND r.floor IS NOT NULL
+"""
+
+ROOM_LAYOUT_RTREE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {ROOM_LAYOUT_RTREE} USING rtree_i32(
+        id, min_x, max_x, min_y, max_y, min_building, max_building, min_floor, max_floor
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS room_layout_rtree_insert AFTER INSERT ON room_layout BEGIN
+        INSERT INTO {ROOM_LAYOUT_RTREE} {_RTREE_ROWS} AND l.id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS room_layout_rtree_update AFTER UPDATE ON room_layout BEGIN
+        DELETE FROM {ROOM_LAYOUT_RTREE} WHERE id = old.id;
+        INSERT INTO {ROOM_LAYOUT_RTREE} {_RTREE_ROWS} AND l.id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS room_layout_rtree_delete AFTER DELETE ON room_layout BEGIN
+        DELETE FROM {ROOM_LAYOUT_RTREE} WHERE id = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS room_layout_rtree_room_update AFTER UPDATE OF building_id, floor ON room BEGIN
+        DELETE FROM {ROOM_LAYOUT_RTREE} WHERE id IN (SELECT id FROM room_layout WHERE room_id = new.id);
+        INSERT INTO {ROOM_LAYOUT_RTREE} {_RTREE_ROWS} AND l.room_id = new.id;
+    END""",
+]
+
+def _ensure_room_layout_rtree(conn) -> None:
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ROOM_LAYOUT_RTREE,)
+    ).first() is not None
+    for ddl in ROOM_LAYOUT_RTREE_DDL:
+        conn.exec_driver_sql(ddl)
+    if not exists:
+        conn.exec_driver_sql(f"INSERT INTO {ROOM_LAYOUT_RTREE} {_RTREE_ROWS}")
+
+def ensure_schema(engine) -> None:
+    """
+    Legt fehlende Tabellen an und ergänzt in bestehenden Datenbanken neu
+    hinzugekommene Spalten und Indizes, da create_all bestehende Tabellen
+    nicht verändert.
+    """
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'
+                if column.server_default is not None:
+                    # SQLite erlaubt NOT NULL beim Nachrüsten nur mit Standardwert
+                    ddl += f" DEFAULT {column.server_default.arg.text}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+        # Bestehende Ausgaben als Ausgangspunkt der Besitzhistorie übernehmen
+        has_events = conn.execute(select(TransponderCustodyEvent.id).limit(1)).first() is not None
+        if not has_events:
+            rows = []
+            now = datetime.datetime.utcnow()
+            for t in conn.execute(select(
+                Transponder.id, Transponder.serial_number, Transponder.owner_id,
+                Transponder.got_date, Transponder.return_date
+            )):
+                base = {"transponder_id": t.id, "serial_number": t.serial_number, "source": "bestand", "recorded_at": now}
+                if t.owner_id is not None:
+                    rows.append({**base, "event_type": "ausgabe", "owner_id": t.owner_id,
+                                 "event_date": t.got_date or t.return_date or now.date()})
+                if t.return_date is not None:
+                    rows.append({**base, "event_type": "rueckgabe", "owner_id": None, "event_date": t.return_date})
+            if rows:
+                conn.execute(TransponderCustodyEvent.__table__.insert(), rows)
+
+        # Snapshots aus der Zeit vor der Snapshot-Tabelle nachtragen
+        has_runs = conn.execute(select(TransponderCustodySnapshotRun.id).limit(1)).first() is not None
+        if not has_runs:
+            snapshots = TransponderCustodySnapshot.__table__
+            conn.execute(
+                TransponderCustodySnapshotRun.__table__.insert().from_select(
+                    ["snapshot_date", "last_event_id"],
+                    select(snapshots.c.snapshot_date, func.max(snapshots.c.last_event_id)).group_by(snapshots.c.snapshot_date)
+                )
+            )
+
+        # Altbestand aus der Zeit ohne Fremdschlüsselprüfung: verwaiste
+        # Verweise blockieren erst spätere Änderungen an genau diesen Zeilen
+        orphans = conn.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+        if orphans:
+            tables = sorted({row[0] for row in orphans})
+            print(f"⚠️ {len(orphans)} Zeilen mit ungültigen Fremdschlüsseln in: {', '.join(tables)}")
+
+        for ddl in ACCESS_CHANGE_LOG_DDL:
+            conn.exec_driver_sql(ddl)
+
+        try:
+            _ensure_room_layout_rtree(conn)
+        except Exception as e:
+            # Ohne R*Tree-Modul (SQLITE_ENABLE_RTREE) stehen nur die Raumabfragen nicht zur Verfügung
+            print(f"❌ Fehler beim Anlegen des R*Tree-Index für Raumlayouts: {e}")
+
+        missing = conn.execute(
+            select(Person.id, Person.first_name, Person.last_name).where(Person.name_search.is_(None))
+        ).all()
+        for person_id, first_name, last_name in missing:
+            conn.execute(
+                Person.__table__.update().where(Person.id == person_id).values(**person_search_keys(first_name, last_name))
+            )
@@ -7,6 +7,7 @@ from db_defs import (
     Building, Room, PersonToRoom, Transponder, TransponderToRoom
 )
 from sqlalchemy.exc import IntegrityError
+from serializers import serializer_for
 
 class AbstractDBHandler:
     def __init__(self, session: Session, model: Type):
@@ -187,7 +188,7 @@ class AbstractDBHandler:
 
     def to_dict(self, instance: Any) -> Dict[str, Any]:
         try:
-            return {col.name: getattr(instance, col.name) for col in instance.__table__.columns}
+            return serializer_for(type(instance))(instance)
         except Exception as e:
             print(f"❌ Fehler bei to_dict: {e}")
             return {}
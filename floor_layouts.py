@@ -0,0 +1,246 @@
+import sys
+import json
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy import select, delete, table, column
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db_defs import Building, Room, RoomLayout, ROOM_LAYOUT_RTREE
+from change_tracking import record_change
+
+# Raumrechtecke einer Etage für den Karteneditor. Räume werden über
+# (building_id, name) zugeordnet; ein PUT ersetzt das Layout der ganzen
+# Etage in einer Transaktion.
+
+LAYOUT_FIELDS = ("x", "y", "width", "height")
+LAYOUT_MAX_ROOMS = 2000
+# Obergrenze für Ausschnittsabfragen, damit ein herausgezoomter Viewport
+# nicht den ganzen Campus auf einmal lädt
+LAYOUT_QUERY_LIMIT = 500
+
+# Der R*Tree aus db_defs.ensure_schema; Gebäude und Etage sind eigene
+# Dimensionen, jede Abfrage ist damit eine reine Indexsuche
+layout_rtree = table(
+    ROOM_LAYOUT_RTREE,
+    column("id"), column("min_x"), column("max_x"), column("min_y"), column("max_y"),
+    column("min_building"), column("max_building"), column("min_floor"), column("max_floor"),
+)
+
+class LayoutValidationError(ValueError):
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+def resolve_building(session, key: str) -> Optional[Building]:
+    """Gebäude über ID, Abkürzung oder Namen."""
+    if key.isdigit():
+        return session.get(Building, int(key))
+    return session.execute(
+        select(Building).where((Building.abkuerzung == key) | (Building.name == key)).limit(1)
+    ).scalars().first()
+
+def parse_layout_data(data: Any) -> List[Dict[str, Any]]:
+    """
+    Akzeptiert den Export des Karteneditors ({"rooms": [...], "snapzones": [...]})
+    und das ältere Dateiformat (Liste von Räumen wie in sechste_etage.txt).
+    Snapzones werden nicht gespeichert.
+    """
+    if isinstance(data, dict):
+        data = data.get("rooms")
+    if not isinstance(data, list):
+        raise LayoutValidationError(["rooms muss eine Liste sein"])
+    if len(data) > LAYOUT_MAX_ROOMS:
+        raise LayoutValidationError([f"Maximal {LAYOUT_MAX_ROOMS} Räume pro Etage"])
+
+    errors = []
+    rects = []
+    seen = set()
+    for i, raw in enumerate(data, start=1):
+        if not isinstance(raw, dict):
+            errors.append(f"Eintrag {i}: kein Objekt")
+            continue
+        name = str(raw.get("name") or "").strip()
+        if not name:
+            errors.append(f"Eintrag {i}: Raumname fehlt")
+            continue
+        if name in seen:
+            errors.append(f"Raum {name} kommt mehrfach vor")
+            continue
+        seen.add(name)
+        try:
+            rect = {field: int(round(float(raw[field]))) for field in LAYOUT_FIELDS}
+        except (KeyError, TypeError, ValueError):
+            errors.append(f"Raum {name}: x, y, width und height müssen Zahlen sein")
+            continue
+        if rect["x"] < 0 or rect["y"] < 0 or rect["width"] <= 0 or rect["height"] <= 0:
+            errors.append(f"Raum {name}: ungültiges Rechteck")
+            continue
+        rects.append({"name": name, **rect})
+    if errors:
+        raise LayoutValidationError(errors)
+    return rects
+
+def load_floor_layout(session, building_id: int, floor: int) -> Dict[str, Any]:
+    rows = session.execute(
+        select(Room.id, Room.name, RoomLayout.x, RoomLayout.y, RoomLayout.width, RoomLayout.height)
+        .outerjoin(RoomLayout, RoomLayout.room_id == Room.id)
+        .where(Room.building_id == building_id, Room.floor == floor)
+        .order_by(Room.name)
+    ).all()
+    rooms = []
+    unplaced = []
+    for room_id, name, x, y, width, height in rows:
+        if x is None:
+            unplaced.append({"room_id": room_id, "name": name})
+        else:
+            rooms.append({"room_id": room_id, "name": name, "x": x, "y": y, "width": width, "height": height})
+    return {"rooms": rooms, "unplaced": unplaced}
+
+def save_floor_layout(session, building_id: int, floor: int, rects: List[Dict[str, Any]], create_missing: bool = False) -> Dict[str, Any]:
+    """
+    Ersetzt das Layout einer Etage: ein Upsert für alle Rechtecke, danach
+    werden Layouts von Räumen der Etage entfernt, die nicht mehr vorkommen.
+    Committet nicht selbst.
+    """
+    names = [rect["name"] for rect in rects]
+    matches: Dict[str, List[Tuple[int, Optional[int]]]] = {}
+    if names:
+        for room_id, name, room_floor in session.execute(
+            select(Room.id, Room.name, Room.floor).where(Room.building_id == building_id, Room.name.in_(names))
+        ):
+            matches.setdefault(name, []).append((room_id, room_floor))
+
+    errors = []
+    missing = []
+    room_ids: Dict[str, int] = {}
+    for name in names:
+        found = matches.get(name, [])
+        if len(found) > 1:
+            errors.append(f"Raum {name} ist im Gebäude mehrfach vorhanden")
+        elif not found:
+            missing.append(name)
+        elif found[0][1] not in (None, floor):
+            errors.append(f"Raum {name} liegt laut Datenbank in Etage {found[0][1]}")
+        else:
+            room_ids[name] = found[0][0]
+    if missing and not create_missing:
+        errors.append(f"Unbekannte Räume: {', '.join(missing)}")
+    if errors:
+        raise LayoutValidationError(errors)
+
+    connection = session.connection()
+    if missing:
+        created = connection.execute(
+            Room.__table__.insert().returning(Room.__table__.c.id, Room.__table__.c.name),
+            [{"building_id": building_id, "name": name, "floor": floor} for name in missing]
+        ).all()
+        room_ids.update({name: room_id for room_id, name in created})
+        record_change(session, Room.__tablename__, [room_id for room_id, _ in created])
+
+    # Räume ohne Etage gehören ab jetzt zu dieser Etage
+    unassigned = [room_id for name, found in matches.items() for room_id, room_floor in found if room_floor is None]
+    if unassigned:
+        connection.execute(Room.__table__.update().where(Room.__table__.c.id.in_(unassigned)).values(floor=floor))
+        record_change(session, Room.__tablename__, unassigned)
+
+    if rects:
+        stmt = sqlite_insert(RoomLayout.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RoomLayout.__table__.c.room_id],
+            set_={field: stmt.excluded[field] for field in LAYOUT_FIELDS}
+        )
+        connection.execute(stmt, [
+            {"room_id": room_ids[rect["name"]], **{field: rect[field] for field in LAYOUT_FIELDS}}
+            for rect in rects
+        ])
+
+    floor_rooms = select(Room.id).where(Room.building_id == building_id, Room.floor == floor)
+    removed = connection.execute(
+        delete(RoomLayout.__table__)
+        .where(RoomLayout.__table__.c.room_id.in_(floor_rooms), RoomLayout.__table__.c.room_id.not_in(list(room_ids.values())))
+    ).rowcount
+    record_change(session, RoomLayout.__tablename__, None)
+    return {"saved": len(rects), "created_rooms": missing, "removed": removed}
+
+# Räumliche Abfragen
+
+def _rtree_rooms(session, building_id: int, floor: int, *conditions, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    rt = layout_rtree.c
+    stmt = (
+        select(Room.id, Room.name, RoomLayout.x, RoomLayout.y, RoomLayout.width, RoomLayout.height)
+        .select_from(layout_rtree)
+        .join(RoomLayout, RoomLayout.id == rt.id)
+        .join(Room, Room.id == RoomLayout.room_id)
+        .where(
+            rt.min_building <= building_id, rt.max_building >= building_id,
+            rt.min_floor <= floor, rt.max_floor >= floor,
+            *conditions
+        )
+        # Kleinste Fläche zuerst: bei verschachtelten Rechtecken gewinnt der innere Raum
+        .order_by((RoomLayout.width * RoomLayout.height), Room.name)
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return [
+        {"room_id": room_id, "name": name, "x": x, "y": y, "width": width, "height": height}
+        for room_id, name, x, y, width, height in session.execute(stmt)
+    ]
+
+def rooms_at_point(session, building_id: int, floor: int, x: float, y: float) -> List[Dict[str, Any]]:
+    """Räume, deren Rechteck den Punkt enthält (Rand eingeschlossen)."""
+    rt = layout_rtree.c
+    return _rtree_rooms(session, building_id, floor, rt.min_x <= x, rt.max_x >= x, rt.min_y <= y, rt.max_y >= y)
+
+def rooms_in_box(session, building_id: int, floor: int, x1: float, y1: float, x2: float, y2: float,
+                 limit: int = LAYOUT_QUERY_LIMIT) -> List[Dict[str, Any]]:
+    """Räume, die den Ausschnitt berühren, z.B. den sichtbaren Viewport."""
+    rt = layout_rtree.c
+    x1, x2 = sorted((x1, x2))
+    y1, y2 = sorted((y1, y2))
+    return _rtree_rooms(session, building_id, floor, rt.min_x <= x2, rt.max_x >= x1, rt.min_y <= y2, rt.max_y >= y1, limit=limit)
+
+def overlapping_rooms(session, building_id: int, floor: int, x: float, y: float, width: float, height: float,
+                      exclude_room_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Räume, die sich mit dem Rechteck echt überschneiden. Gemeinsame Kanten
+    zählen nicht, Räume dürfen also aneinanderstoßen. exclude_room_id lässt
+    den gerade bearbeiteten Raum selbst weg.
+    """
+    rt = layout_rtree.c
+    conditions = [rt.min_x < x + width, rt.max_x > x, rt.min_y < y + height, rt.max_y > y]
+    if exclude_room_id is not None:
+        conditions.append(Room.id != exclude_room_id)
+    return _rtree_rooms(session, building_id, floor, *conditions)
+
+def import_layout_file(session, path: str, building_id: int, floor: int, create_missing: bool = False) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        rects = parse_layout_data(json.load(f))
+    result = save_floor_layout(session, building_id, floor, rects, create_missing)
+    session.commit()
+    return result
+
+if __name__ == "__main__":
+    # python floor_layouts.py import <datei> <gebäude> <etage> [--create-missing]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) != 4 or args[0] != "import":
+        print("Aufruf: python floor_layouts.py import <datei> <gebäude> <etage> [--create-missing]")
+        sys.exit(1)
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from db_defs import ensure_schema
+
+    engine = create_engine("sqlite:///database.db")
+    ensure_schema(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        building = resolve_building(session, args[2])
+        if building is None:
+            print(f"❌ Gebäude {args[2]} nicht gefunden")
+            sys.exit(1)
+        result = import_layout_file(session, args[1], building.id, int(args[3]), "--create-missing" in sys.argv)
+        print(f"{result['saved']} Räume übernommen, {len(result['created_rooms'])} neu angelegt, {result['removed']} Layouts entfernt")
+    except LayoutValidationError as e:
+        session.rollback()
+        for error in e.errors:
+            print(f"❌ {error}")
+        sys.exit(1)
+    finally:
+        session.close()
@@ -0,0 +1,126 @@
+import os
+import re
+import sys
+import json
+import math
+import shutil
+import hashlib
+from typing import Optional, Dict, Any
+
+# Kachelpyramide für Etagenpläne. Ein Offline-Schritt zerlegt das Bild in
+# TILE_SIZE-Kacheln auf mehreren Zoomstufen; der Karteneditor lädt davon
+# nur die sichtbaren Kacheln der aktuellen Zoomstufe.
+#
+# Ablage: <FLOOR_TILE_DIR>/<gebäude-id>/<etage>/manifest.json und
+# <version>/<zoom>/<x>_<y>.png. Die Version ist ein Hash des Quellbilds und
+# Teil der Kachel-URL, daher dürfen Kacheln unbegrenzt gecacht werden.
+# Zoomstufe 0 passt in eine Kachel, die höchste Stufe ist Originalgröße.
+#
+# Pillow wird nur zum Erzeugen gebraucht, nicht zum Ausliefern.
+
+TILE_SIZE = 256
+MANIFEST_NAME = "manifest.json"
+FLOOR_TILE_DIR = os.environ.get("VERWALTUNG_TILE_DIR", "floor_tiles")
+
+_VERSION_RE = re.compile(r"^[0-9a-f]{16}$")
+
+def floor_dir(building_id: int, floor: int, root: str = FLOOR_TILE_DIR) -> str:
+    return os.path.join(root, str(int(building_id)), str(int(floor)))
+
+def load_manifest(building_id: int, floor: int, root: str = FLOOR_TILE_DIR) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(floor_dir(building_id, floor, root), MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def tile_directory(building_id: int, floor: int, version: str, zoom: int, root: str = FLOOR_TILE_DIR) -> Optional[str]:
+    """Verzeichnis der Kacheln einer Zoomstufe oder None bei ungültiger Version."""
+    if not _VERSION_RE.match(version):
+        return None
+    return os.path.join(floor_dir(building_id, floor, root), version, str(int(zoom)))
+
+def build_tiles(image_path: str, building_id: int, floor: int, root: str = FLOOR_TILE_DIR) -> Dict[str, Any]:
+    """
+    Erzeugt alle Zoomstufen und schreibt das Manifest zuletzt, sodass
+    Leser nie eine halb fertige Pyramide sehen. Ältere Versionen werden
+    danach entfernt. Unverändertes Quellbild: es wird nichts neu erzeugt.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("Zum Erzeugen der Kacheln wird Pillow benötigt (pip install Pillow)")
+
+    with open(image_path, "rb") as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:16]
+    target = floor_dir(building_id, floor, root)
+    manifest = load_manifest(building_id, floor, root)
+    if manifest is not None and manifest.get("version") == version:
+        return manifest
+
+    resample = getattr(Image, "Resampling", Image).LANCZOS
+    with Image.open(image_path) as source:
+        image = source.convert("RGBA") if source.mode not in ("RGB", "RGBA") else source.copy()
+    width, height = image.size
+    max_zoom = max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE)))
+
+    version_dir = os.path.join(target, version)
+    shutil.rmtree(version_dir, ignore_errors=True)
+    levels = []
+    level = image
+    # Von der Originalgröße abwärts, jede Stufe aus der vorherigen halbiert
+    for zoom in range(max_zoom, -1, -1):
+        if zoom != max_zoom:
+            level = level.resize((max(1, math.ceil(level.width / 2)), max(1, math.ceil(level.height / 2))), resample)
+        zoom_dir = os.path.join(version_dir, str(zoom))
+        os.makedirs(zoom_dir, exist_ok=True)
+        cols = math.ceil(level.width / TILE_SIZE)
+        rows = math.ceil(level.height / TILE_SIZE)
+        for x in range(cols):
+            for y in range(rows):
+                box = (x * TILE_SIZE, y * TILE_SIZE, min((x + 1) * TILE_SIZE, level.width), min((y + 1) * TILE_SIZE, level.height))
+                level.crop(box).save(os.path.join(zoom_dir, f"{x}_{y}.png"), optimize=True)
+        levels.append({"zoom": zoom, "width": level.width, "height": level.height, "cols": cols, "rows": rows})
+
+    manifest = {
+        "version": version,
+        "width": width,
+        "height": height,
+        "tile_size": TILE_SIZE,
+        "max_zoom": max_zoom,
+        "levels": sorted(levels, key=lambda l: l["zoom"]),
+    }
+    tmp_path = os.path.join(target, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(target, MANIFEST_NAME))
+
+    for name in os.listdir(target):
+        if name != version and _VERSION_RE.match(name):
+            shutil.rmtree(os.path.join(target, name), ignore_errors=True)
+    return manifest
+
+if __name__ == "__main__":
+    # python floor_tiles.py build <bild> <gebäude> <etage>
+    args = sys.argv[1:]
+    if len(args) != 4 or args[0] != "build":
+        print("Aufruf: python floor_tiles.py build <bild> <gebäude> <etage>")
+        sys.exit(1)
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from floor_layouts import resolve_building
+
+    session = sessionmaker(bind=create_engine("sqlite:///database.db"))()
+    try:
+        building = resolve_building(session, args[2])
+    finally:
+        session.close()
+    if building is None:
+        print(f"❌ Gebäude {args[2]} nicht gefunden")
+        sys.exit(1)
+    try:
+        result = build_tiles(args[1], building.id, int(args[3]))
+    except (RuntimeError, OSError) as e:
+        print(f"❌ Fehler beim Erzeugen der Kacheln: {e}")
+        sys.exit(1)
+    print(f"{len(result['levels'])} Zoomstufen für {result['width']}x{result['height']} erzeugt (Version {result['version']})")
@@ -0,0 +1,273 @@
+import io
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, BinaryIO, FrozenSet, Iterable, Iterator, List, Tuple
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import NameObject
+
+class PdfTemplate:
+    """
+    Einmal eingelesenes PDF-Formular. Der geparste Reader und die Liste der
+    Formularfelder werden wiederverwendet; pro Ausfüllvorgang wird nur noch
+    eine Kopie des Dokuments erzeugt.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        stat = os.stat(path)
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.reader = PdfReader(path)
+        self.field_names: FrozenSet[str] = frozenset((self.reader.get_fields() or {}).keys())
+        # Der Reader liest Objekte bei Bedarf aus seinem Stream nach und ist
+        # damit nicht threadsicher; das Klonen wird daher serialisiert
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        return f"{os.path.basename(self.path)}:{self.mtime_ns}:{self.size}"
+
+    def is_stale(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+    def new_writer(self) -> PdfWriter:
+        with self._lock:
+            return PdfWriter(clone_from=self.reader)
+
+class PdfTemplateRegistry:
+    def __init__(self):
+        self._templates: Dict[str, PdfTemplate] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> PdfTemplate:
+        key = os.path.abspath(path)
+        template = self._templates.get(key)
+        if template is not None and not template.is_stale():
+            return template
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None or template.is_stale():
+                template = PdfTemplate(key)
+                self._templates[key] = template
+            return template
+
+    def preload(self, *paths: str) -> None:
+        for path in paths:
+            try:
+                self.get(path)
+            except Exception as e:
+                print(f"❌ Fehler beim Vorladen der PDF-Vorlage {path}: {e}")
+
+template_registry = PdfTemplateRegistry()
+
+def fill_pdf_form(template_path, data_dict, flatten: bool = False) -> io.BytesIO:
+    template = template_registry.get(template_path)
+    writer = template.new_writer()
+
+    # Nur Felder übernehmen, die es im Formular auch gibt
+    filled_fields = {k: v for k, v in data_dict.items() if k in template.field_names}
+
+    # 📝 Formularfelder auf erster Seite aktualisieren
+    writer.update_page_form_field_values(writer.pages[0], filled_fields, flatten=flatten)
+
+    if flatten:
+        # Werte stehen jetzt im Seiteninhalt; ohne Formularfelder kollidieren
+        # gleichnamige Felder beim Zusammenfügen mehrerer Formulare nicht
+        writer.remove_annotations(subtypes="/Widget")
+        if "/AcroForm" in writer._root_object:
+            del writer._root_object[NameObject("/AcroForm")]
+
+    # Ergebnis zurückgeben
+    output_io = io.BytesIO()
+    writer.write(output_io)
+    output_io.seek(0)
+    return output_io
+
+class FilledPdfCache:
+    """
+    Inhaltsadressierter Festplatten-Cache für ausgefüllte Formulare.
+
+    Der Schlüssel ist ein SHA-256 über Vorlagenversion und Felddaten, gleiche
+    Eingaben ergeben also dieselbe Datei. Überschreitet der Cache seine
+    Maximalgröße, werden die am längsten nicht benutzten Dateien gelöscht.
+
+    Mehrere Prozesse teilen sich das Verzeichnis. Die Größe wird deshalb
+    beim Verdrängen aus dem Verzeichnis bestimmt statt mitgezählt, und
+    Aufrufer bekommen eine geöffnete Datei statt eines Pfads: eine offene
+    Datei bleibt lesbar, auch wenn sie inzwischen verdrängt wurde.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._created = False
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    @staticmethod
+    def make_key(template: PdfTemplate, data_dict: Dict[str, Any], flatten: bool = False) -> str:
+        payload = json.dumps(
+            {"template": template.version, "flatten": flatten, "fields": data_dict},
+            sort_keys=True, default=str, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _evict(self, keep: str) -> None:
+        """Löscht nach Änderungszeit (beim Lesen aktualisiert) die ältesten Dateien bis unter max_bytes."""
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pdf") or name[:-4] == keep:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+            total += stat.st_size
+        try:
+            total += os.path.getsize(self.path_for(keep))
+        except OSError:
+            pass
+        for _, name, size in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def open_or_create(self, template_path: str, data_dict: Dict[str, Any], flatten: bool = False) -> Tuple[BinaryIO, str]:
+        """Gibt (geöffnete Datei, Schlüssel) des ausgefüllten Formulars zurück; der Aufrufer schließt die Datei."""
+        template = template_registry.get(template_path)
+        key = self.make_key(template, data_dict, flatten)
+        path = self.path_for(key)
+
+        with self._lock:
+            if not self._created:
+                os.makedirs(self.directory, exist_ok=True)
+                self._created = True
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                # Nicht vorhanden oder gerade von einem anderen Prozess verdrängt
+                pass
+            else:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return f, key
+
+        data = fill_pdf_bytes(template_path, data_dict, flatten)
+
+        # Erst in eine temporäre Datei schreiben, damit parallele Leser nie
+        # eine halb geschriebene Datei sehen
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._evict(keep=key)
+        # Die eben erzeugten Bytes direkt ausliefern, die Datei kann schon
+        # wieder verdrängt sein
+        return io.BytesIO(data), key
+
+PDF_CACHE_DIR = os.environ.get("VERWALTUNG_PDF_CACHE_DIR", "pdf_cache")
+PDF_CACHE_MAX_BYTES = int(os.environ.get("VERWALTUNG_PDF_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+filled_pdf_cache = FilledPdfCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+
+# Stapelverarbeitung: das Ausfüllen läuft in einem Prozesspool, dessen
+# Worker die Vorlage beim Start einmal laden.
+BATCH_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+def _init_batch_worker(template_path: str) -> None:
+    template_registry.preload(template_path)
+
+def fill_pdf_bytes(template_path: str, data_dict: Dict[str, Any], flatten: bool = False) -> bytes:
+    return fill_pdf_form(template_path, data_dict, flatten=flatten).getvalue()
+
+def get_process_pool(template_path: str) -> ProcessPoolExecutor:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=BATCH_WORKERS,
+                initializer=_init_batch_worker,
+                initargs=(template_path,)
+            )
+        return _process_pool
+
+def fill_pdf_forms_parallel(template_path: str, jobs: List[Dict[str, Any]], flatten: bool = False) -> Iterator[bytes]:
+    """Füllt viele Formulare im Prozesspool; liefert die PDFs in Eingabereihenfolge."""
+    if not jobs:
+        return iter(())
+    pool = get_process_pool(template_path)
+    chunksize = max(1, len(jobs) // (BATCH_WORKERS * 4))
+    return pool.map(
+        fill_pdf_bytes,
+        [template_path] * len(jobs),
+        jobs,
+        [flatten] * len(jobs),
+        chunksize=chunksize
+    )
+
+def safe_filename(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", value).strip("_") or "formular"
+
+class _StreamBuffer(io.RawIOBase):
+    """Nicht-seekbarer Puffer, aus dem die bisher geschriebenen Bytes abgeholt werden."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip(files: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """Erzeugt ein ZIP-Archiv stückweise, jede Datei wird nach dem Schreiben ausgeliefert."""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+            chunk = buffer.pop()
+            if chunk:
+                yield chunk
+    chunk = buffer.pop()
+    if chunk:
+        yield chunk
+
+def merge_pdfs(documents: Iterable[bytes]) -> bytes:
+    writer = PdfWriter()
+    for data in documents:
+        writer.append(PdfReader(io.BytesIO(data)))
+    output_io = io.BytesIO()
+    writer.write(output_io)
+    return output_io.getvalue()
@@ -0,0 +1,276 @@
+import os
+import json
+import uuid
+import shutil
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, List, Tuple
+from sqlalchemy import create_engine, Column, String, Text, DateTime, select, delete, update
+from sqlalchemy.orm import declarative_base, sessionmaker
+from serializers import ModelSerializer
+from pdf_forms import filled_pdf_cache, fill_pdf_forms_parallel, merge_pdfs, stream_zip
+from pdf_signing import get_signer
+
+# Die Jobs liegen in einer eigenen SQLite-Datei, damit Statusupdates der
+# Worker nicht mit Schreibzugriffen auf die Hauptdatenbank konkurrieren.
+JobsBase = declarative_base()
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class PdfJob(JobsBase):
+    __tablename__ = "pdf_job"
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default=JOB_QUEUED, index=True)
+    params = Column(Text, nullable=False)
+    result_path = Column(Text)
+    download_name = Column(Text)
+    mimetype = Column(String(100))
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return PDF_JOB_SERIALIZER(self)
+
+PDF_JOB_SERIALIZER = ModelSerializer(
+    PdfJob,
+    fields=("id", "kind", "status", "error", "download_name", "created_at", "started_at", "finished_at"),
+    iso_dates=True
+)
+
+class QueueFullError(Exception):
+    pass
+
+# Ein Job-Handler erhält die gespeicherten Parameter und einen Zielpfad und
+# liefert (Dateiname für den Download, Mimetype) zurück.
+JobHandler = Callable[[Dict[str, Any], str], Tuple[str, str]]
+
+class PdfJobQueue:
+    """
+    Lokale Warteschlange für PDF-Erzeugung ohne externen Broker.
+
+    Aufträge werden in SQLite gespeichert und von einem kleinen Thread-Pool
+    abgearbeitet. Die Zahl der Worker und der wartenden Aufträge ist
+    begrenzt, damit PDF-Arbeit die interaktiven Requests nicht verdrängt.
+    """
+
+    def __init__(self, db_path: str, result_dir: str, max_workers: int = 2, max_queued: int = 100,
+                 retention: datetime.timedelta = datetime.timedelta(days=1),
+                 stale_after: datetime.timedelta = datetime.timedelta(minutes=30)):
+        self.engine = create_engine(f"sqlite:///{db_path}")
+        JobsBase.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.result_dir = result_dir
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.stale_after = stale_after
+        self._handlers: Dict[str, JobHandler] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pdf-job")
+            return self._executor
+
+    def start(self) -> None:
+        """
+        Nimmt nach einem Neustart liegengebliebene Aufträge wieder auf. Als
+        liegengeblieben gilt ein laufender Auftrag erst nach stale_after, da
+        andere Prozesse (weitere Worker, Reloader) ihn noch bearbeiten können.
+        """
+        os.makedirs(self.result_dir, exist_ok=True)
+        cutoff = datetime.datetime.utcnow() - self.stale_after
+        session = self.Session()
+        try:
+            session.execute(
+                update(PdfJob)
+                .where(PdfJob.status == JOB_RUNNING, (PdfJob.started_at < cutoff) | PdfJob.started_at.is_(None))
+                .values(status=JOB_QUEUED, started_at=None)
+            )
+            session.commit()
+            job_ids = session.execute(
+                select(PdfJob.id).where(PdfJob.status == JOB_QUEUED).order_by(PdfJob.created_at)
+            ).scalars().all()
+        finally:
+            session.close()
+        for job_id in job_ids:
+            self._dispatch(job_id)
+
+    def _dispatch(self, job_id: str) -> None:
+        with self._lock:
+            self._pending += 1
+        self._get_executor().submit(self._run, job_id)
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> str:
+        if kind not in self._handlers:
+            raise ValueError(f"Unbekannter Auftragstyp: {kind}")
+        with self._lock:
+            if self._pending >= self.max_queued:
+                raise QueueFullError("Zu viele PDF-Aufträge in der Warteschlange")
+
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        session = self.Session()
+        try:
+            session.add(PdfJob(id=job_id, kind=kind, status=JOB_QUEUED, params=json.dumps(params, default=str)))
+            session.commit()
+        finally:
+            session.close()
+        self._dispatch(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[PdfJob]:
+        session = self.Session()
+        try:
+            return session.get(PdfJob, job_id)
+        finally:
+            session.close()
+
+    def _set_status(self, job_id: str, **values) -> None:
+        session = self.Session()
+        try:
+            session.execute(update(PdfJob).where(PdfJob.id == job_id).values(**values))
+            session.commit()
+        finally:
+            session.close()
+
+    def _claim(self, job_id: str) -> Optional[PdfJob]:
+        """
+        Übernimmt einen wartenden Auftrag mit einem bedingten UPDATE, sodass
+        ihn auch bei mehreren Prozessen genau ein Worker bekommt.
+        """
+        session = self.Session()
+        try:
+            claimed = session.execute(
+                update(PdfJob)
+                .where(PdfJob.id == job_id, PdfJob.status == JOB_QUEUED)
+                .values(status=JOB_RUNNING, started_at=datetime.datetime.utcnow())
+            ).rowcount
+            session.commit()
+            return session.get(PdfJob, job_id) if claimed == 1 else None
+        finally:
+            session.close()
+
+    def _run(self, job_id: str) -> None:
+        try:
+            job = self._claim(job_id)
+            if job is None:
+                return
+
+            target = os.path.join(self.result_dir, job_id)
+            try:
+                handler = self._handlers[job.kind]
+                download_name, mimetype = handler(json.loads(job.params), target)
+            except Exception as e:
+                print(f"❌ Fehler bei PDF-Auftrag {job_id}: {e}")
+                if os.path.exists(target):
+                    os.remove(target)
+                self._set_status(job_id, status=JOB_FAILED, error=str(e), finished_at=datetime.datetime.utcnow())
+                return
+
+            self._set_status(
+                job_id, status=JOB_DONE, result_path=target, download_name=download_name,
+                mimetype=mimetype, finished_at=datetime.datetime.utcnow()
+            )
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def cleanup(self) -> None:
+        """Entfernt abgeschlossene Aufträge samt Ergebnisdatei nach Ablauf der Aufbewahrungszeit."""
+        cutoff = datetime.datetime.utcnow() - self.retention
+        session = self.Session()
+        try:
+            expired = session.execute(
+                select(PdfJob.id, PdfJob.result_path)
+                .where(PdfJob.status.in_((JOB_DONE, JOB_FAILED)), PdfJob.finished_at < cutoff)
+            ).all()
+            if not expired:
+                return
+            for _, result_path in expired:
+                if result_path and os.path.exists(result_path):
+                    try:
+                        os.remove(result_path)
+                    except OSError as e:
+                        print(f"❌ Fehler beim Löschen von {result_path}: {e}")
+            session.execute(delete(PdfJob).where(PdfJob.id.in_([job_id for job_id, _ in expired])))
+            session.commit()
+        finally:
+            session.close()
+
+# Handler für die Schließmedien-Formulare. Die Felddaten werden schon im
+# Request aus der Datenbank geladen, die Worker füllen nur noch aus.
+
+def _write_zip(target: str, files) -> None:
+    with open(target, "wb") as f:
+        for chunk in stream_zip(files):
+            f.write(chunk)
+
+def _require_signer():
+    signer = get_signer()
+    if signer is None:
+        raise RuntimeError("Signieren ist nicht konfiguriert")
+    return signer
+
+def _zip_name(name: str) -> str:
+    return os.path.splitext(name)[0] + ".zip"
+
+def fill_form_job(params: Dict[str, Any], target: str) -> Tuple[str, str]:
+    download_name = params.get("download_name") or "formular.pdf"
+    cached, _ = filled_pdf_cache.open_or_create(params["template"], params["fields"])
+    with cached:
+        if params.get("sign"):
+            _write_zip(target, _require_signer().sign_single(download_name, cached.read()))
+            return _zip_name(download_name), "application/zip"
+
+        # Kopie, da der Cache die Datei jederzeit verdrängen darf
+        with open(target, "wb") as f:
+            shutil.copyfileobj(cached, f)
+    return download_name, "application/pdf"
+
+def batch_form_job(params: Dict[str, Any], target: str) -> Tuple[str, str]:
+    jobs: List[Dict[str, Any]] = params["jobs"]
+    signer = _require_signer() if params.get("sign") else None
+
+    if params.get("format") == "pdf":
+        download_name = params.get("download_name") or "formulare.pdf"
+        documents = fill_pdf_forms_parallel(params["template"], jobs, flatten=True)
+        merged = merge_pdfs(documents)
+        if signer is not None:
+            _write_zip(target, signer.sign_single(download_name, merged))
+            return _zip_name(download_name), "application/zip"
+        with open(target, "wb") as f:
+            f.write(merged)
+        return download_name, "application/pdf"
+
+    files = zip(params["names"], fill_pdf_forms_parallel(params["template"], jobs))
+    if signer is not None:
+        files = signer.sign_batch(files)
+    _write_zip(target, files)
+    return params.get("download_name") or "formulare.zip", "application/zip"
+
+PDF_JOB_DB = os.environ.get("VERWALTUNG_PDF_JOB_DB", "pdf_jobs.db")
+PDF_JOB_DIR = os.environ.get("VERWALTUNG_PDF_JOB_DIR", "pdf_jobs")
+PDF_JOB_WORKERS = int(os.environ.get("VERWALTUNG_PDF_JOB_WORKERS", 2))
+PDF_JOB_MAX_QUEUED = int(os.environ.get("VERWALTUNG_PDF_JOB_MAX_QUEUED", 100))
+PDF_JOB_STALE_MINUTES = int(os.environ.get("VERWALTUNG_PDF_JOB_STALE_MINUTES", 30))
+
+pdf_job_queue = PdfJobQueue(
+    PDF_JOB_DB, PDF_JOB_DIR, max_workers=PDF_JOB_WORKERS, max_queued=PDF_JOB_MAX_QUEUED,
+    stale_after=datetime.timedelta(minutes=PDF_JOB_STALE_MINUTES)
+)
+pdf_job_queue.register("fill_form", fill_form_job)
+pdf_job_queue.register("batch_forms", batch_form_job)
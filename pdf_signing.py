@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import datetime
+import threading
+from typing import Optional, Iterable, Iterator, List, Tuple
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import pkcs7
+
+MANIFEST_NAME = "MANIFEST.json"
+SIGNATURE_SUFFIX = ".p7s"
+
+class PdfSigner:
+    """
+    Erzeugt abgesetzte PKCS#7-Signaturen (.p7s) für ausgefüllte Formulare.
+
+    Schlüssel und Zertifikat werden einmal geladen und danach für alle
+    Signaturen wiederverwendet. Auch im Stapel bekommt jedes Dokument eine
+    eigene Signatur, damit ein einzelnes Formular nach der Weitergabe für
+    sich prüfbar bleibt; zusätzlich gibt es auf Wunsch ein signiertes
+    Manifest mit den SHA-256-Prüfsummen aller Dateien.
+    """
+
+    def __init__(self, private_key, certificate: x509.Certificate, additional_certs: Optional[List[x509.Certificate]] = None):
+        self.private_key = private_key
+        self.certificate = certificate
+        self.additional_certs = list(additional_certs or [])
+
+    @classmethod
+    def from_files(cls, key_path: str, cert_path: str, password: Optional[str] = None) -> "PdfSigner":
+        with open(key_path, "rb") as f:
+            private_key = serialization.load_pem_private_key(
+                f.read(), password=password.encode("utf-8") if password else None
+            )
+        with open(cert_path, "rb") as f:
+            certs = x509.load_pem_x509_certificates(f.read())
+        return cls(private_key, certs[0], certs[1:])
+
+    def sign(self, data: bytes) -> bytes:
+        """Gibt eine DER-kodierte, abgesetzte Signatur über data zurück."""
+        builder = pkcs7.PKCS7SignatureBuilder().set_data(data).add_signer(
+            self.certificate, self.private_key, hashes.SHA256()
+        )
+        for cert in self.additional_certs:
+            builder = builder.add_certificate(cert)
+        return builder.sign(
+            serialization.Encoding.DER,
+            [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.Binary]
+        )
+
+    def sign_batch(self, files: Iterable[Tuple[str, bytes]], manifest: bool = True) -> Iterator[Tuple[str, bytes]]:
+        """
+        Reicht jede Datei zusammen mit ihrer abgesetzten Signatur durch und
+        hängt bei manifest=True am Ende Manifest und Manifest-Signatur an.
+        Alles entsteht im selben Durchlauf, sodass sich das mit stream_zip
+        kombinieren lässt.
+        """
+        digests = {}
+        for name, data in files:
+            digests[name] = hashlib.sha256(data).hexdigest()
+            yield from self.sign_single(name, data)
+        if not manifest:
+            return
+
+        manifest_data = json.dumps({
+            "algorithm": "sha256",
+            "signed_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+            "signer": self.certificate.subject.rfc4514_string(),
+            "files": digests,
+        }, indent=2, ensure_ascii=False).encode("utf-8")
+        yield MANIFEST_NAME, manifest_data
+        yield MANIFEST_NAME + SIGNATURE_SUFFIX, self.sign(manifest_data)
+
+    def sign_single(self, name: str, data: bytes) -> List[Tuple[str, bytes]]:
+        return [(name, data), (name + SIGNATURE_SUFFIX, self.sign(data))]
+
+SIGNING_KEY_PATH = os.environ.get("VERWALTUNG_SIGNING_KEY")
+SIGNING_CERT_PATH = os.environ.get("VERWALTUNG_SIGNING_CERT")
+SIGNING_KEY_PASSWORD = os.environ.get("VERWALTUNG_SIGNING_KEY_PASSWORD")
+
+_signer: Optional[PdfSigner] = None
+_signer_lock = threading.Lock()
+
+def get_signer() -> Optional[PdfSigner]:
+    """
+    Lädt den konfigurierten Signierschlüssel einmal pro Prozess; None, wenn
+    keiner eingerichtet ist oder er sich nicht laden lässt. Nach einem
+    Ladefehler wird es beim nächsten Aufruf erneut versucht.
+    """
+    global _signer
+    if _signer is not None or not (SIGNING_KEY_PATH and SIGNING_CERT_PATH):
+        return _signer
+    with _signer_lock:
+        if _signer is None:
+            try:
+                _signer = PdfSigner.from_files(SIGNING_KEY_PATH, SIGNING_CERT_PATH, SIGNING_KEY_PASSWORD)
+            except (OSError, ValueError, TypeError, IndexError) as e:
+                print(f"❌ Fehler beim Laden des Signierschlüssels ({SIGNING_KEY_PATH}, {SIGNING_CERT_PATH}): {e}")
+    return _signer
+
+def generate_test_credentials(directory: str, common_name: str = "Verwaltung Testsignatur") -> Tuple[str, str]:
+    """Erzeugt einen selbstsignierten Testschlüssel samt Zertifikat, nur für Entwicklung und Benchmarks."""
+    os.makedirs(directory, exist_ok=True)
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.KeyUsage(
+            digital_signature=True, content_commitment=True, key_encipherment=False,
+            data_encipherment=False, key_agreement=False, key_cert_sign=False,
+            crl_sign=False, encipher_only=False, decipher_only=False
+        ), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    key_path = os.path.join(directory, "signing_key.pem")
+    cert_path = os.path.join(directory, "signing_cert.pem")
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ))
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return key_path, cert_path
+
+def _benchmark(count: int, directory: str) -> None:
+    from pdf_forms import fill_pdf_bytes
+
+    key_path, cert_path = generate_test_credentials(directory)
+    signer = PdfSigner.from_files(key_path, cert_path)
+    template = "pdfs/ausgabe_schliessmedien.pdf"
+    documents = [
+        (f"form_{i}.pdf", fill_pdf_bytes(template, {"Text3": f"Testperson {i}"}))
+        for i in range(count)
+    ]
+
+    start = time.perf_counter()
+    for name, data in documents:
+        signer.sign_single(name, data)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in signer.sign_batch(documents):
+        pass
+    batch = time.perf_counter() - start
+
+    print(f"{count} Formulare einzeln signiert: {single * 1000:.1f} ms")
+    print(f"{count} Formulare als Stapel samt Manifest signiert: {batch * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    # python pdf_signing.py testkey <verzeichnis>
+    # python pdf_signing.py benchmark [anzahl] [verzeichnis]
+    if len(sys.argv) >= 3 and sys.argv[1] == "testkey":
+        key_path, cert_path = generate_test_credentials(sys.argv[2])
+        print(f"VERWALTUNG_SIGNING_KEY={key_path}")
+        print(f"VERWALTUNG_SIGNING_CERT={cert_path}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "benchmark":
+        _benchmark(
+            int(sys.argv[2]) if len(sys.argv) >= 3 else 100,
+            sys.argv[3] if len(sys.argv) >= 4 else "test_signing"
+        )
+    else:
+        print("Verwendung: python pdf_signing.py testkey <verzeichnis> | benchmark [anzahl] [verzeichnis]")
+        sys.exit(1)
@@ -0,0 +1,319 @@
+import datetime
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy import select, func, case, literal, null, union_all, distinct
+from sqlalchemy.orm import Session
+from db_defs import (
+    Inventory, Object, ObjectCategory, Room, Building,
+    Kostenstelle, Professorship, Abteilung, Person, Transponder, PersonToRoom, TransponderToRoom
+)
+from change_tracking import VersionedCache
+
+# Dimensionen für die Inventar-Wertübersicht: (ID-Spalte, Namensspalte)
+ROLLUP_DIMENSIONS = {
+    "kostenstelle": (Inventory.kostenstelle_id, Kostenstelle.name),
+    "professorship": (Inventory.professorship_id, Professorship.name),
+    "abteilung": (Inventory.abteilung_id, Abteilung.name),
+    "category": (Object.category_id, ObjectCategory.name),
+    "building": (Room.building_id, Building.name),
+    "room": (Inventory.raum_id, Room.name),
+}
+
+ROLLUP_LABELS = {
+    "kostenstelle": "Kostenstelle",
+    "professorship": "Professur",
+    "abteilung": "Abteilung",
+    "category": "Kategorie",
+    "building": "Gebäude",
+    "room": "Raum",
+}
+
+_rollup_cache = VersionedCache((
+    "inventory", "object", "object_category", "room", "building",
+    "kostenstelle", "professorship", "abteilung"
+))
+
+def parse_rollup_dimensions(value: Optional[str]) -> List[str]:
+    if not value:
+        return ["kostenstelle"]
+    dims = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"Unbekannte Dimension: {part}")
+        if part not in dims:
+            dims.append(part)
+    if not dims:
+        raise ValueError("Keine Dimension angegeben")
+    return dims
+
+def _inventory_rollup_base(columns: List[Any]):
+    return (
+        select(*columns)
+        .select_from(Inventory)
+        .outerjoin(Object, Inventory.object_id == Object.id)
+        .outerjoin(ObjectCategory, Object.category_id == ObjectCategory.id)
+        .outerjoin(Room, Inventory.raum_id == Room.id)
+        .outerjoin(Building, Room.building_id == Building.id)
+        .outerjoin(Kostenstelle, Inventory.kostenstelle_id == Kostenstelle.id)
+        .outerjoin(Professorship, Inventory.professorship_id == Professorship.id)
+        .outerjoin(Abteilung, Inventory.abteilung_id == Abteilung.id)
+    )
+
+def _build_rollup_statement(dims: List[str], filters: Dict[str, Optional[int]], only_unreturned: bool):
+    """
+    SQLite kennt kein GROUP BY ROLLUP, daher wird jede Ebene als eigenes
+    GROUP BY formuliert und per UNION ALL zusammengefügt. Die Spalte
+    "level" gibt an, wie viele Dimensionen in einer Zeile gruppiert sind
+    (0 = Gesamtsumme).
+    """
+    unreturned = func.sum(case((Inventory.return_date.is_(None), 1), else_=0))
+    selects = []
+
+    for level in range(len(dims), -1, -1):
+        columns = [literal(level).label("level")]
+        group_by = []
+        for i, dim in enumerate(dims):
+            id_col, name_col = ROLLUP_DIMENSIONS[dim]
+            if i < level:
+                columns += [id_col.label(f"{dim}_id"), name_col.label(f"{dim}_name")]
+                group_by += [id_col, name_col]
+            else:
+                columns += [null().label(f"{dim}_id"), null().label(f"{dim}_name")]
+        columns += [
+            func.coalesce(func.sum(Inventory.price), 0).label("total_price"),
+            func.count(Inventory.id).label("item_count"),
+            func.coalesce(unreturned, 0).label("unreturned_count"),
+        ]
+
+        stmt = _inventory_rollup_base(columns)
+        for dim, value in filters.items():
+            id_col = ROLLUP_DIMENSIONS[dim][0]
+            stmt = stmt.where(id_col.is_(None) if value is None else id_col == value)
+        if only_unreturned:
+            stmt = stmt.where(Inventory.return_date.is_(None))
+        if group_by:
+            stmt = stmt.group_by(*group_by)
+        selects.append(stmt)
+
+    combined = union_all(*selects).subquery("rollup")
+
+    # Zwischensummen direkt nach ihren Detailzeilen, Gesamtsumme am Ende
+    order_by = []
+    for i, dim in enumerate(dims):
+        order_by.append(case((combined.c.level <= i, 1), else_=0))
+        order_by.append(combined.c[f"{dim}_name"])
+        order_by.append(combined.c[f"{dim}_id"])
+    return select(combined).order_by(*order_by)
+
+def inventory_rollup(session: Session, dims: List[str], filters: Optional[Dict[str, Optional[int]]] = None, only_unreturned: bool = False) -> Dict[str, Any]:
+    filters = dict(filters or {})
+    for dim in filters:
+        if dim not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"Unbekannte Filter-Dimension: {dim}")
+
+    cache_key = (tuple(dims), tuple(sorted(filters.items(), key=lambda kv: kv[0])), only_unreturned)
+
+    def compute():
+        stmt = _build_rollup_statement(dims, filters, only_unreturned)
+        rows = []
+        for r in session.execute(stmt).mappings():
+            row = {
+                "level": r["level"],
+                "total_price": round(float(r["total_price"] or 0), 2),
+                "item_count": r["item_count"],
+                "unreturned_count": r["unreturned_count"],
+            }
+            for i, dim in enumerate(dims):
+                if i < r["level"]:
+                    row[dim] = {"id": r[f"{dim}_id"], "name": r[f"{dim}_name"]}
+                else:
+                    row[dim] = None
+            rows.append(row)
+        return {
+            "dimensions": list(dims),
+            "filters": filters,
+            "unreturned": only_unreturned,
+            "rows": rows,
+        }
+
+    return _rollup_cache.get_or_compute(cache_key, compute)
+
+def parse_rollup_filters(args) -> Dict[str, Optional[int]]:
+    """Liest Drill-down-Filter wie ?kostenstelle=3 oder ?abteilung=none."""
+    filters = {}
+    for dim in ROLLUP_DIMENSIONS:
+        raw = args.get(dim)
+        if raw is None or raw == "":
+            continue
+        if raw.lower() == "none":
+            filters[dim] = None
+        else:
+            filters[dim] = int(raw)
+    return filters
+
+# Ausgabe-/Rückgabebericht für Transponder und Inventar. Beide Modelle
+# haben einen Index auf (return_date, got_date), sodass "nicht
+# zurückgegeben und vor Stichtag ausgegeben" eine reine Indexsuche ist.
+OUTSTANDING_KINDS = {
+    "transponder": Transponder,
+    "inventory": Inventory,
+}
+
+_outstanding_caches = {
+    "transponder": VersionedCache(("transponder", "person")),
+    "inventory": VersionedCache(("inventory", "person", "object")),
+}
+
+def _outstanding_items(session: Session, model, cutoff: datetime.date, today: datetime.date) -> List[Dict[str, Any]]:
+    columns = [
+        model.id,
+        model.serial_number,
+        model.got_date,
+        model.owner_id,
+        Person.first_name,
+        Person.last_name,
+        (func.julianday(literal(today.isoformat())) - func.julianday(model.got_date)).label("days_outstanding"),
+    ]
+    stmt = select(*columns).select_from(model).outerjoin(Person, model.owner_id == Person.id)
+    if model is Inventory:
+        stmt = stmt.add_columns(Object.name.label("object_name")).outerjoin(Object, Inventory.object_id == Object.id)
+    stmt = (
+        stmt.where(model.return_date.is_(None), model.got_date <= cutoff)
+        .order_by(model.got_date, model.id)
+    )
+
+    items = []
+    for r in session.execute(stmt).mappings():
+        owner = " ".join(p for p in (r["first_name"], r["last_name"]) if p) or None
+        item = {
+            "id": r["id"],
+            "serial_number": r["serial_number"],
+            "got_date": r["got_date"].isoformat() if r["got_date"] else None,
+            "owner_id": r["owner_id"],
+            "owner": owner,
+            "days_outstanding": int(r["days_outstanding"]) if r["days_outstanding"] is not None else None,
+        }
+        if "object_name" in r:
+            item["object"] = r["object_name"]
+        items.append(item)
+    return items
+
+def _monthly_counts(session: Session, model, since: Optional[datetime.date]) -> List[Dict[str, Any]]:
+    issued = select(
+        func.strftime("%Y-%m", model.got_date).label("month"),
+        literal(1).label("issued"),
+        literal(0).label("returned"),
+    ).where(model.got_date.is_not(None))
+    returned = select(
+        func.strftime("%Y-%m", model.return_date).label("month"),
+        literal(0).label("issued"),
+        literal(1).label("returned"),
+    ).where(model.return_date.is_not(None))
+    if since is not None:
+        issued = issued.where(model.got_date >= since)
+        returned = returned.where(model.return_date >= since)
+
+    events = union_all(issued, returned).subquery("events")
+    stmt = (
+        select(events.c.month, func.sum(events.c.issued), func.sum(events.c.returned))
+        .group_by(events.c.month)
+        .order_by(events.c.month)
+    )
+    return [
+        {"month": month, "issued": int(issued_count or 0), "returned": int(returned_count or 0)}
+        for month, issued_count, returned_count in session.execute(stmt)
+    ]
+
+def outstanding_report(session: Session, kind: str, days: int, since: Optional[datetime.date] = None, today: Optional[datetime.date] = None) -> Dict[str, Any]:
+    if kind not in OUTSTANDING_KINDS:
+        raise ValueError(f"Unbekannte Art: {kind}")
+    if days < 0:
+        raise ValueError("days darf nicht negativ sein")
+
+    model = OUTSTANDING_KINDS[kind]
+    today = today or datetime.date.today()
+    cutoff = today - datetime.timedelta(days=days)
+
+    def compute():
+        return {
+            "kind": kind,
+            "days": days,
+            "cutoff": cutoff.isoformat(),
+            "overdue": _outstanding_items(session, model, cutoff, today),
+            "monthly": _monthly_counts(session, model, since),
+        }
+
+    # Das heutige Datum gehört zum Schlüssel, da sich der Stichtag täglich verschiebt
+    return _outstanding_caches[kind].get_or_compute((days, since, today), compute)
+
+# Belegung der Räume einer Etage für die Kartenansicht. Personen,
+# Inventar und Transponder werden je in einer gruppierten Unterabfrage auf
+# die Räume der Etage eingeschränkt und an die Räume gejoint, alles in
+# einer einzigen Abfrage. Als aktiv gilt ein ausgegebener, nicht
+# zurückgegebener Transponder.
+OCCUPANCY_FIELDS = ("person_count", "item_count", "item_value", "transponder_count")
+
+_occupancy_cache = VersionedCache((
+    "room", "person_to_room", "inventory", "transponder", "transponder_to_room"
+), max_entries=512)
+
+def _floor_occupancy_statement(building_id: int, floor: int):
+    floor_rooms = select(Room.id).where(Room.building_id == building_id, Room.floor == floor)
+    persons = (
+        select(PersonToRoom.room_id, func.count(distinct(PersonToRoom.person_id)).label("person_count"))
+        .where(PersonToRoom.room_id.in_(floor_rooms))
+        .group_by(PersonToRoom.room_id)
+        .subquery()
+    )
+    items = (
+        select(Inventory.raum_id.label("room_id"), func.count(Inventory.id).label("item_count"), func.sum(Inventory.price).label("item_value"))
+        .where(Inventory.raum_id.in_(floor_rooms))
+        .group_by(Inventory.raum_id)
+        .subquery()
+    )
+    transponders = (
+        select(TransponderToRoom.room_id, func.count(distinct(Transponder.id)).label("transponder_count"))
+        .join(Transponder, Transponder.id == TransponderToRoom.transponder_id)
+        .where(TransponderToRoom.room_id.in_(floor_rooms), Transponder.owner_id.is_not(None), Transponder.return_date.is_(None))
+        .group_by(TransponderToRoom.room_id)
+        .subquery()
+    )
+    return (
+        select(
+            Room.id, Room.name,
+            func.coalesce(persons.c.person_count, 0),
+            func.coalesce(items.c.item_count, 0),
+            func.coalesce(items.c.item_value, 0),
+            func.coalesce(transponders.c.transponder_count, 0),
+        )
+        .outerjoin(persons, persons.c.room_id == Room.id)
+        .outerjoin(items, items.c.room_id == Room.id)
+        .outerjoin(transponders, transponders.c.room_id == Room.id)
+        .where(Room.building_id == building_id, Room.floor == floor)
+        .order_by(Room.name)
+    )
+
+def floor_occupancy(session: Session, building_id: int, floor: int) -> Dict[str, Any]:
+    """{"rooms": [{room_id, name, person_count, ...}], "totals": {...}, "max": {...}}"""
+    def compute():
+        rooms = []
+        for room_id, name, person_count, item_count, item_value, transponder_count in session.execute(
+            _floor_occupancy_statement(building_id, floor)
+        ):
+            rooms.append({
+                "room_id": room_id,
+                "name": name,
+                "person_count": person_count,
+                "item_count": item_count,
+                "item_value": round(float(item_value), 2),
+                "transponder_count": transponder_count,
+            })
+        return {
+            "rooms": rooms,
+            "totals": {field: sum(r[field] for r in rooms) for field in OCCUPANCY_FIELDS},
+            "max": {field: max((r[field] for r in rooms), default=0) for field in OCCUPANCY_FIELDS},
+        }
+
+    return _occupancy_cache.get_or_compute((building_id, floor), compute)
@@ -0,0 +1,139 @@
+import datetime
+import threading
+from operator import attrgetter
+from typing import Optional, Dict, Any, Callable, Iterable, List, Tuple, Union
+from sqlalchemy import inspect as sa_inspect, Date, DateTime
+
+# Vorkompilierte Serialisierer für ORM-Objekte. Spalten, Beziehungen und
+# Konvertierungen werden einmal pro Modell aus dem Mapper gelesen; beim
+# Serialisieren bleibt nur noch eine Schleife über fertige Getter übrig.
+
+def _iso(value: Union[datetime.date, datetime.datetime]) -> str:
+    return value.isoformat()
+
+def _compile_path(mapper, path: str) -> Tuple[Callable[[Any], Any], bool, Any]:
+    """
+    Übersetzt einen Beziehungspfad wie "room_links.room" in einen Getter.
+    Liefert (getter, many, Zielmodell); many ist True, sobald ein Schritt
+    eine Liste ist. None-Werte auf dem Weg werden übersprungen.
+    """
+    steps = []
+    current = mapper
+    for key in path.split("."):
+        if key not in current.relationships:
+            raise ValueError(f"{current.class_.__name__} hat keine Beziehung {key}")
+        rel = current.relationships[key]
+        steps.append((attrgetter(key), rel.uselist))
+        current = rel.mapper
+    many = any(uselist for _, uselist in steps)
+
+    if len(steps) == 1:
+        return steps[0][0], many, current.class_
+
+    def get(obj):
+        values = [obj]
+        for getter, uselist in steps:
+            next_values = []
+            for value in values:
+                result = getter(value)
+                if uselist:
+                    next_values.extend(r for r in result if r is not None)
+                elif result is not None:
+                    next_values.append(result)
+            values = next_values
+        return values if many else (values[0] if values else None)
+
+    return get, many, current.class_
+
+class ModelSerializer:
+    """
+    Serialisierer für genau ein Modell.
+
+    fields:    erlaubte Spalten (Standard: alle außer exclude und
+               __serializer_exclude__ des Modells)
+    related:   {Ausgabename: Serialisierer | (Beziehungspfad, Serialisierer) | None}
+    coalesce:  {Spalte: Ersatzwert für None}
+    iso_dates: Datums-/Zeitspalten als ISO-String ausgeben (für JSON)
+    """
+
+    def __init__(self, model, fields: Optional[Iterable[str]] = None, exclude: Iterable[str] = (),
+                 related: Optional[Dict[str, Any]] = None, coalesce: Optional[Dict[str, Any]] = None,
+                 iso_dates: bool = False):
+        mapper = sa_inspect(model)
+        self.model = model
+        coalesce = coalesce or {}
+        excluded = set(exclude) | set(getattr(model, "__serializer_exclude__", ()))
+
+        if fields is None:
+            keys = [attr.key for attr in mapper.column_attrs if attr.key not in excluded]
+        else:
+            keys = list(fields)
+            for key in keys:
+                if key not in mapper.column_attrs:
+                    raise ValueError(f"{model.__name__} hat keine Spalte {key}")
+
+        columns = []
+        for key in keys:
+            column = mapper.column_attrs[key].columns[0]
+            convert = _iso if iso_dates and isinstance(column.type, (Date, DateTime)) else None
+            columns.append((key, attrgetter(key), convert, coalesce.get(key)))
+        self._columns = tuple(columns)
+
+        relations = []
+        for name, spec in (related or {}).items():
+            if isinstance(spec, tuple):
+                path, serializer = spec
+            else:
+                path, serializer = name, spec
+            getter, many, target = _compile_path(mapper, path)
+            if serializer is None:
+                serializer = serializer_for(target, iso_dates=iso_dates)
+            relations.append((name, getter, many, serializer))
+        self._relations = tuple(relations)
+
+    def __call__(self, obj: Any) -> Optional[Dict[str, Any]]:
+        if obj is None:
+            return None
+        data = {}
+        for key, getter, convert, default in self._columns:
+            value = getter(obj)
+            if value is None:
+                value = default
+            elif convert is not None:
+                value = convert(value)
+            data[key] = value
+        for name, getter, many, serializer in self._relations:
+            value = getter(obj)
+            if many:
+                data[name] = [serializer(v) for v in value if v is not None]
+            else:
+                data[name] = serializer(value)
+        return data
+
+    def many(self, objs: Iterable[Any]) -> List[Dict[str, Any]]:
+        return [self(obj) for obj in objs]
+
+_default_serializers: Dict[Tuple[Any, int, bool], ModelSerializer] = {}
+_default_lock = threading.Lock()
+
+def serializer_for(model, depth: int = 0, iso_dates: bool = False) -> ModelSerializer:
+    """
+    Standard-Serialisierer eines Modells: alle Spalten und, bei depth > 0,
+    alle Beziehungen bis zur angegebenen Tiefe. Wird pro Modell nur einmal
+    kompiliert.
+    """
+    key = (model, depth, iso_dates)
+    serializer = _default_serializers.get(key)
+    if serializer is not None:
+        return serializer
+
+    related = None
+    if depth > 0:
+        related = {
+            rel.key: serializer_for(rel.mapper.class_, depth - 1, iso_dates)
+            for rel in sa_inspect(model).relationships
+        }
+    serializer = ModelSerializer(model, related=related, iso_dates=iso_dates)
+    with _default_lock:
+        _default_serializers.setdefault(key, serializer)
+    return _default_serializers[key]
@@ -8,6 +8,9 @@ let selectedRoomId = null;
 let dragData = null; // {type: 'room'|'snapzone', id, ...}
 let resizeData = null;
 
+// Maßstab der Anzeige gegenüber den Plankoordinaten (Zoomstufe der Kacheln)
+let viewScale = 1;
+
 let roomCounter = 1;
 let snapzoneCounter = 1;
 
@@ -61,8 +64,8 @@ function updateOutput() {
 function getMousePos(evt) {
 	const rect = container.getBoundingClientRect();
 	return {
-		x: evt.clientX - rect.left,
-		y: evt.clientY - rect.top
+		x: (evt.clientX - rect.left + container.scrollLeft) / viewScale,
+		y: (evt.clientY - rect.top + container.scrollTop) / viewScale
 	};
 }
 function startDrawRoom() {
@@ -121,6 +124,7 @@ function createRoomElement(room) {
 		}
 	});
 
+	applyOccupancy(el, room);
 	enableDragResize(el, 'room', room);
 
 	return el;
@@ -213,8 +217,8 @@ window.addEventListener('mouseup', e => {
 window.addEventListener('mousemove', e => {
 	if(dragData) {
 		e.preventDefault();
-		const dx = e.clientX - dragData.startX;
-		const dy = e.clientY - dragData.startY;
+		const dx = (e.clientX - dragData.startX) / viewScale;
+		const dy = (e.clientY - dragData.startY) / viewScale;
 		const obj = (dragData.type === 'room' ? rooms : snapzones).find(o => o.id === dragData.id);
 		if(!obj) return;
 		obj.x = Math.max(0, dragData.origX + dx);
@@ -223,8 +227,8 @@ window.addEventListener('mousemove', e => {
 		updateOutput();
 	} else if(resizeData) {
 		e.preventDefault();
-		const dx = e.clientX - resizeData.startX;
-		const dy = e.clientY - resizeData.startY;
+		const dx = (e.clientX - resizeData.startX) / viewScale;
+		const dy = (e.clientY - resizeData.startY) / viewScale;
 		const obj = (resizeData.type === 'room' ? rooms : snapzones).find(o => o.id === resizeData.id);
 		if(!obj) return;
 		let x = obj.x, y = obj.y, w = resizeData.origWidth, h = resizeData.origHeight;
@@ -267,6 +271,7 @@ container.addEventListener('mousemove', e => {
 window.addEventListener('mouseup', e => {
 	if(currentMode === 'draw-room' && drawingRoom) {
 		if(drawingRoom.width > 5 && drawingRoom.height > 5) {
+			checkOverlap(drawingRoom);
 			rooms.push({
 				id: 'r' + roomCounter++,
 				name: '',
@@ -296,7 +301,7 @@ window.addEventListener('mouseup', e => {
 
 function drawTempRect(type, rect) {
 	removeTempRects();
-	const temp = createElement('div', type === 'room' ? 'room' : 'snapzone', container);
+	const temp = createElement('div', type === 'room' ? 'room' : 'snapzone', document.getElementById('overlay'));
 	temp.style.left = rect.x + 'px';
 	temp.style.top = rect.y + 'px';
 	temp.style.width = rect.width + 'px';
@@ -325,7 +330,244 @@ function renderAll() {
 	updateOutput();
 }
 
+// Laden und Speichern des Etagenlayouts über /api/floor/<gebäude>/<etage>/layout
+const buildingSelect = document.getElementById('building-select');
+const floorInput = document.getElementById('floor-input');
+const loadLayoutBtn = document.getElementById('load-layout-btn');
+const saveLayoutBtn = document.getElementById('save-layout-btn');
+const createMissingCheckbox = document.getElementById('create-missing-checkbox');
+const layoutStatus = document.getElementById('layout-status');
+
+function setLayoutStatus(text, isError) {
+	layoutStatus.textContent = text;
+	layoutStatus.style.color = isError ? 'red' : '';
+}
+function layoutUrl() {
+	if(!buildingSelect.value || floorInput.value === '') {
+		setLayoutStatus('Bitte Gebäude und Etage wählen', true);
+		return null;
+	}
+	return `/api/floor/${encodeURIComponent(buildingSelect.value)}/${parseInt(floorInput.value, 10)}/layout`;
+}
+function loadLayout() {
+	const url = layoutUrl();
+	if(!url) return;
+	loadTiles(url.replace(/\/layout$/, '/tiles'));
+	fetch(url)
+		.then(resp => resp.json())
+		.then(data => {
+			if(!data.success) throw new Error(data.error);
+			rooms = data.rooms.map(room => ({
+				id: 'r' + roomCounter++,
+				name: room.name,
+				x: room.x,
+				y: room.y,
+				width: room.width,
+				height: room.height
+			}));
+			renderAll();
+			let text = `${rooms.length} Räume geladen`;
+			if(data.unplaced.length) {
+				text += `, ohne Layout: ${data.unplaced.map(room => room.name).join(', ')}`;
+			}
+			setLayoutStatus(text, false);
+			loadOccupancy();
+		})
+		.catch(err => setLayoutStatus('Fehler beim Laden: ' + err.message, true));
+}
+function saveLayout() {
+	const url = layoutUrl();
+	if(!url) return;
+	const body = {
+		rooms: rooms.map(room => ({
+			name: room.name,
+			x: Math.round(room.x),
+			y: Math.round(room.y),
+			width: Math.round(room.width),
+			height: Math.round(room.height)
+		})),
+		create_missing: createMissingCheckbox.checked
+	};
+	fetch(url, {
+		method: 'PUT',
+		headers: {'Content-Type': 'application/json'},
+		body: JSON.stringify(body)
+	})
+		.then(resp => resp.json())
+		.then(data => {
+			if(!data.success) throw new Error((data.errors || [data.error]).join('; '));
+			let text = `${data.saved} Räume gespeichert`;
+			if(data.created_rooms.length) text += `, neu angelegt: ${data.created_rooms.join(', ')}`;
+			setLayoutStatus(text, false);
+		})
+		.catch(err => setLayoutStatus('Fehler beim Speichern: ' + err.message, true));
+}
+
+// Überschneidungen mit gespeicherten Räumen prüft der Server über den R*Tree
+function checkOverlap(rect) {
+	if(!buildingSelect.value || floorInput.value === '') return;
+	const url = layoutUrl();
+	const params = new URLSearchParams({
+		x: Math.round(rect.x),
+		y: Math.round(rect.y),
+		width: Math.round(rect.width),
+		height: Math.round(rect.height)
+	});
+	fetch(url.replace(/\/layout$/, '/rooms/overlap?') + params)
+		.then(resp => resp.json())
+		.then(data => {
+			if(!data.success) throw new Error(data.error);
+			if(data.rooms.length) {
+				setLayoutStatus(`Überschneidet sich mit: ${data.rooms.map(room => room.name).join(', ')}`, true);
+			}
+		})
+		.catch(err => setLayoutStatus('Fehler bei der Überschneidungsprüfung: ' + err.message, true));
+}
+
+// Belegung der Räume als Einfärbung; der Server rechnet die ganze Etage
+// in einer Abfrage und cacht sie bis zur nächsten Änderung
+const occupancySelect = document.getElementById('occupancy-select');
+let occupancyByName = null;
+let occupancyMax = null;
+
+function applyOccupancy(el, room) {
+	const field = occupancySelect.value;
+	const entry = occupancyByName && occupancyByName.get(room.name);
+	if(!field || !entry) return;
+	const max = occupancyMax[field] || 1;
+	const share = entry[field] / max;
+	el.style.backgroundColor = `rgba(220, 40, 40, ${(0.05 + 0.6 * share).toFixed(2)})`;
+	el.title = `${entry.person_count} Personen, ${entry.item_count} Inventar (${entry.item_value.toFixed(2)} €), ${entry.transponder_count} aktive Transponder`;
+}
+function loadOccupancy() {
+	if(!occupancySelect.value || !buildingSelect.value || floorInput.value === '') {
+		occupancyByName = null;
+		renderAll();
+		return;
+	}
+	fetch(layoutUrl().replace(/\/layout$/, '/occupancy'))
+		.then(resp => resp.json())
+		.then(data => {
+			if(!data.success) throw new Error(data.error);
+			occupancyByName = new Map(data.rooms.map(room => [room.name, room]));
+			occupancyMax = data.max;
+			renderAll();
+		})
+		.catch(err => setLayoutStatus('Fehler beim Laden der Belegung: ' + err.message, true));
+}
+
+// Gekachelter Etagenplan: nur die Kacheln im sichtbaren Ausschnitt der
+// gewählten Zoomstufe werden geladen. Ohne Kacheln bleibt das Einzelbild.
+const floorplanImg = document.getElementById('floorplan');
+const tilesLayer = document.getElementById('tiles');
+const zoomSelect = document.getElementById('zoom-select');
+let tileManifest = null;
+let tileLevel = null;
+let tileFrame = null;
+const loadedTiles = new Map();
+
+function showFloorplanImage() {
+	tileManifest = null;
+	tileLevel = null;
+	loadedTiles.clear();
+	tilesLayer.innerHTML = '';
+	zoomSelect.hidden = true;
+	container.classList.remove('tiled');
+	// Das Einzelbild wird erst hier geladen, damit es bei vorhandenen
+	// Kacheln gar nicht erst übertragen wird
+	if(!floorplanImg.getAttribute('src')) floorplanImg.src = floorplanImg.dataset.src;
+	floorplanImg.hidden = false;
+	setViewScale(1);
+}
+function setViewScale(scale) {
+	viewScale = scale;
+	document.getElementById('overlay').style.transform = scale === 1 ? '' : `scale(${scale})`;
+}
+function loadTiles(url) {
+	fetch(url)
+		.then(resp => resp.json())
+		.then(data => {
+			if(!data.success) {
+				showFloorplanImage();
+				return;
+			}
+			tileManifest = data;
+			floorplanImg.hidden = true;
+			container.classList.add('tiled');
+			zoomSelect.innerHTML = '';
+			data.levels.slice().reverse().forEach(level => {
+				const option = createElement('option', null, zoomSelect);
+				option.value = level.zoom;
+				option.textContent = Math.round(100 * level.width / data.width) + ' %';
+			});
+			zoomSelect.hidden = false;
+			setTileZoom(data.max_zoom);
+		})
+		.catch(() => showFloorplanImage());
+}
+function setTileZoom(zoom) {
+	const level = tileManifest.levels.find(l => l.zoom === zoom);
+	if(!level) return;
+	// Mittelpunkt des Ausschnitts beim Zoomen beibehalten
+	const centerX = (container.scrollLeft + container.clientWidth / 2) / viewScale;
+	const centerY = (container.scrollTop + container.clientHeight / 2) / viewScale;
+	tileLevel = level;
+	zoomSelect.value = zoom;
+	loadedTiles.clear();
+	tilesLayer.innerHTML = '';
+	tilesLayer.style.width = level.width + 'px';
+	tilesLayer.style.height = level.height + 'px';
+	setViewScale(level.width / tileManifest.width);
+	container.scrollLeft = centerX * viewScale - container.clientWidth / 2;
+	container.scrollTop = centerY * viewScale - container.clientHeight / 2;
+	renderVisibleTiles();
+}
+function renderVisibleTiles() {
+	tileFrame = null;
+	if(!tileLevel) return;
+	const size = tileManifest.tile_size;
+	const firstCol = Math.max(0, Math.floor(container.scrollLeft / size));
+	const lastCol = Math.min(tileLevel.cols - 1, Math.floor((container.scrollLeft + container.clientWidth - 1) / size));
+	const firstRow = Math.max(0, Math.floor(container.scrollTop / size));
+	const lastRow = Math.min(tileLevel.rows - 1, Math.floor((container.scrollTop + container.clientHeight - 1) / size));
+	const wanted = new Set();
+	for(let x = firstCol; x <= lastCol; x++) {
+		for(let y = firstRow; y <= lastRow; y++) {
+			const key = x + '_' + y;
+			wanted.add(key);
+			if(loadedTiles.has(key)) continue;
+			const img = createElement('img', null, tilesLayer);
+			img.style.left = (x * size) + 'px';
+			img.style.top = (y * size) + 'px';
+			img.alt = '';
+			img.src = tileManifest.tile_url.replace('{z}', tileLevel.zoom).replace('{x}', x).replace('{y}', y);
+			loadedTiles.set(key, img);
+		}
+	}
+	// Kacheln außerhalb des Ausschnitts freigeben; der Browser-Cache hält sie
+	loadedTiles.forEach((img, key) => {
+		if(!wanted.has(key)) {
+			img.remove();
+			loadedTiles.delete(key);
+		}
+	});
+}
+function scheduleTileRender() {
+	if(tileLevel && tileFrame === null) tileFrame = requestAnimationFrame(renderVisibleTiles);
+}
+
+container.addEventListener('scroll', scheduleTileRender);
+window.addEventListener('resize', scheduleTileRender);
+occupancySelect.addEventListener('change', loadOccupancy);
+zoomSelect.addEventListener('change', () => setTileZoom(parseInt(zoomSelect.value, 10)));
+loadLayoutBtn.addEventListener('click', loadLayout);
+saveLayoutBtn.addEventListener('click', saveLayout);
 drawRoomBtn.addEventListener('click', startDrawRoom);
 drawSnapzoneBtn.addEventListener('click', startDrawSnapzone);
 cancelDrawBtn.addEventListener('click', cancelDraw);
 renderAll();
+if(buildingSelect.value && floorInput.value !== '') {
+	loadLayout();
+} else {
+	showFloorplanImage();
+}
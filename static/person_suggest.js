@@ -0,0 +1,117 @@
+// Autovervollständigung für Personenfelder.
+//
+// Verwendung:
+//   <input type="hidden" name="owner_id" value="">
+//   <input type="text" data-person-suggest="owner_id" value="">
+//
+// Das Textfeld fragt /api/persons/suggest ab, die gewählte ID landet im
+// versteckten Feld mit dem angegebenen Namen im selben Formular.
+
+(function () {
+	const SUGGEST_URL = "/api/persons/suggest";
+	const DEBOUNCE_MS = 150;
+
+	function initPersonSuggest(input) {
+		const form = input.form || document;
+		const hidden = form.querySelector(`input[type="hidden"][name="${input.dataset.personSuggest}"]`);
+		if (!hidden) {
+			console.warn("Kein verstecktes Feld für", input.dataset.personSuggest);
+			return;
+		}
+
+		input.setAttribute("autocomplete", "off");
+
+		const wrapper = document.createElement("div");
+		wrapper.className = "person-suggest-wrapper";
+		input.parentNode.insertBefore(wrapper, input);
+		wrapper.appendChild(input);
+
+		const list = document.createElement("ul");
+		list.className = "person-suggest-list";
+		list.hidden = true;
+		wrapper.appendChild(list);
+
+		let timer = null;
+		let activeIndex = -1;
+		let items = [];
+		let requestCounter = 0;
+
+		function close() {
+			list.hidden = true;
+			activeIndex = -1;
+		}
+
+		function choose(item) {
+			hidden.value = item.id;
+			input.value = item.label;
+			hidden.dispatchEvent(new Event("change", { bubbles: true }));
+			close();
+		}
+
+		function render() {
+			list.innerHTML = "";
+			items.forEach((item, i) => {
+				const li = document.createElement("li");
+				li.textContent = `${item.label} (${item.id})`;
+				if (i === activeIndex) li.className = "active";
+				li.addEventListener("mousedown", e => {
+					e.preventDefault();
+					choose(item);
+				});
+				list.appendChild(li);
+			});
+			list.hidden = items.length === 0;
+		}
+
+		function fetchSuggestions() {
+			const q = input.value.trim();
+			if (!q) {
+				items = [];
+				render();
+				return;
+			}
+			const current = ++requestCounter;
+			fetch(`${SUGGEST_URL}?q=${encodeURIComponent(q)}`)
+				.then(resp => resp.json())
+				.then(data => {
+					if (current !== requestCounter) return;
+					items = Array.isArray(data) ? data : [];
+					activeIndex = items.length ? 0 : -1;
+					render();
+				})
+				.catch(err => console.error("Fehler bei der Personensuche:", err));
+		}
+
+		input.addEventListener("input", () => {
+			hidden.value = "";
+			clearTimeout(timer);
+			timer = setTimeout(fetchSuggestions, DEBOUNCE_MS);
+		});
+
+		input.addEventListener("keydown", e => {
+			if (list.hidden) return;
+			if (e.key === "ArrowDown") {
+				activeIndex = Math.min(items.length - 1, activeIndex + 1);
+				render();
+				e.preventDefault();
+			} else if (e.key === "ArrowUp") {
+				activeIndex = Math.max(0, activeIndex - 1);
+				render();
+				e.preventDefault();
+			} else if (e.key === "Enter" && activeIndex >= 0) {
+				choose(items[activeIndex]);
+				e.preventDefault();
+			} else if (e.key === "Escape") {
+				close();
+			}
+		});
+
+		input.addEventListener("blur", close);
+	}
+
+	window.initPersonSuggest = initPersonSuggest;
+
+	document.addEventListener("DOMContentLoaded", () => {
+		document.querySelectorAll("input[data-person-suggest]").forEach(initPersonSuggest);
+	});
+})();
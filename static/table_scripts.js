@@ -73,20 +73,33 @@ $(document).ready(function() {
 	checkNewEntryInputs();
 });
 
-// Bestehender Update-Code für vorhandene Einträge (unverändert)
-$(".cell-input").filter(function() {
-	return $(this).closest(".new-entry").length === 0;
-}).on("change", function() {
+// Update für vorhandene Einträge; data-version der Zeile dient dem
+// optimistischen Sperren und wird nach jedem Speichern fortgeschrieben
+// (delegiert, damit auch live eingefügte oder ersetzte Zeilen funktionieren)
+$(".edit-table").on("change", "tr[data-id] .cell-input", function() {
+	const $row = $(this).closest("tr");
 	const name = $(this).attr("name");
 	const value = $(this).val();
-	$.post("/update/{{ table_name }}", { name, value }, function(resp) {
+	const data = { name, value };
+	if ($row.attr("data-version") !== undefined) {
+		data.version = $row.attr("data-version");
+	}
+	$.post("/update/{{ table_name }}", data, function(resp) {
 		if (!resp.success) {
 			toastr.error("Fehler beim Updaten: " + resp.error);
 		} else {
+			if (resp.version !== undefined && resp.version !== null) {
+				$row.attr("data-version", resp.version);
+			}
 			toastr.success("Eintrag geupdatet");
 		}
-	}, "json").fail(function() {
-		toastr.error("Netzwerkfehler beim Updaten");
+	}, "json").fail(function(xhr) {
+		const resp = xhr.responseJSON;
+		if (resp && resp.error) {
+			toastr.error("Fehler beim Updaten: " + resp.error);
+		} else {
+			toastr.error("Netzwerkfehler beim Updaten");
+		}
 	});
 });
 
@@ -101,7 +114,14 @@ $(".save-new").on("click", function() {
 			toastr.error("Fehler beim Speichern: " + resp.error);
 		} else {
 			toastr.success("Eintrag gespeichert");
-			location.reload();
+			if (feedConnected) {
+				// Die neue Zeile kommt über den Live-Feed
+				$(".new-entry input").val("");
+				$(".new-entry select").prop("selectedIndex", 0);
+				checkNewEntryInputs();
+			} else {
+				location.reload();
+			}
 		}
 	}, "json").fail(function() {
 		toastr.error("Netzwerkfehler beim Speichern");
@@ -109,7 +129,7 @@ $(".save-new").on("click", function() {
 });
 
 // Löschen Eintrag
-$(".delete-entry").on("click", function() {
+$(".edit-table").on("click", ".delete-entry", function() {
 	const $row = $(this).closest("tr");
 	const id = $row.data("id");
 
@@ -139,3 +159,70 @@ $(".delete-entry").on("click", function() {
 		toastr.error("Netzwerkfehler beim Löschen");
 	});
 });
+
+// Live-Feed: Änderungen anderer Benutzer (und eigene) werden zeilenweise
+// eingespielt, ohne die Seite neu zu laden
+let feedConnected = false;
+
+function applyTableChange(change) {
+	const $body = $(".edit-table tbody");
+	const seen = new Set();
+
+	change.rows.forEach(function(row) {
+		seen.add(String(row.id));
+		let $row = $body.find(`tr[data-id="${row.id}"]`);
+		let skippedFocused = false;
+
+		if ($row.length === 0) {
+			$row = $("<tr>").attr("data-id", row.id);
+			row.cells.forEach(function(cell) {
+				$("<td>").html(cell).appendTo($row);
+			});
+			$("<td>").append('<button class="delete-entry" title="Eintrag löschen">Löschen</button>').appendTo($row);
+			$row.insertBefore($body.find("tr.new-entry"));
+		} else {
+			$row.children("td").each(function(i) {
+				if (i >= row.cells.length) {
+					return;
+				}
+				// Feld, in dem gerade getippt wird, nicht überschreiben
+				if ($.contains(this, document.activeElement)) {
+					skippedFocused = true;
+					return;
+				}
+				$(this).html(row.cells[i]);
+			});
+		}
+
+		// Bei übersprungenem Feld die alte Version behalten, damit eine
+		// Eingabe dort als Konflikt erkannt wird statt still zu überschreiben
+		if (row.version !== null && row.version !== undefined && !skippedFocused) {
+			$row.attr("data-version", row.version);
+		}
+	});
+
+	(change.deleted || []).forEach(function(id) {
+		$body.find(`tr[data-id="${id}"]`).remove();
+	});
+
+	if (change.complete) {
+		$body.find("tr[data-id]").each(function() {
+			if (!seen.has(String($(this).attr("data-id")))) {
+				$(this).remove();
+			}
+		});
+	}
+}
+
+if (window.EventSource && $(".edit-table").length) {
+	const feed = new EventSource("/table/{{ table_name }}/events");
+	feed.onopen = function() {
+		feedConnected = true;
+	};
+	feed.onerror = function() {
+		feedConnected = false;
+	};
+	feed.addEventListener("change", function(e) {
+		applyTableChange(JSON.parse(e.data));
+	});
+}
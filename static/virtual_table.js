@@ -0,0 +1,132 @@
+// Virtuelles Scrollen für große Aggregat-Tabellen.
+//
+// Im DOM stehen nur die gerade sichtbaren Zeilen (plus Puffer), der Rest
+// wird durch zwei Platzhalterzeilen ersetzt. Weitere Zeilen werden in
+// Blöcken von data-rows-url nachgeladen, sobald sie in Sichtweite kommen.
+
+function initVirtualTable(wrapper, options) {
+	const tbody = wrapper.querySelector("tbody");
+	const rowsUrl = wrapper.dataset.rowsUrl;
+	const chunkSize = parseInt(wrapper.dataset.chunkSize, 10) || 100;
+	const columnCount = options.columnCount;
+	const htmlColumns = new Set(options.htmlColumns || []);
+	const BUFFER_ROWS = 20;
+
+	let total = parseInt(wrapper.dataset.total, 10) || 0;
+	let rowHeight = 0;
+	let renderedRange = null;
+	let scheduled = false;
+
+	const chunks = new Map();   // Blocknummer -> Zeilen
+	const pending = new Set();  // Blocknummern, die gerade geladen werden
+
+	chunks.set(0, options.initialRows || []);
+
+	function spacer(height) {
+		const tr = document.createElement("tr");
+		tr.className = "virtual-spacer";
+		const td = document.createElement("td");
+		td.colSpan = columnCount;
+		td.style.height = height + "px";
+		td.style.padding = "0";
+		td.style.border = "none";
+		tr.appendChild(td);
+		return tr;
+	}
+
+	function buildRow(cells) {
+		const tr = document.createElement("tr");
+		cells.forEach((cell, i) => {
+			const td = document.createElement("td");
+			if (htmlColumns.has(i)) {
+				td.innerHTML = cell;
+			} else {
+				td.textContent = cell;
+			}
+			tr.appendChild(td);
+		});
+		return tr;
+	}
+
+	function placeholderRow() {
+		const tr = document.createElement("tr");
+		tr.className = "virtual-loading";
+		const td = document.createElement("td");
+		td.colSpan = columnCount;
+		td.textContent = "…";
+		tr.appendChild(td);
+		return tr;
+	}
+
+	function getRow(index) {
+		const chunk = chunks.get(Math.floor(index / chunkSize));
+		return chunk ? chunk[index % chunkSize] : undefined;
+	}
+
+	function loadChunk(chunkIndex) {
+		if (chunks.has(chunkIndex) || pending.has(chunkIndex)) return;
+		pending.add(chunkIndex);
+		const separator = rowsUrl.includes("?") ? "&" : "?";
+		fetch(`${rowsUrl}${separator}offset=${chunkIndex * chunkSize}&limit=${chunkSize}`)
+			.then(resp => resp.json())
+			.then(data => {
+				if (!data.success) throw new Error(data.error);
+				chunks.set(chunkIndex, data.rows);
+				total = data.total;
+				renderedRange = null;
+				scheduleRender();
+			})
+			.catch(err => console.error("Fehler beim Nachladen der Zeilen:", err))
+			.finally(() => pending.delete(chunkIndex));
+	}
+
+	function measureRowHeight() {
+		const probe = buildRow(getRow(0) || new Array(columnCount).fill("-"));
+		tbody.appendChild(probe);
+		rowHeight = probe.getBoundingClientRect().height || 40;
+		tbody.removeChild(probe);
+	}
+
+	function render() {
+		scheduled = false;
+		if (!rowHeight) measureRowHeight();
+
+		const headerHeight = wrapper.querySelector("thead").getBoundingClientRect().height;
+		const scrollTop = Math.max(0, wrapper.scrollTop - headerHeight);
+		const visibleCount = Math.ceil(wrapper.clientHeight / rowHeight);
+		const start = Math.max(0, Math.floor(scrollTop / rowHeight) - BUFFER_ROWS);
+		const end = Math.min(total, start + visibleCount + 2 * BUFFER_ROWS);
+
+		if (renderedRange && renderedRange[0] === start && renderedRange[1] === end) return;
+		renderedRange = [start, end];
+
+		for (let c = Math.floor(start / chunkSize); c <= Math.floor(Math.max(start, end - 1) / chunkSize); c++) {
+			loadChunk(c);
+		}
+
+		const fragment = document.createDocumentFragment();
+		fragment.appendChild(spacer(start * rowHeight));
+		for (let i = start; i < end; i++) {
+			const cells = getRow(i);
+			fragment.appendChild(cells ? buildRow(cells) : placeholderRow());
+		}
+		fragment.appendChild(spacer((total - end) * rowHeight));
+
+		tbody.replaceChildren(fragment);
+	}
+
+	function scheduleRender() {
+		if (scheduled) return;
+		scheduled = true;
+		requestAnimationFrame(render);
+	}
+
+	wrapper.addEventListener("scroll", scheduleRender, { passive: true });
+	window.addEventListener("resize", () => {
+		rowHeight = 0;
+		renderedRange = null;
+		scheduleRender();
+	});
+
+	render();
+}
@@ -0,0 +1,260 @@
+import datetime
+from collections import Counter
+from typing import Optional, Dict, Any, Callable, List, Tuple
+from sqlalchemy import select, insert, Integer, Float, Date, DateTime, UniqueConstraint
+from sqlalchemy import inspect as sa_inspect
+
+# Wizard-Definitionen werden beim Start einmal kompiliert: ein JSON-sicheres
+# Schema für das Template und pro Feld eine Konvertierungsfunktion sowie das
+# Zielmodell von Fremdschlüsseln für die gebündelte Existenzprüfung.
+
+WIZARD_MAX_PASTE_ROWS = 500
+
+class WizardValidationError(ValueError):
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+def _parse_date(value: str) -> datetime.date:
+    value = value.strip()
+    if "." in value:
+        return datetime.datetime.strptime(value, "%d.%m.%Y").date()
+    return datetime.date.fromisoformat(value)
+
+def column_converter(column) -> Callable[[str], Any]:
+    """Wandelt Formulareingaben passend zum Spaltentyp um."""
+    col_type = column.type
+    if isinstance(col_type, Integer):
+        return int
+    if isinstance(col_type, Float):
+        return lambda v: float(v.replace(",", "."))
+    if isinstance(col_type, DateTime):
+        return datetime.datetime.fromisoformat
+    if isinstance(col_type, Date):
+        return _parse_date
+    return str
+
+def _model_for_table(mapper, table):
+    for m in mapper.registry.mappers:
+        if m.local_table is table:
+            return m.class_
+    return None
+
+class CompiledField:
+    __slots__ = ("name", "label", "required", "convert", "fk_model")
+
+    def __init__(self, model, field: Dict[str, Any]):
+        mapper = sa_inspect(model)
+        if field["name"] not in mapper.columns:
+            raise ValueError(f"{model.__name__} hat keine Spalte {field['name']}")
+        column = mapper.columns[field["name"]]
+        self.name = field["name"]
+        self.label = field.get("label", field["name"])
+        self.required = bool(field.get("required"))
+        self.convert = column_converter(column)
+        fk = next(iter(column.foreign_keys), None)
+        self.fk_model = _model_for_table(mapper, fk.column.table) if fk is not None else None
+
+class CompiledForm:
+    def __init__(self, model, fields: List[Dict[str, Any]], foreign_key: Optional[str] = None):
+        self.model = model
+        self.foreign_key = foreign_key
+        self.fields = [CompiledField(model, f) for f in fields]
+        self.fields_by_name = {f.name: f for f in self.fields}
+
+        # Einspaltige Unique-Constraints auf Wizard-Feldern werden vorab geprüft
+        self.unique_fields = []
+        for constraint in model.__table__.constraints:
+            if isinstance(constraint, UniqueConstraint) and len(constraint.columns) == 1:
+                name = list(constraint.columns)[0].name
+                if name in self.fields_by_name:
+                    self.unique_fields.append(name)
+
+    def convert(self, raw: Dict[str, Optional[str]], where: str, errors: List[str]) -> Dict[str, Any]:
+        values = {}
+        for field in self.fields:
+            value = raw.get(field.name)
+            value = value.strip() if isinstance(value, str) else value
+            if value in (None, ""):
+                if field.required:
+                    errors.append(f"{where}: {field.label} fehlt")
+                values[field.name] = None
+                continue
+            try:
+                values[field.name] = field.convert(value)
+            except (TypeError, ValueError):
+                errors.append(f"{where}: ungültiger Wert für {field.label}: {value}")
+                values[field.name] = None
+        return values
+
+class CompiledWizard:
+    """
+    Eine Wizard-Definition mit Hauptformular, Unterformularen und optionalem
+    Einfügemodus ("paste_columns"), in dem jede Zeile eines Textfelds einen
+    eigenen Hauptdatensatz samt Unterformular-Zeilen erzeugt.
+    """
+
+    def __init__(self, name: str, config: Dict[str, Any]):
+        self.name = name
+        self.title = config["title"]
+        self.main = CompiledForm(config["model"], config["fields"])
+        self.subforms = {
+            sub["name"]: CompiledForm(sub["model"], sub["fields"], sub["foreign_key"])
+            for sub in config.get("subforms", [])
+        }
+        self.paste_columns = list(config.get("paste_columns", []))
+        for column in self.paste_columns:
+            sub_name, _, field_name = column.rpartition(".")
+            form = self.subforms.get(sub_name) if sub_name else self.main
+            if form is None or field_name not in form.fields_by_name:
+                raise ValueError(f"Wizard {name}: unbekannte Einfügespalte {column}")
+
+        self.schema = {
+            "title": self.title,
+            "fields": [dict(f) for f in config["fields"]],
+            "subforms": [
+                {"name": sub["name"], "label": sub["label"], "fields": [dict(f) for f in sub["fields"]]}
+                for sub in config.get("subforms", [])
+            ],
+            "paste_columns": [
+                {"name": column, "label": self._column_label(column)} for column in self.paste_columns
+            ],
+        }
+
+    def _column_label(self, column: str) -> str:
+        sub_name, _, field_name = column.rpartition(".")
+        form = self.subforms[sub_name] if sub_name else self.main
+        return form.fields_by_name[field_name].label
+
+    # Eingaben einlesen
+
+    def _parse_subforms(self, form, errors: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        result = {}
+        for sub_name, sub in self.subforms.items():
+            lists = {f.name: form.getlist(f.name + "[]") for f in sub.fields}
+            count = max((len(v) for v in lists.values()), default=0)
+            rows = []
+            for i in range(count):
+                raw = {name: values[i] if i < len(values) else None for name, values in lists.items()}
+                if not any((v or "").strip() for v in raw.values()):
+                    continue
+                rows.append(sub.convert(raw, f"Unterformular {sub_name}, Eintrag {i + 1}", errors))
+            result[sub_name] = rows
+        return result
+
+    def _parse_paste(self, text: str, common: Dict[str, Optional[str]], errors: List[str]) -> List[Tuple[Dict[str, Any], Dict[str, List[Dict[str, Any]]]]]:
+        entries = []
+        lines = [(n, line) for n, line in enumerate(text.splitlines(), start=1) if line.strip() and not line.lstrip().startswith("#")]
+        if len(lines) > WIZARD_MAX_PASTE_ROWS:
+            raise WizardValidationError([f"Maximal {WIZARD_MAX_PASTE_ROWS} Zeilen pro Einfügen"])
+
+        for line_no, line in lines:
+            cells = [c.strip() for c in (line.split("\t") if "\t" in line else line.split(";"))]
+            where = f"Zeile {line_no}"
+            if len(cells) > len(self.paste_columns):
+                errors.append(f"{where}: zu viele Spalten ({len(cells)} statt {len(self.paste_columns)})")
+                continue
+
+            raw_main = dict(common)
+            raw_subs: Dict[str, List[str]] = {}
+            for column, cell in zip(self.paste_columns, cells):
+                sub_name, _, field_name = column.rpartition(".")
+                if sub_name:
+                    # Mehrere Werte je Zelle, z.B. "12, 13 14"
+                    raw_subs[column] = [v for v in cell.replace(",", " ").split() if v]
+                elif cell:
+                    raw_main[field_name] = cell
+
+            main_values = self.main.convert(raw_main, where, errors)
+            sub_values = {name: [] for name in self.subforms}
+            for column, values in raw_subs.items():
+                sub_name, _, field_name = column.rpartition(".")
+                for value in values:
+                    sub_values[sub_name].append(self.subforms[sub_name].convert({field_name: value}, where, errors))
+            entries.append((main_values, sub_values))
+        return entries
+
+    def parse(self, form) -> List[Tuple[Dict[str, Any], Dict[str, List[Dict[str, Any]]]]]:
+        """Liest das Formular in eine Liste von (Hauptwerte, {Unterformular: [Zeilen]})."""
+        errors: List[str] = []
+        common = {f.name: form.get(f.name) for f in self.main.fields}
+        paste_text = (form.get("paste_rows") or "").strip()
+
+        if paste_text and self.paste_columns:
+            entries = self._parse_paste(paste_text, common, errors)
+            if not entries and not errors:
+                errors.append("Keine Zeilen zum Einfügen gefunden")
+        else:
+            entries = [(self.main.convert(common, "Formular", errors), self._parse_subforms(form, errors))]
+
+        if errors:
+            raise WizardValidationError(errors)
+        return entries
+
+    # Prüfen und speichern
+
+    def validate(self, session, entries) -> None:
+        """Prüft alle Fremdschlüssel mit einer IN-Abfrage pro Zieltabelle sowie Unique-Felder."""
+        errors: List[str] = []
+        wanted: Dict[Any, set] = {}
+        forms = [(self.main, [main for main, _ in entries])]
+        for sub_name, sub in self.subforms.items():
+            forms.append((sub, [row for _, subs in entries for row in subs.get(sub_name, [])]))
+
+        for form, rows in forms:
+            for field in form.fields:
+                if field.fk_model is None:
+                    continue
+                ids = {row[field.name] for row in rows if row.get(field.name) is not None}
+                if ids:
+                    wanted.setdefault(field.fk_model, set()).update(ids)
+
+        existing: Dict[Any, set] = {}
+        for model, ids in wanted.items():
+            existing[model] = set(session.execute(select(model.id).where(model.id.in_(ids))).scalars())
+
+        for form, rows in forms:
+            for field in form.fields:
+                if field.fk_model is None:
+                    continue
+                ids = {row[field.name] for row in rows if row.get(field.name) is not None}
+                for value in sorted(ids - existing.get(field.fk_model, set())):
+                    errors.append(f"{field.label}: ID {value} existiert nicht")
+
+        main_rows = [main for main, _ in entries]
+        for name in self.main.unique_fields:
+            values = [row[name] for row in main_rows if row.get(name) is not None]
+            counts = Counter(values)
+            for value in sorted((v for v, n in counts.items() if n > 1), key=str):
+                errors.append(f"{self.main.fields_by_name[name].label} {value} kommt mehrfach vor")
+            if values:
+                column = getattr(self.main.model, name)
+                taken = session.execute(select(column).where(column.in_(set(values)))).scalars().all()
+                for value in sorted(taken, key=str):
+                    errors.append(f"{self.main.fields_by_name[name].label} {value} existiert bereits")
+
+        if errors:
+            raise WizardValidationError(errors)
+
+    def persist(self, session, entries) -> List[Any]:
+        """
+        Legt alle Hauptdatensätze mit add_all an (deren IDs werden gebraucht)
+        und die Unterformular-Zeilen anschließend mit einem gebündelten INSERT
+        pro Unterformular.
+        """
+        mains = [self.main.model(**main) for main, _ in entries]
+        session.add_all(mains)
+        session.flush()
+
+        for sub_name, sub in self.subforms.items():
+            rows = []
+            for instance, (_, subs) in zip(mains, entries):
+                # Doppelte Zeilen (z.B. derselbe Raum zweimal) nur einmal anlegen
+                for row in dict.fromkeys(tuple(sorted(r.items())) for r in subs.get(sub_name, [])):
+                    rows.append({**dict(row), sub.foreign_key: instance.id})
+            if rows:
+                session.execute(insert(sub.model), rows)
+        return mains
+
+def compile_wizards(configs: Dict[str, Dict[str, Any]]) -> Dict[str, CompiledWizard]:
+    return {name: CompiledWizard(name, config) for name, config in configs.items()}
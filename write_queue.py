@@ -0,0 +1,191 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Optional, Any, Callable, List, Tuple
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from change_tracking import PENDING_KEY
+
+# Alle Schreibzugriffe eines Prozesses laufen über einen einzigen
+# Schreib-Thread. Er sammelt wartende Schreibeinheiten und schreibt sie in
+# kleinen Gruppen: jede Einheit bekommt einen eigenen SAVEPOINT, die Gruppe
+# einen gemeinsamen Commit. So zahlt nicht jeder Request sein eigenes
+# fsync, und Threads desselben Prozesses warten nicht mehr gegenseitig auf
+# die Schreibsperre von SQLite.
+
+# Eine Schreibeinheit erhält die Session des Schreib-Threads und führt ihre
+# Änderungen ohne eigenen Commit aus. Sie sollte einfache Werte statt
+# ORM-Objekten zurückgeben, da die Session danach weiterverwendet wird.
+# Code, der selbst committet oder zurückrollt (z.B. die Handler aus
+# db_interface), läuft als exklusive Einheit allein in ihrer Transaktion.
+WriteUnit = Callable[..., Any]
+QueuedUnit = Tuple[Future, WriteUnit, tuple, dict, bool]
+
+class WriteCoordinator:
+    """
+    Ein Schreib-Thread pro Datenbank.
+
+    submit() reiht eine Einheit ein und liefert ein Future mit ihrem
+    Ergebnis oder ihrer Exception; run() wartet direkt darauf. Schlägt eine
+    Einheit fehl, wird nur ihr SAVEPOINT zurückgerollt. Schlägt der Commit
+    der Gruppe fehl, werden die Einheiten einzeln wiederholt.
+    submit_exclusive()/run_exclusive() führen eine Einheit ohne Gruppe und
+    ohne SAVEPOINT aus; sie darf selbst committen.
+    """
+
+    def __init__(self, url: str, max_batch: int = 50, max_wait: float = 0.002, busy_timeout: float = 30.0):
+        # Eigene Engine für den Schreib-Thread: pysqlite beginnt Transaktionen
+        # sonst erst beim ersten DML und verträgt sich nicht mit SAVEPOINT.
+        # BEGIN IMMEDIATE holt die Schreibsperre gleich zu Beginn, sodass
+        # andere Prozesse über busy_timeout warten statt in Deadlocks zu laufen.
+        self.engine = create_engine(url, connect_args={"timeout": busy_timeout, "check_same_thread": False})
+        event.listen(self.engine, "connect", self._on_connect)
+        event.listen(self.engine, "begin", self._on_begin)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Optional[QueuedUnit]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @staticmethod
+    def _on_begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _enqueue(self, unit: WriteUnit, args: tuple, kwargs: dict, exclusive: bool) -> Future:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Schreibeinheiten dürfen keine weiteren Einheiten einreihen")
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((future, unit, args, kwargs, exclusive))
+        return future
+
+    def submit(self, unit: WriteUnit, *args, **kwargs) -> Future:
+        return self._enqueue(unit, args, kwargs, False)
+
+    def run(self, unit: WriteUnit, *args, **kwargs) -> Any:
+        return self.submit(unit, *args, **kwargs).result()
+
+    def submit_exclusive(self, unit: WriteUnit, *args, **kwargs) -> Future:
+        return self._enqueue(unit, args, kwargs, True)
+
+    def run_exclusive(self, unit: WriteUnit, *args, **kwargs) -> Any:
+        return self.submit_exclusive(unit, *args, **kwargs).result()
+
+    def stop(self) -> None:
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            # Gruppen bis zur nächsten exklusiven Einheit, Reihenfolge bleibt erhalten
+            group: List[QueuedUnit] = []
+            for item in batch:
+                if not item[0].set_running_or_notify_cancel():
+                    continue
+                if item[4]:
+                    if group:
+                        self._process(group)
+                        group = []
+                    self._process_exclusive(item)
+                else:
+                    group.append(item)
+            if group:
+                self._process(group)
+            if stop:
+                return
+
+    def _process_exclusive(self, item: QueuedUnit) -> None:
+        future, unit, args, kwargs, _ = item
+        session = self.Session()
+        try:
+            result = unit(session, *args, **kwargs)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            future.set_exception(e)
+            return
+        finally:
+            session.close()
+        future.set_result(result)
+
+    def _process(self, units: List[QueuedUnit]) -> None:
+        outcomes = []
+        session = self.Session()
+        try:
+            for future, unit, args, kwargs, _ in units:
+                # session.info gilt pro Einheit (z.B. die Quelle der
+                # Besitzhistorie); nur die vorgemerkten Tabellenänderungen
+                # bleiben bis zum gemeinsamen Commit stehen
+                for key in [k for k in session.info if k != PENDING_KEY]:
+                    del session.info[key]
+                # Scheitert die Einheit, rollt nur ihr SAVEPOINT zurück; ihre
+                # vorgemerkten Änderungen dürfen dann nicht mitveröffentlicht werden
+                pending = session.info.get(PENDING_KEY)
+                snapshot = None if pending is None else {
+                    table: None if ids is None else set(ids) for table, ids in pending.items()
+                }
+                try:
+                    with session.begin_nested():
+                        result = unit(session, *args, **kwargs)
+                    outcomes.append((future, result, None))
+                except Exception as e:
+                    if snapshot is None:
+                        session.info.pop(PENDING_KEY, None)
+                    else:
+                        session.info[PENDING_KEY] = snapshot
+                    outcomes.append((future, None, e))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            session.close()
+            if len(units) > 1:
+                print(f"❌ Fehler beim gemeinsamen Commit von {len(units)} Schreibeinheiten, wiederhole einzeln: {e}")
+                for unit in units:
+                    self._process([unit])
+            else:
+                units[0][0].set_exception(e)
+            return
+        finally:
+            session.close()
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+WRITE_MAX_BATCH = int(os.environ.get("VERWALTUNG_WRITE_MAX_BATCH", 50))
+WRITE_MAX_WAIT = float(os.environ.get("VERWALTUNG_WRITE_MAX_WAIT_MS", 2)) / 1000